@@ -2,7 +2,6 @@ import sys
 sys.path.append('.')
 
 import os
-import glob
 import torch
 import numpy as np
 import pandas as pd
@@ -20,6 +19,7 @@ from iriscc.settings import (DATES_TEST,
                              CONFIG)
 from iriscc.transforms import DomainCrop
 from iriscc.plotutils import plot_map_contour
+from iriscc.samplestore import load_sample
 
 
 exp = str(sys.argv[1]) # ex : exp 1
@@ -73,8 +73,7 @@ for i, date in enumerate(dates):
     if date.month in [1,2,12]:
         i_winter.append(i)
     date_str = date.date().strftime('%Y%m%d')
-    sample = glob.glob(str(sample_dir/f'sample_{date_str}.npz'))[0]
-    data = dict(np.load(sample), allow_pickle=True)
+    data = load_sample(sample_dir, date_str)
     y_hat, y = data['y_hat'], data['y']
     condition = np.isnan(y)
     y_hat[condition] = np.nan
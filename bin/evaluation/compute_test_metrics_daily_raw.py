@@ -2,7 +2,6 @@ import sys
 sys.path.append('.')
 
 import os
-import glob
 import torch
 import numpy as np
 import pandas as pd
@@ -22,6 +21,7 @@ from iriscc.settings import (DATES_BC_TEST_HIST,
                              DATASET_BC_DIR,
                              CONFIG)
 from iriscc.transforms import DomainCrop
+from iriscc.samplestore import load_sample
 
 
 exp = str(sys.argv[1]) # ex : exp 1
@@ -79,8 +79,7 @@ for i, date in enumerate(dates):
     if date.month in [1,2,12]:
         i_winter.append(i)
     date_str = date.date().strftime('%Y%m%d')
-    sample = glob.glob(str(sample_dir/f'sample_{date_str}.npz'))[0]
-    data = dict(np.load(sample), allow_pickle=True)
+    data = load_sample(sample_dir, date_str)
     x, y = data['x'], data['y']
     y_hat = x[1] 
     condition = np.isnan(y[0])
@@ -27,6 +27,8 @@ from iriscc.settings import (CONFIG,
                              METRICS_DIR, 
                              DATASET_BC_DIR,
                              DATASET_DIR)
+from iriscc.samplestore import load_sample
+from iriscc.compilation import PRECISIONS, autocast_context, to_memory_format
 
 
 def get_config(exp: str, test_name: str, cmip6_test: Optional[str]) -> Tuple[Optional[IRISCCLightningModule], Optional[v2.Compose], str]:
@@ -89,16 +91,16 @@ def preprocess(year:int,
     for day in group['day']:
         date_str = f'{year}{month:02d}{day:02d}'
         print(date_str)
-        sample = glob.glob(str(sample_dir/f'sample_{date_str}.npz'))[0]
-        data = dict(np.load(sample), allow_pickle=True)
+        data = load_sample(sample_dir, date_str)
         x, y = data['x'], data['y']
         condition = np.isnan(y[0])
 
         if model: # unet, unet_cmip6, unet_cmip6_bc
             x, y = transforms((x, y))
-            x = torch.unsqueeze(x, dim=0).float()
-            y_hat = model(x.to(device)).to(device)
-            y_hat = y_hat.detach().cpu()
+            x = to_memory_format(torch.unsqueeze(x, dim=0).float(), channels_last)
+            with torch.no_grad(), context():
+                y_hat = model(x.to(device)).to(device)
+            y_hat = y_hat.detach().cpu().float()
 
             if exp == 'exp3':
                 unpad_func = UnPad(list(CONFIG['safran']['shape']['france_xy']))
@@ -129,6 +131,9 @@ if __name__=='__main__':
     parser.add_argument('--exp', type=str, help='Experiment name (e.g., exp1)')   
     parser.add_argument('--test-name', type=str, help='Test name (e.g., unet, baseline, cmip6_raw ...)')
     parser.add_argument('--cmip6-test', type=str, help='if predict (e.g., cmip6 or cmip6_bc)', default=None)
+    parser.add_argument('--precision', type=str, help='32 or bf16-mixed (bf16 autocast on CPU)', 
+                        choices=list(PRECISIONS), default='32')
+    parser.add_argument('--channels-last', action='store_true', help='channels_last memory format for the model and inputs')
     args = parser.parse_args()
 
     exp = args.exp
@@ -138,6 +143,9 @@ if __name__=='__main__':
 
     transforms = None
     model, transforms, sample_dir = get_config(exp, test_name, cmip6_test)
+    channels_last = args.channels_last
+    if model and channels_last:
+        model = model.to(memory_format=torch.channels_last)
 
     if cmip6_test:
         test_name = f'{test_name}_{cmip6_test}'
@@ -147,6 +155,7 @@ if __name__=='__main__':
     os.makedirs(metric_dir, exist_ok=True)
 
     device = 'cpu'
+    context = autocast_context(args.precision, device)
     rmse = MeanSquaredError(squared=False).to(device)
     corr = PearsonCorrCoef().to(device)
 
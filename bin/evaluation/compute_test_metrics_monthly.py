@@ -4,6 +4,7 @@ sys.path.append('.')
 import os
 import glob
 import torch
+import argparse
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
@@ -25,11 +26,23 @@ from iriscc.settings import (DATES_TEST,
                              DATASET_EXP4_30Y_DIR)
 from iriscc.transforms import UnPad
 from iriscc.plotutils import plot_map_contour
+from iriscc.samplestore import load_sample
+from iriscc.compilation import PRECISIONS, autocast_context, to_memory_format
 
-exp = str(sys.argv[1]) # ex : exp 1
-target = str(sys.argv[2]) # ex : eobs or safran
-test_name = str(sys.argv[3]) # ex : mask_continents
-cmip6_test = str(sys.argv[4]) # Perfect prognosis, no or cmip6, cmip6_bc
+parser = argparse.ArgumentParser(description="Compute monthly metrics for test period")
+parser.add_argument('exp', type=str, help='Experiment name (e.g., exp1)')
+parser.add_argument('target', type=str, help='eobs or safran')
+parser.add_argument('test_name', type=str, help='Test name (e.g., mask_continents)')
+parser.add_argument('cmip6_test', type=str, help='Perfect prognosis, no or cmip6, cmip6_bc')
+parser.add_argument('--precision', type=str, help='32 or bf16-mixed (bf16 autocast on CPU)', 
+                    choices=list(PRECISIONS), default='32')
+parser.add_argument('--channels-last', action='store_true', help='channels_last memory format for the model and inputs')
+args = parser.parse_args()
+
+exp = args.exp # ex : exp 1
+target = args.target # ex : eobs or safran
+test_name = args.test_name # ex : mask_continents
+cmip6_test = args.cmip6_test # Perfect prognosis, no or cmip6, cmip6_bc
 
 
 run_dir = RUNS_DIR/f'{exp}/{test_name}/lightning_logs/version_best'
@@ -57,6 +70,9 @@ transforms = v2.Compose([
             Pad(hparams['fill_value'])
             ])
 device = 'cpu'
+context = autocast_context(args.precision, device)
+if args.channels_last:
+    model = model.to(memory_format=torch.channels_last)
 sample_dir = hparams['sample_dir']
 pp = ''
 dates = DATES_TEST
@@ -107,16 +123,16 @@ for i, ((year, month), group) in enumerate(df_dates.groupby(['year', 'month'])):
     for day in group['day']:
         date_str = f'{year}{month:02d}{day:02d}'
         print(date_str)
-        sample = glob.glob(str(sample_dir/f'sample_{date_str}.npz'))[0]
-        data = dict(np.load(sample), allow_pickle=True)
+        data = load_sample(sample_dir, date_str)
         x, y = data['x'], data['y']
         condition_saf = np.isnan(y[0])
 
         x, y = transforms((x, y))
 
-        x = torch.unsqueeze(x, dim=0).float()
-        y_hat = model(x.to(device)).to(device)
-        y_hat = y_hat.detach().cpu()
+        x = to_memory_format(torch.unsqueeze(x, dim=0).float(), args.channels_last)
+        with torch.no_grad(), context():
+            y_hat = model(x.to(device)).to(device)
+        y_hat = y_hat.detach().cpu().float()
 
         if target == 'safran':
             unpad_func = UnPad(TARGET_SIZE)
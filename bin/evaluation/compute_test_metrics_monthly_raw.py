@@ -2,7 +2,6 @@ import sys
 sys.path.append('.')
 
 import os
-import glob
 import torch
 import numpy as np
 import pandas as pd
@@ -19,6 +18,7 @@ from iriscc.settings import (DATES_TEST,
                              DATASET_BC_DIR,
                              DATASET_EXP3_30Y_DIR,
                              DATASET_EXP4_30Y_DIR)
+from iriscc.samplestore import load_sample
 
 
 exp = str(sys.argv[1]) # ex : exp 1
@@ -89,8 +89,7 @@ for i, ((year, month), group) in enumerate(df_dates.groupby(['year', 'month'])):
     for day in group['day']:
         date_str = f'{year}{month:02d}{day:02d}'
         print(date_str)
-        sample = glob.glob(str(sample_dir/f'sample_{date_str}.npz'))[0]
-        data = dict(np.load(sample), allow_pickle=True)
+        data = load_sample(sample_dir, date_str)
         x, y = data['x'], data['y']
         y_hat = x[1] 
         condition = np.isnan(y[0])
@@ -1,21 +1,23 @@
-''' Data correction, evaluation and saving of the bias corrected dataset using IBICUS '''
+''' Data correction, evaluation and saving of the bias corrected dataset (iriscc or IBICUS debiasers) '''
 
 import sys
 sys.path.append('.')
 
 import xarray as xr
 import numpy as np
-import glob
-from datetime import datetime
+import argparse
 import matplotlib.pyplot as plt
 import pandas as pd
 from typing import Optional, List, Tuple
 from ibicus.evaluate import marginal, metrics, trend
 from ibicus.debias import CDFt
 
-
-from iriscc.datautils import remove_countries, reformat_as_target
-from iriscc.settings import (SAFRAN_REFORMAT_DIR, 
+from iriscc.biascorrection import DEBIASERS, QuantileDebiaser
+from iriscc.ncpool import open_dataset
+from iriscc.datautils import reformat_as_target, select_dates
+from iriscc.samplestore import load_period, save_static
+from iriscc.samplewriters import get_sample_writer
+from iriscc.settings import (SAFRAN_DAILY_FILE, 
                              GRAPHS_DIR,
                              DATASET_BC_CMIP6_ERA5,
                              ERA5_DIR,
@@ -25,31 +27,60 @@ from iriscc.settings import (SAFRAN_REFORMAT_DIR,
                              TARGET_SAFRAN_FILE,
                              DATES_BC_TEST_FUTURE,
                              DATES_BC_TEST_HIST,
-                             DATES_BC_TRAIN_HIST,
                              DATASET_BC_DIR,
                              TARGET)
 
-def target_data(date):
-    ''' Returns target data as an array of shape (H, W) '''
-
-    threshold_date = datetime(date.year, 8, 1)
-    year = date.year
-    if date < threshold_date : 
-        year = year-1
-    ds = xr.open_dataset(glob.glob(str(SAFRAN_REFORMAT_DIR/f"SAFRAN_{year}080107_{year+1}080106_reformat.nc"))[0])
-
-    if date == datetime(date.year, 8, 1):
-        ds_before = xr.open_dataset(glob.glob(str(SAFRAN_REFORMAT_DIR/f"SAFRAN_{year-1}080107_{year}080106_reformat.nc"))[0])
-        ds_before = ds_before.isel(time=slice (-7, None))
-        ds = ds.isel(time = slice(None, 17))
-        ds = ds.merge(ds_before)
-    else : 
-        ds = ds.sel(time=pd.date_range(start=date.strftime("%Y-%m-%d"), periods = 24, freq='h').to_numpy())
-    y = ds[TARGET].values.mean(axis=0)
-    y = remove_countries(y)
-    y = np.expand_dims(y, axis=0)
+def target_data(dates):
+    ''' Returns target data as an array of shape (T, 1, H, W) '''
+
+    # Daily means with the countries already removed (build_safran_daily.py)
+    ds = select_dates(open_dataset(SAFRAN_DAILY_FILE), dates)
+    y = ds[TARGET].values
+    y = np.expand_dims(y, axis=1)
     return y
 
+
+def write_bc_samples(tas_bc: np.ndarray, 
+                     dates: np.ndarray, 
+                     coordinates: dict, 
+                     writer, 
+                     with_target: bool,
+                     chunk_days: int = 366) -> None:
+    """
+    Regrids a bias corrected (time, lat, lon) cube to the SAFRAN grid and writes its samples.
+
+    The cube is regridded by chunks of days with the cached regridder, and the target 
+    of each chunk is read in one selection of the daily SAFRAN file.
+
+    Args:
+        tas_bc (np.ndarray): Bias corrected temperature (time, lat, lon).
+        dates (np.ndarray): Dates of the cube.
+        coordinates (dict): 'lat' and 'lon' coordinates of the cube.
+        writer: Sample writer (see `get_sample_writer`).
+        with_target (bool): Adds the SAFRAN target ('y') to the samples.
+        chunk_days (int): Number of days regridded at once.
+    """
+    dates = pd.DatetimeIndex(dates)
+    for start in range(0, len(dates), chunk_days):
+        chunk_dates = dates[start:start + chunk_days]
+        print(chunk_dates[0].date(), chunk_dates[-1].date())
+        ds_chunk = xr.Dataset(data_vars=dict(
+                            tas=(['time', 'lat', 'lon'], tas_bc[start:start + chunk_days])),
+                            coords=dict(
+                            lat=('lat', coordinates['lat']),
+                            lon=('lon', coordinates['lon']),
+                            time=('time', chunk_dates)
+                            ))
+        ds_chunk = reformat_as_target(ds_chunk, 
+                                      target_file=TARGET_SAFRAN_FILE,
+                                      domain=CONFIG['safran']['domain']['france'], 
+                                      method="conservative_normed")
+        x = ds_chunk.tas.values[:, np.newaxis]
+        y = target_data(chunk_dates) if with_target else None
+        for i, date in enumerate(chunk_dates):
+            sample = {'x': x[i]} if y is None else {'x': x[i], 'y': y[i]}
+            writer.write(date, sample)
+
 def plot_tprofiles_short_range(
         y: Optional[np.ndarray], 
         x: np.ndarray, 
@@ -162,46 +193,67 @@ def monthly_mean(y: Optional[np.ndarray],
 
 
 if __name__=='__main__':
-    
-    debiaser = CDFt.from_variable(variable="tas",
-                                  apply_by_month=True)
+    parser = argparse.ArgumentParser(description="Bias correction of the CMIP6 simulation")
+    parser.add_argument('--debiaser', type=str, default='cdft', help='cdft, qm (iriscc.biascorrection) or ibicus (ibicus CDFt)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (iriscc debiasers)')
+    parser.add_argument('--refit', action='store_true', help='Refits the iriscc debiaser even if a matching one is saved')
+    parser.add_argument('--periods', type=str, nargs='+', default=['train_hist'], 
+                        help='Periods written as samples (train_hist, test_hist, test_future)')
+    parser.add_argument('--backend', type=str, default='npz', help='Output backend (npz or zarr)')
+    parser.add_argument('--chunk-days', type=int, default=366, help='Number of days regridded at once')
+    args = parser.parse_args()
     ssp = 'ssp585'
 
-    train_hist = dict(np.load(DATASET_BC_DIR/'bc_train_hist.npz', allow_pickle=True))
-    test_hist = dict(np.load(DATASET_BC_DIR/'bc_test_hist.npz', allow_pickle=True))
-    test_future = dict(np.load(DATASET_BC_DIR/'bc_test_future.npz', allow_pickle=True))
+    # Memmap periods stay memory-mapped (np.asarray does not copy them), Zarr periods are read here
+    train_hist = {key: np.asarray(value) for key, value in load_period(DATASET_BC_DIR/'bc_train_hist').items()}
+    test_hist = {key: np.asarray(value) for key, value in load_period(DATASET_BC_DIR/'bc_test_hist').items()}
+    test_future = {key: np.asarray(value) for key, value in load_period(DATASET_BC_DIR/'bc_test_future').items()}
     coordinates = dict(np.load(DATASET_BC_DIR / 'coordinates.npz', allow_pickle=True))
 
-   
+    if args.debiaser == 'ibicus':
+        debiaser = CDFt.from_variable(variable="tas",
+                                      apply_by_month=True)
+        def debias(cm_future, time_cm_future):
+            return debiaser.apply(obs=train_hist['era5'],
+                                  cm_hist=train_hist['cmip6'], 
+                                  cm_future=cm_future, 
+                                  time_obs=train_hist['dates'], 
+                                  time_cm_hist=train_hist['dates'],
+                                  time_cm_future=time_cm_future)
+    else:
+        # The transfer functions are fitted once on 1980-1999 and saved. A saved debiaser
+        # is only reused if it was fitted on the same data with the same settings.
+        debiaser_file = DATASET_BC_DIR / f'debiaser_{args.debiaser}.npz'
+        debiaser = DEBIASERS[args.debiaser]()
+        fit_inputs = dict(obs=train_hist['era5'],
+                          cm_hist=train_hist['cmip6'],
+                          time_obs=train_hist['dates'],
+                          time_cm_hist=train_hist['dates'])
+        saved = QuantileDebiaser.load(debiaser_file) if debiaser_file.exists() and not args.refit else None
+        if saved is not None and saved.fit_key == debiaser.fit_hash(**fit_inputs):
+            debiaser = saved
+        else:
+            if saved is not None:
+                print(f'{debiaser_file} was fitted on other data or settings, refitting')
+            debiaser.fit(**fit_inputs, n_workers=args.workers)
+            debiaser.save(debiaser_file)
+        def debias(cm_future, time_cm_future):
+            return debiaser.apply(cm_future, time_cm_future, n_workers=args.workers)
+
     ##### 1980-1999
-    train_hist_bc = debiaser.apply(obs=train_hist['era5'],
-                                cm_hist=train_hist['cmip6'], 
-                                cm_future=train_hist['cmip6'], 
-                                time_obs=train_hist['dates'], 
-                                time_cm_hist=train_hist['dates'],
-                                time_cm_future=train_hist['dates'])
+    train_hist_bc = debias(train_hist['cmip6'], train_hist['dates'])
     ##### 2000-2014
-    test_hist_bc = debiaser.apply(obs=train_hist['era5'],
-                                cm_hist=train_hist['cmip6'], 
-                                cm_future=test_hist['cmip6'], 
-                                time_obs=train_hist['dates'], 
-                                time_cm_hist=train_hist['dates'],
-                                time_cm_future=test_hist['dates'])
-    
+    test_hist_bc = debias(test_hist['cmip6'], test_hist['dates'])
     ##### 2015-2100
-    test_future_bc = debiaser.apply(obs=train_hist['era5'],
-                            cm_hist=train_hist['cmip6'], 
-                            cm_future=test_future['cmip6'], 
-                            time_obs=train_hist['dates'], 
-                            time_cm_hist=train_hist['dates'],
-                            time_cm_future=test_future['dates'])
+    test_future_bc = debias(test_future['cmip6'], test_future['dates'])
+    label = 'QM' if args.debiaser == 'qm' else 'CDFt'
     
 
     tas_marginal_bias_data = marginal.calculate_marginal_bias(metrics = [metrics.cold_days, metrics.warm_days], 
                                                             percentage_or_absolute='absolute',
                                                             obs = test_hist['era5'],
                                                             raw = test_hist['cmip6'],
-                                                            CDFt = test_hist_bc)
+                                                            **{label: test_hist_bc})
     plot = marginal.plot_marginal_bias(variable = 'tas',
                                        bias_df = tas_marginal_bias_data)
     plot.savefig(GRAPHS_DIR /'biascorrection/ibicus_bias_boxplot.png')
@@ -210,7 +262,7 @@ if __name__=='__main__':
                                                         trend_type = 'additive',
                                                         raw_validate = test_hist['cmip6'], raw_future = test_future['cmip6'],
                                                         metrics = [metrics.cold_days, metrics.warm_days],
-                                                        CDFt = [test_hist_bc, test_future_bc])
+                                                        **{label: [test_hist_bc, test_future_bc]})
 
     plot = trend.plot_future_trend_bias_boxplot(variable ='tas', bias_df = tas_trend_bias_data,remove_outliers = True)
     plot.savefig(GRAPHS_DIR / f'biascorrection/ibicus_bias_futur_trend_{ssp}.png')
@@ -317,100 +369,16 @@ if __name__=='__main__':
                        title =f'Monthly mean temperature over the future Test period (2015-2100 {ssp})',
                        savedir=GRAPHS_DIR/f'biascorrection/ibicus_test_future_histo_{ssp}.png')
 
-    ds_train_hist_bc = xr.Dataset(data_vars=dict(
-                            tas=(['time', 'lat', 'lon'], train_hist_bc)),
-                            coords=dict(
-                            lat=('lat', coordinates['lat']),
-                            lon=('lon', coordinates['lon']),
-                            time=('time', train_hist['dates'])
-                            ))
-
-    ds_test_hist_bc = xr.Dataset(data_vars=dict(
-                            tas=(['time', 'lat', 'lon'], test_hist_bc)),
-                            coords=dict(
-                            lat=('lat', coordinates['lat']),
-                            lon=('lon', coordinates['lon']),
-                            time=('time', test_hist['dates'])
-                            ))
-
-    ds_test_future_bc = xr.Dataset(data_vars=dict(
-                            tas=(['time', 'lat', 'lon'], test_future_bc)),
-                            coords=dict(
-                            lat=('lat', coordinates['lat']),
-                            lon=('lon', coordinates['lon']),
-                            time=('time', test_future['dates'])
-                            ))
-    for date in DATES_BC_TRAIN_HIST:
-        print(date)
-        x = []
-
-        # Commune variables
-        ds = xr.open_dataset(OROG_FILE)
-        x.append(ds['Altitude'].values)
-        ds_train_hist_bc_i = ds_train_hist_bc.sel(time=ds_train_hist_bc.time.dt.date == date.date())
-        ds_train_hist_bc_i = ds_train_hist_bc_i.isel(time=0, drop=True)
-
-        ds_train_hist_bc_i = reformat_as_target(ds_train_hist_bc_i, 
-                                         target_file=TARGET_SAFRAN_FILE,
-                                         domain=CONFIG['safran']['domain']['france'], 
-                                         method="conservative_normed")
-    
-        x.append(ds_train_hist_bc_i.tas.values)
-        x = np.stack(x, axis = 0)
-        y = target_data(date)
-        
-        sample = {'x' : x,
-                    'y' : y}
-        date_str = date.date().strftime('%Y%m%d')
-        np.savez(DATASET_BC_DIR/f'dataset_exp3_test_cmip6_bc/sample_{date_str}.npz', **sample)
-
-
-    '''
-    for date in DATES_BC_TEST_HIST:
-        print(date)
-        x = []
-
-        # Commune variables
-        ds = xr.open_dataset(OROG_FILE)
-        x.append(ds['Altitude'].values)
-        ds_test_hist_bc_i = ds_test_hist_bc.sel(time=ds_test_hist_bc.time.dt.date == date.date())
-        ds_test_hist_bc_i = ds_test_hist_bc_i.isel(time=0, drop=True)
-
-        ds_test_hist_bc_i = reformat_as_target(ds_test_hist_bc_i, 
-                                         target_file=TARGET_SAFRAN_FILE,
-                                         domain=CONFIG['safran']['domain']['france'], 
-                                         method="conservative_normed")
-    
-        x.append(ds_test_hist_bc_i.tas.values)
-        x = np.stack(x, axis = 0)
-        y = target_data(date)
-        
-        sample = {'x' : x,
-                    'y' : y}
-        date_str = date.date().strftime('%Y%m%d')
-        np.savez(DATASET_BC_DIR/f'dataset_exp3_test_cmip6_bc/sample_{date_str}.npz', **sample)
+    periods = {'train_hist': (train_hist_bc, train_hist['dates'], True),
+               'test_hist': (test_hist_bc, test_hist['dates'], True),
+               'test_future': (test_future_bc, test_future['dates'], False)}
 
-    
-
-    for date in DATES_BC_TEST_FUTURE:
-        print(date)
-        x = []
+    # The orography is stored once, the samples only contain the corrected temperature
+    output_dir = DATASET_BC_DIR/'dataset_exp3_test_cmip6_bc'
+    ds = open_dataset(OROG_FILE)
+    save_static(output_dir, np.expand_dims(ds['Altitude'].values, axis=0))
 
-        # Commune variables
-        ds = xr.open_dataset(OROG_FILE)
-        x.append(ds['Altitude'].values)
-
-        ds_test_future_bc_i = ds_test_future_bc.sel(time=ds_test_future_bc.time.dt.date == date.date())
-        ds_test_future_bc_i = ds_test_future_bc_i.isel(time=0, drop=True)
-        ds_test_future_bc_i = reformat_as_target(ds_test_future_bc_i, 
-                                         target_file=TARGET_SAFRAN_FILE,
-                                         domain=CONFIG['safran']['domain']['france'], 
-                                         method="conservative_normed")
-    
-        x.append(ds_test_future_bc_i.tas.values)
-        x = np.stack(x, axis = 0)
-        
-        sample = {'x' : x}
-        date_str = date.date().strftime('%Y%m%d')
-        np.savez(DATASET_BC_DIR/f'dataset_exp3_test_cmip6_bc/sample_{date_str}.npz', **sample)
-    '''
\ No newline at end of file
+    with get_sample_writer(output_dir, args.backend) as writer:
+        for period in args.periods:
+            tas_bc, dates, with_target = periods[period]
+            write_bc_samples(tas_bc, dates, coordinates, writer, with_target, chunk_days=args.chunk_days)
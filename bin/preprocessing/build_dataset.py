@@ -0,0 +1,19 @@
+''' Builds the dataset of an experiment from its pipeline configuration (PIPELINES in iriscc/settings.py) '''
+
+import sys
+sys.path.append('.')
+
+import argparse
+
+from iriscc.pipeline import Pipeline
+from iriscc.settings import PIPELINES
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Build the dataset of an experiment")
+    parser.add_argument('--exp', type=str, required=True, choices=list(PIPELINES), help='Experiment name (e.g., exp3)')
+    parser.add_argument('--backend', type=str, default='npz', help='Output backend (npz or zarr)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    args = parser.parse_args()
+
+    Pipeline(args.exp).run(backend=args.backend, n_workers=args.workers)
@@ -7,7 +7,13 @@ import xarray as xr
 import numpy as np
 import pandas as pd
 import glob
+import argparse
+import dask.array as da
+from numcodecs import Blosc
+from concurrent.futures import ProcessPoolExecutor
 
+from iriscc.samplestore import create_period, open_period_array
+from iriscc.timeindex import open_reader
 from iriscc.datautils import (standardize_dims_and_coords, 
                               standardize_longitudes, 
                               interpolation_target_grid, 
@@ -22,10 +28,11 @@ from iriscc.settings import (DATES_TEST,
                              DATASET_BC_DIR,
                              CONFIG)
 
+ZARR_CHUNK = 8 # days per Zarr chunk
+
 def get_era5_dataset(date):
     file = glob.glob(str(ERA5_DIR/f'tas*_{date.year}_*'))[0]
-    ds = xr.open_dataset(file)
-    ds = ds.sel(time=ds.time.dt.date == date).isel(time=0)
+    ds = open_reader(file).day(date)
     ds = standardize_dims_and_coords(ds)
     ds = standardize_longitudes(ds)
     ds = ds.reindex(lat=ds.lat[::-1])
@@ -37,69 +44,92 @@ def get_cmip6_dataset(date):
         file = glob.glob(str(CMIP6_RAW_DIR/f'CNRM-CM6-1/tas*historical*r1i1p1f2*'))[0]
     else:
         file = np.sort(glob.glob(str(CMIP6_RAW_DIR/f'CNRM-CM6-1/tas*ssp585*r1i1p1f2*')))[0]
-    ds = xr.open_dataset(file)
-    ds = ds.sel(time=ds.time.dt.date == date).isel(time=0)
+    ds = open_reader(file).day(date)
     ds = standardize_longitudes(ds)
     ds = crop_domain_from_ds(ds, CONFIG['eobs']['domain']['europe'])
     return ds
 
-if __name__=='__main__':
-    
-    #### TRAIN HISTORIQUE DATASET
-    era5_train_hist = []
-    cmip6_train_hist = []
-    for i, date in enumerate(DATES_BC_TRAIN_HIST):
+def year_blocks(dates):
+    ''' Returns the (start, stop) positions of the years of a daily period '''
+    years = pd.DatetimeIndex(dates).year.values
+    bounds = np.concatenate(([0], np.where(np.diff(years) != 0)[0] + 1, [len(years)]))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def build_block(name, dates, start, stop, era5, backend):
+    ''' Builds the CMIP6 (and ERA5 regridded to CMIP6) arrays of a block of days '''
+    block = {}
+    for i, date in enumerate(dates[start:stop]):
         print(date)
         ds_cmip6 = get_cmip6_dataset(date.date()) # 1er membre
-        if i == 0:
-            lon, lat = ds_cmip6.lon.values, ds_cmip6.lat.values
-            coordinates = {'lon': lon,
-                           'lat': lat}
-            np.savez(DATASET_BC_DIR/f'coordinates.npz', **coordinates)
-        ds_era5 = get_era5_dataset(date.date())
-        ds_era5_to_cmip6 = interpolation_target_grid(ds_era5, ds_target=ds_cmip6, method="conservative_normed") # tout à la résolution cmip6
-        tas_era5 = ds_era5_to_cmip6.tas.values
-        tas_cmip6 = ds_cmip6.tas.values
-        era5_train_hist.append(tas_era5)
-        cmip6_train_hist.append(tas_cmip6)
-    era5_train_hist = np.stack(era5_train_hist, axis = 0)
-    cmip6_train_hist = np.stack(cmip6_train_hist, axis = 0)
-    train_hist = {'era5' : era5_train_hist,
-                'cmip6' : cmip6_train_hist,
-                'dates': DATES_BC_TRAIN_HIST}
-    np.savez(DATASET_BC_DIR/f'bc_train_hist.npz', **train_hist)
-    
+        sample = {'cmip6': ds_cmip6.tas.values}
+        if era5:
+            ds_era5 = get_era5_dataset(date.date())
+            ds_era5_to_cmip6 = interpolation_target_grid(ds_era5, ds_target=ds_cmip6, method="conservative_normed") # tout à la résolution cmip6
+            sample['era5'] = ds_era5_to_cmip6.tas.values
+        for key, array in sample.items():
+            if key not in block:
+                block[key] = np.empty((stop - start,) + array.shape, dtype=np.float32)
+            block[key][i] = array
+
+    if backend == 'zarr': # written by the main process
+        return block
+    for key, array in block.items():
+        period = open_period_array(DATASET_BC_DIR/name, key, mode='r+')
+        period[start:stop] = array
+        period.flush()
+    return None
+
+
+def build_period(name, dates, backend, shape, era5=True, n_workers=1):
+    ''' 
+    Builds the CMIP6 (and ERA5 regridded to CMIP6) arrays of a period. The arrays are 
+    preallocated on disk and filled in place by blocks of one year, built in parallel.
+    '''
+    keys = ['era5', 'cmip6'] if era5 else ['cmip6']
+    if backend == 'zarr':
+        store_path = DATASET_BC_DIR/f'{name}.zarr'
+        data_vars = {key: (['time', 'h', 'w'], da.zeros((len(dates),) + shape, chunks=(ZARR_CHUNK,) + shape, dtype=np.float32)) 
+                     for key in keys}
+        encoding = {key: {'chunks': (ZARR_CHUNK,) + shape,
+                          'compressor': Blosc(cname='lz4', clevel=5, shuffle=Blosc.SHUFFLE)} for key in keys}
+        xr.Dataset(data_vars=data_vars, coords={'time': dates}).to_zarr(store_path, mode='w', compute=False, encoding=encoding)
+    elif backend == 'memmap':
+        create_period(DATASET_BC_DIR/name, keys, dates, shape)
+    else:
+        raise ValueError("Invalid backend. Choose from 'memmap' or 'zarr'.")
+
+    blocks = year_blocks(dates)
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = executor.map(build_block, 
+                               [name] * len(blocks), 
+                               [dates] * len(blocks),
+                               *zip(*blocks),
+                               [era5] * len(blocks),
+                               [backend] * len(blocks))
+        for (start, stop), block in zip(blocks, results):
+            if block is not None:
+                ds = xr.Dataset(data_vars={key: (['time', 'h', 'w'], array) for key, array in block.items()})
+                ds.to_zarr(store_path, region={'time': slice(int(start), int(stop))})
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Build the bias correction datasets")
+    parser.add_argument('--backend', type=str, default='memmap', help='Output backend (memmap or zarr)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes (one year per task)')
+    args = parser.parse_args()
+
+    ds_cmip6 = get_cmip6_dataset(DATES_BC_TRAIN_HIST[0].date())
+    coordinates = {'lon': ds_cmip6.lon.values,
+                   'lat': ds_cmip6.lat.values}
+    np.savez(DATASET_BC_DIR/f'coordinates.npz', **coordinates)
+    shape = ds_cmip6.tas.shape
+
+    #### TRAIN HISTORIQUE DATASET
+    build_period('bc_train_hist', DATES_BC_TRAIN_HIST, args.backend, shape, n_workers=args.workers)
 
     #### TEST HISTORIQUE DATASET
-    era5_test_hist = []
-    cmip6_test_hist = []
-    for date in DATES_BC_TEST_HIST:    
-        print(date)
-        ds_cmip6 = get_cmip6_dataset(date.date()) # 1er membre
-        ds_era5 = get_era5_dataset(date.date())
-        ds_era5_to_cmip6 = interpolation_target_grid(ds_era5, ds_target=ds_cmip6, method="conservative_normed") # tout à la résolution cmip6
-        tas_era5 = ds_era5_to_cmip6.tas.values
-        tas_cmip6 = ds_cmip6.tas.values
-        era5_test_hist.append(tas_era5)
-        cmip6_test_hist.append(tas_cmip6)
-    era5_test_hist = np.stack(era5_test_hist, axis = 0)
-    cmip6_test_hist = np.stack(cmip6_test_hist, axis = 0)
-    test_hist = {'era5' : era5_test_hist,
-                'cmip6' : cmip6_test_hist,
-                'dates': DATES_BC_TEST_HIST}
-    np.savez(DATASET_BC_DIR/f'bc_test_hist.npz', **test_hist)
-    
+    build_period('bc_test_hist', DATES_BC_TEST_HIST, args.backend, shape, n_workers=args.workers)
 
     #### TEST FUTUR DATASET
-    cmip6_test_future = []
-    for date in DATES_BC_TEST_FUTURE:    
-        print(date)
-        ds_cmip6 = get_cmip6_dataset(date.date())
-        tas_cmip6 = ds_cmip6.tas.values
-        cmip6_test_future.append(tas_cmip6)
-    cmip6_test_future = np.stack(cmip6_test_future, axis = 0)
-    test_future = {'cmip6' : cmip6_test_future,
-                'dates' : DATES_BC_TEST_FUTURE}
-    np.savez(DATASET_BC_DIR/f'bc_test_future.npz', **test_future)
-        
-   
\ No newline at end of file
+    build_period('bc_test_future', DATES_BC_TEST_FUTURE, args.backend, shape, era5=False, n_workers=args.workers)
@@ -0,0 +1,54 @@
+''' Daily means of the hourly SAFRAN season files, in one contiguous cube '''
+
+import sys
+sys.path.append('.')
+
+import xarray as xr
+import numpy as np
+import glob
+import os
+
+from iriscc.datautils import remove_countries
+from iriscc.settings import SAFRAN_REFORMAT_DIR, SAFRAN_DAILY_FILE, SAFRAN_DAILY_RAW_FILE, TARGET
+
+
+def daily_sums(file):
+    ''' Returns the daily sums and numbers of hourly steps of an August-to-August season file '''
+    ds = xr.open_dataset(file)
+    tas = ds[TARGET].load()
+    sums = tas.resample(time='1D').sum(skipna=False)
+    counts = tas['time'].resample(time='1D').count()
+    ds.close()
+    return sums, counts
+
+
+def save_cube(ds, file):
+    ''' Writes a daily cube, one compressed chunk per day '''
+    tmp_file = file.with_suffix('.tmp.nc')
+    ds.to_netcdf(tmp_file, encoding={TARGET: {'zlib': True,
+                                              'complevel': 1,
+                                              'dtype': 'float32',
+                                              'chunksizes': (1,) + ds[TARGET].shape[1:]}})
+    os.replace(tmp_file, file)
+
+
+if __name__=='__main__':
+    # Each season starts on the 1st of August at 07h: the 1st of August is split
+    # between two files, so sums and counts are merged before averaging.
+    files = np.sort(glob.glob(str(SAFRAN_REFORMAT_DIR/'SAFRAN_*_reformat.nc')))
+    sums, counts = zip(*[daily_sums(file) for file in files])
+    sums = xr.concat(sums, dim='time').groupby('time').sum(skipna=False)
+    counts = xr.concat(counts, dim='time').groupby('time').sum()
+
+    tas = sums / counts
+    attrs = xr.open_dataset(files[0])[TARGET].attrs
+
+    # The raw cube keeps the neighbouring countries (exp2 target)
+    ds = tas.to_dataset(name=TARGET)
+    ds[TARGET].attrs = attrs
+    save_cube(ds, SAFRAN_DAILY_RAW_FILE)
+
+    tas.values = remove_countries(tas.values) # applied once to the whole cube
+    ds = tas.to_dataset(name=TARGET)
+    ds[TARGET].attrs = attrs
+    save_cube(ds, SAFRAN_DAILY_FILE)
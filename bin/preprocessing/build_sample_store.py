@@ -0,0 +1,17 @@
+''' Converts a dataset of daily .npz samples into a consolidated memory-mapped store '''
+
+import sys
+sys.path.append('.')
+
+import argparse
+from pathlib import Path
+
+from iriscc.samplestore import build_sample_store
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(description="Build the consolidated sample store of a dataset")
+    parser.add_argument('--dataset-path', type=str, help='Dataset path')
+    args = parser.parse_args()
+
+    build_sample_store(Path(args.dataset_path))
@@ -2,33 +2,17 @@ import sys
 sys.path.append('.')
 
 import numpy as np
-import glob
 from pathlib import Path
 import json
 import argparse
 import matplotlib.pyplot as plt
 
-from iriscc.settings import DATASET_EXP1_DIR, CHANELS, DATASET_EXP3_30Y_DIR, DATASET_EXP4_30Y_DIR
-from typing import Tuple
+from iriscc.settings import CHANELS
+from iriscc.statistics import Histogram, compute_statistics, compute_pixel_statistics, save_pixel_statistics
 
-def update_statistics(sum: float, square_sum: float, n_total: int, min: float, max: float, x: np.ndarray) -> Tuple[float, float, int, float, float]:
-    ''' 
-    Compute and update sample statistics including sum, squared sum, total count, 
-    minimum, and maximum values for a given array, ignoring NaN values.
-    '''
-    x = x[~np.isnan(x)]  # Remove NaN values
-    sum += np.sum(x)  # Update sum
-    square_sum += np.sum(x**2)  # Update squared sum
-    n_total += x.size  # Update total count
-    if np.min(x) < min:  # Update minimum value
-         min = np.min(x)
-    if np.max(x) > max:  # Update maximum value
-         max = np.max(x)
-    return sum, square_sum, n_total, min, max
 
-
-def plot_histogram(data, min, max, mean, std, variable:str, title:str, save_dir:str):
-    hist, edges = np.histogram(data, bins=50, range=(min, max), density=True)
+def plot_histogram(histogram: Histogram, mean, std, variable:str, title:str, save_dir:str):
+    hist, edges = histogram.density, histogram.edges
     centers = 0.5 * (edges[:-1] + edges[1:])
 
     plt.figure(figsize=(10, 6))
@@ -50,103 +34,29 @@ def plot_histogram(data, min, max, mean, std, variable:str, title:str, save_dir:
 
 if __name__=='__main__':
     parser = argparse.ArgumentParser(description="Compute statistics for a given dataset path")
-    parser.add_argument('--dataset-path', type=str, help='Dataset path')   
+    parser.add_argument('--dataset-path', type=str, help='Dataset path')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    parser.add_argument('--pixel', action='store_true', help='Also compute the per-pixel (and per day of the year) mean/std maps')
     args = parser.parse_args()
 
     dataset_dir = Path(args.dataset_path)
-    dataset = np.sort(glob.glob(str(dataset_dir/'sample*')))
-    ch = len(CHANELS)
-    sum = np.zeros(ch)
-    square_sum = np.zeros(ch)
-    n_total = np.zeros(ch)
-
-    #nb = len(dataset)
-    #train_end = int(0.6 * nb) 
-    #val_end = train_end + int(0.2 * nb)
-    
-    train_end = np.where(dataset == str(dataset_dir/'sample_20091231.npz'))[0][0]
-    val_end = np.where(dataset == str(dataset_dir/'sample_20131231.npz'))[0][0]
-
-    
-    x_data = {'train' : [],
-                 'val' : [],
-                 'test' : []}
-    y_data = {'train' : [],
-                 'val' : [],
-                 'test' : []}
-
-    for nb, sample in enumerate(dataset):
-        print(sample)
 
-        data = dict(np.load(sample, allow_pickle=True))
-        x, y = data['x'], data['y']
-        condition = np.isnan(y[0])
-        for c in range(len(x)):
-            x[c][condition] = np.nan
+    # Only training statistics are used for normalization
+    stats, histograms = compute_statistics(dataset_dir, CHANELS, n_workers=args.workers)
+    print(stats)
 
-        # Only training statistics are used for normalization
-        if nb < train_end :
-            x_data['train'].append(x[1:,:,:].flatten())
-            y_data['train'].append(y.flatten())
-            if nb == 0:
-                min, max = np.nanmin(x, axis=(1, 2)), np.nanmax(x, axis=(1, 2))
-                min = np.concatenate((min, np.nanmin(y, axis=(1, 2))))
-                max = np.concatenate((max, np.nanmax(y, axis=(1, 2))))
-            
-            for i in range(ch):
-                if i == ch-1:
-                    sum[i], square_sum[i], n_total[i], min[i], max[i] = update_statistics(sum[i], 
-                                                                        square_sum[i], 
-                                                                        n_total[i],
-                                                                        min[i],
-                                                                        max[i],
-                                                                        y[0])
-                else:
-                    sum[i], square_sum[i], n_total[i], min[i], max[i] = update_statistics(sum[i], 
-                                                                        square_sum[i], 
-                                                                        n_total[i],
-                                                                        min[i],
-                                                                        max[i],
-                                                                        x[i])
-                
-            if max[-1] > 350:
-                print(max[-1])
-        
-
-        # Validation and test data histograms 
-        elif nb in range(train_end, val_end):
-            x_data['val'].append(x[1:,:,:].flatten())
-            y_data['val'].append(y.flatten())
-        elif nb >= val_end :
-            x_data['test'].append(x[1:,:,:].flatten())
-            y_data['test'].append(y.flatten())
-        
-    mean = sum / n_total
-    std = np.sqrt((square_sum / n_total) - (mean**2))
-    print(mean, std, min, max)
-
-    stats = {}
-    for i, chanel in enumerate(CHANELS):
-        stats[chanel] = {'mean': mean[i],
-                         'std': std[i],
-                         'min': min[i].astype(np.float64),
-                         'max': max[i].astype(np.float64)}
-    
-    with open(dataset_dir/'statistics.json', "w") as f: 
+    with open(dataset_dir/'statistics.json', "w") as f:
         json.dump(stats, f)
 
-    for name, dict in {'x':x_data, 'y':y_data}.items():
-        for type, data in dict.items():
-            # Only Temperature values are kept
-            data = np.concatenate(data)
-            plot_histogram(data, 
-                        min[1:].min(), 
-                        max[1:].max(), 
-                        np.nanmean(data), 
-                        np.nanstd(data), 
-                        'tas (K)', 
-                        f'{name} {type} dataset histogram', 
+    if args.pixel:
+        maps = compute_pixel_statistics(dataset_dir, CHANELS, stats, n_workers=args.workers)
+        print(save_pixel_statistics(dataset_dir, maps))
+
+    for name, dict in histograms.items():
+        for type, (histogram, moments) in dict.items():
+            plot_histogram(histogram,
+                        moments.mean[0],
+                        moments.std[0],
+                        'tas (K)',
+                        f'{name} {type} dataset histogram',
                         dataset_dir/f'hist_{name}_{type}.png')
- 
-    
-
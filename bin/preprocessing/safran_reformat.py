@@ -3,57 +3,113 @@ sys.path.append('.')
 
 import xarray as xr
 import numpy as np
+import dask
+import dask.array as da
 from scipy.spatial import cKDTree
+from numcodecs import Blosc
+import argparse
+import hashlib
 import glob
 import os
+from concurrent.futures import ProcessPoolExecutor
 
-from iriscc.settings import SAFRAN_RAW_DIR, SAFRAN_DIR
+from iriscc.settings import SAFRAN_RAW_DIR, SAFRAN_DIR, SAFRAN_REFORMAT_DIR, SAFRAN_GRID_FILE
 
-def reformat_safran_xy(file):
+INDEX_DIR = SAFRAN_DIR / 'reformat_index'
+TIME_BLOCK = 24 * 31 # hourly steps scattered at once
+
+
+def grid_index(lon, lat, lon_grid, lat_grid):
+    ''' Returns the (y, x) indices of the nearest grid point of each SAFRAN point, cached on disk '''
+    h = hashlib.md5()
+    for array in [lon, lat, lon_grid, lat_grid]:
+        h.update(np.ascontiguousarray(array).tobytes())
+    file = INDEX_DIR / f'index_{h.hexdigest()[:12]}.npz'
+    if file.exists():
+        index = np.load(file)
+        return index['id_y'], index['id_x']
+
+    grid_points = np.column_stack((lon_grid.ravel(), lat_grid.ravel()))
+    data_points = np.column_stack((lon, lat))
+    tree = cKDTree(grid_points)
+    _, indices = tree.query(data_points)
+    id_y, id_x = np.unravel_index(indices, np.shape(lon_grid))
+
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    tmp_file = file.with_suffix('.tmp.npz')
+    np.savez(tmp_file, id_y=id_y, id_x=id_x)
+    os.replace(tmp_file, file)
+    return id_y, id_x
+
+
+def reformat_safran_xy(file, output_format='netcdf'):
+    ''' Scatters the SAFRAN points of a raw file on the (x, y) grid and writes the result '''
+    output = SAFRAN_REFORMAT_DIR / f'{os.path.basename(file)[:-3]}_reformat.{"nc" if output_format == "netcdf" else "zarr"}'
+    if output.exists():
+        return output
 
     # target dataset
-    ds_grid = xr.open_dataset('/gpfs-calypso/scratch/globc/garcia/utils/tasmax_1d_21000101_21001231.nc')
+    ds_grid = xr.open_dataset(SAFRAN_GRID_FILE)
     lon_grid = ds_grid['lon'].values
     lat_grid = ds_grid['lat'].values
     dimx = np.shape(lon_grid)[1]
     dimy = np.shape(lon_grid)[0]
 
     # interpolated to safran grid (x,y)
-    ds = xr.open_dataset(file)
+    ds = xr.open_dataset(file, chunks={'time': TIME_BLOCK})
     lon = ds['LON'].values
     lat = ds['LAT'].values
     tas = ds['Tair']
-    tas_attrs = ds['Tair'].attrs
     time = ds['time']
-    time_attrs = ds['time'].attrs
+    id_y, id_x = grid_index(lon, lat, lon_grid, lat_grid)
 
-    grid_points = np.column_stack((lon_grid.ravel(), lat_grid.ravel()))
-    data_points = np.column_stack((lon, lat))
-
-    tree = cKDTree(grid_points)
-    _, indices = tree.query(data_points)
+    def scatter(block):
+        tas_grid = np.full((block.shape[0], dimy, dimx), np.nan, dtype=block.dtype)
+        tas_grid[:, id_y, id_x] = block
+        return tas_grid
 
-    tas_grid = np.nan * np.ones((len(time.values), dimy, dimx))
+    # Blocks of time steps are scattered lazily and streamed to the output
+    tas_grid = da.map_blocks(scatter, tas.data,
+                             dtype=tas.dtype,
+                             drop_axis=1,
+                             new_axis=[1, 2],
+                             chunks=(tas.data.chunks[0], (dimy,), (dimx,)))
 
-    id_y, id_x = np.unravel_index(indices, np.shape(lon_grid))
-    tas_grid[:, id_y, id_x] = tas.values
-
-
-    # create a new conforme dataset 
+    # create a new conforme dataset
     new_ds = ds_grid.drop_vars(['tasmax', 'time'])
-
-    new_ds.expand_dims(dim={'time' : time})
-    new_ds['time'] = (['time'], time)
-    new_ds['time'].attrs = time_attrs
+    new_ds['time'] = (['time'], time.values)
+    new_ds['time'].attrs = time.attrs
     new_ds['tas'] = (['time', 'y', 'x'], tas_grid)
-    new_ds['tas'].attrs = tas_attrs
+    new_ds['tas'].attrs = tas.attrs
+
+    tmp_output = output.with_name(f'{output.stem}.tmp{output.suffix}')
+    with dask.config.set(scheduler='synchronous'): # one process per file
+        if output_format == 'netcdf':
+            new_ds.to_netcdf(tmp_output, encoding={'tas': {'zlib': True,
+                                                           'complevel': 1,
+                                                           'chunksizes': (min(24, len(time)), dimy, dimx)}})
+        else:
+            new_ds.to_zarr(tmp_output, mode='w', encoding={'tas': {'chunks': (TIME_BLOCK, dimy, dimx),
+                                                                   'compressor': Blosc(cname='lz4', clevel=5, shuffle=Blosc.SHUFFLE)}})
+    os.replace(tmp_output, output)
+    ds.close()
+    ds_grid.close()
+    return output
 
-    #new_ds.to_netcdf(SAFRAN_DIR/f'{os.path.basename(file)[:-3]}_reformat.nc')
 
 if __name__=='__main__':
-    safran_files = glob.glob(str(SAFRAN_RAW_DIR/'SAFRAN*'))
-    for file in safran_files:
-        print(file)
-        reformat_safran_xy(file)
+    parser = argparse.ArgumentParser(description="Reformat the raw SAFRAN files on the (x, y) grid")
+    parser.add_argument('--format', type=str, default='netcdf', help='Output format (netcdf or zarr)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    args = parser.parse_args()
+
+    safran_files = np.sort(glob.glob(str(SAFRAN_RAW_DIR/'SAFRAN*')))
+    os.makedirs(SAFRAN_REFORMAT_DIR, exist_ok=True)
+    # The index is computed once, before the workers start
+    ds = xr.open_dataset(safran_files[0])
+    ds_grid = xr.open_dataset(SAFRAN_GRID_FILE)
+    grid_index(ds['LON'].values, ds['LAT'].values, ds_grid['lon'].values, ds_grid['lat'].values)
 
-    
\ No newline at end of file
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for output in executor.map(reformat_safran_xy, safran_files, [args.format] * len(safran_files)):
+            print(output)
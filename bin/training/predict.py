@@ -12,6 +12,8 @@ from iriscc.lightning_module import IRISCCLightningModule
 from iriscc.plotutils import plot_test, plot_contour, plot_map_image
 from iriscc.transforms import MinMaxNormalisation, LandSeaMask, Pad, FillMissingValue, UnPad
 from iriscc.settings import GRAPHS_DIR, TARGET_SIZE, RUNS_DIR, DATASET_BC_DIR, CONFIG
+from iriscc.samplestore import load_sample
+from iriscc.compilation import PRECISIONS, autocast_context, to_memory_format
 
 
 
@@ -56,6 +58,9 @@ if __name__=='__main__':
     parser.add_argument('--exp', type=str, help='Experiment name (e.g., exp1)')   
     parser.add_argument('--test-name', type=str, help='Test name (e.g., mask_continents)')
     parser.add_argument('--cmip6-test', type=str, help='CMIP6 test (yes or no)')
+    parser.add_argument('--precision', type=str, help='32 or bf16-mixed (bf16 autocast on CPU)', 
+                        choices=list(PRECISIONS), default='32')
+    parser.add_argument('--channels-last', action='store_true', help='channels_last memory format for the model and inputs')
     args = parser.parse_args()
 
     run_dir = RUNS_DIR/f'{args.exp}/{args.test_name}/lightning_logs/version_best'
@@ -80,16 +85,19 @@ if __name__=='__main__':
     else : 
         test_name = args.test_name
     device = 'cpu'
+    context = autocast_context(args.precision, device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
 
-    sample = glob.glob(str(sample_dir/f'sample_{args.date}.npz'))[0]
-    data = dict(np.load(sample), allow_pickle=True)
+    data = load_sample(sample_dir, args.date)
     x_init, y = data['x'], data['y']
 
     condition = np.isnan(y[0])
     x, _ = transforms((x_init, y))
 
-    x = torch.unsqueeze(x, dim=0).float()
-    y_hat = model(x.to(device)).to(device)
+    x = to_memory_format(torch.unsqueeze(x, dim=0).float(), args.channels_last)
+    with torch.no_grad(), context():
+        y_hat = model(x.to(device)).to(device)
     y_hat = y_hat.detach().cpu()
 
     unpad_func = UnPad(TARGET_SIZE)
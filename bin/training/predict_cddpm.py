@@ -12,6 +12,8 @@ from iriscc.diffusionutils import generate
 from iriscc.lightning_module_ddpm import IRISCCCDDPMLightningModule
 from iriscc.transforms import MinMaxNormalisation, LandSeaMask, Pad, FillMissingValue, UnPad
 from iriscc.settings import GRAPHS_DIR, TARGET_SIZE, RUNS_DIR, DATASET_EXP1_30Y_DIR
+from iriscc.samplestore import load_sample
+from iriscc.compilation import PRECISIONS, autocast_context, to_memory_format
 
 
 def compare_4_subplots(x, y, y_hat, pixel, title, save_dir):
@@ -56,6 +58,9 @@ if __name__=='__main__':
     parser.add_argument('--exp', type=str, help='Experiment name (e.g., exp1)')   
     parser.add_argument('--test-name', type=str, help='Test name (e.g., mask_continents)')
     parser.add_argument('--cmip6-test', type=str, help='CMIP6 test (yes or no)')
+    parser.add_argument('--precision', type=str, help='32 or bf16-mixed (bf16 autocast on CPU)', 
+                        choices=list(PRECISIONS), default='32')
+    parser.add_argument('--channels-last', action='store_true', help='channels_last memory format for the model and inputs')
     args = parser.parse_args()
 
     run_dir = RUNS_DIR/f'{args.exp}/{args.test_name}/lightning_logs/version_best'
@@ -79,23 +84,26 @@ if __name__=='__main__':
     else:
         test_name = args.test_name
     device = 'cpu'
+    context = autocast_context(args.precision, device)
+    if args.channels_last:
+        model = model.to(memory_format=torch.channels_last)
 
-    sample = glob.glob(str(sample_dir/f'sample_{args.date}.npz'))[0]
-    data = dict(np.load(sample), allow_pickle=True)
+    data = load_sample(sample_dir, args.date)
     conditioning_image_init, y = data['x'], data['y']
 
     condition = np.isnan(y[0])
     conditioning_image, _ = transforms((conditioning_image_init, y))
 
-    conditioning_image = torch.unsqueeze(conditioning_image, dim=0).float()
-    intermediate_images = generate(model.model,
-                                   conditioning_image, 
-                                   n_samples=2,
-                                   neighbours=False, 
-                                   std=1e-1, 
-                                   start_t = None, 
-                                   clamp=None, 
-                                   device='cpu')
+    conditioning_image = to_memory_format(torch.unsqueeze(conditioning_image, dim=0).float(), args.channels_last)
+    with torch.no_grad(), context():
+        intermediate_images = generate(model.model,
+                                       conditioning_image, 
+                                       n_samples=2,
+                                       neighbours=False, 
+                                       std=1e-1, 
+                                       start_t = None, 
+                                       clamp=None, 
+                                       device=device)
     print(len(intermediate_images))
     print(intermediate_images[-1].shape)
     y_hat = intermediate_images[-1][0,...]
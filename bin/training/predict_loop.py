@@ -8,8 +8,9 @@ import argparse
 import numpy as np
 from torchvision.transforms import v2
 
+from iriscc.ncpool import open_dataset
 from iriscc.lightning_module import IRISCCLightningModule
-from iriscc.transforms import MinMaxNormalisation, LandSeaMask, Pad, FillMissingValue, UnPad
+from iriscc.transforms import LandSeaMask, Pad, FillMissingValue, UnPad, get_normalisation
 from iriscc.settings import (PREDICTION_DIR, 
                              TARGET_SAFRAN_FILE, 
                              TARGET_SIZE, 
@@ -18,11 +19,18 @@ from iriscc.settings import (PREDICTION_DIR,
                              DATES_BC_TEST_HIST,
                              DATES_BC_TRAIN_HIST)
 from iriscc.datautils import standardize_longitudes, remove_countries
+from iriscc.samplestore import load_sample
+from iriscc.compilation import COMPILE_MODES, PRECISIONS, compile_model, autocast_context, to_memory_format
 
 parser = argparse.ArgumentParser(description="Predict and plot results for full period")
 parser.add_argument('--exp', type=str, help='Experiment name (e.g., exp1)')   
 parser.add_argument('--test-name', type=str, help='Test name (e.g., mask_continents)')
 parser.add_argument('--cmip6-test', type=str, help='cmip6 or cmip6_bc', default=None)
+parser.add_argument('--compile-mode', type=str, help='torch.compile mode of the model', 
+                    choices=['none'] + COMPILE_MODES[1:], default='none')
+parser.add_argument('--precision', type=str, help='32 or bf16-mixed (bf16 autocast on CPU)', 
+                    choices=list(PRECISIONS), default='32')
+parser.add_argument('--channels-last', action='store_true', help='channels_last memory format for the model and inputs')
 args = parser.parse_args()
 
 dates = DATES_BC_TRAIN_HIST
@@ -36,7 +44,7 @@ hparams = model.hparams['hparams']
 arch = hparams['model']
 
 transforms = v2.Compose([
-            MinMaxNormalisation(hparams['sample_dir'], hparams['output_norm']), 
+            get_normalisation(hparams), 
             LandSeaMask(hparams['mask'], hparams['fill_value']),
             FillMissingValue(hparams['fill_value']),
             Pad(hparams['fill_value'])
@@ -49,12 +57,22 @@ if args.cmip6_test == 'cmip6' or args.cmip6_test == 'cmip6_bc':
 else:
     test_name = args.test_name
 device = 'cpu'
+context = autocast_context(args.precision, device)
+if args.channels_last:
+    model = model.to(memory_format=torch.channels_last)
+
+# The graph of the (1, C, H, W) inputs is compiled once, before the loop
+example = to_memory_format(torch.randn(1, hparams['in_channels'], *hparams['img_size'], device=device), args.channels_last)
+report = compile_model(model.model, args.compile_mode, example, train=False, context=context)
+if report:
+    print(f"torch.compile ({args.compile_mode}): {report['eager_time']*1e3:.1f} ms -> "
+          f"{report['compiled_time']*1e3:.1f} ms per sample (x{report['speedup']:.2f})")
 
 startdate = dates[0].date().strftime('%d/%m/%Y')
 enddate = dates[-1].date().strftime('%d/%m/%Y')
 period = f'{startdate} - {enddate}'
 
-ds_target = xr.open_dataset(TARGET_SAFRAN_FILE).isel(time=0)
+ds_target = open_dataset(TARGET_SAFRAN_FILE).isel(time=0)
 ds_target = standardize_longitudes(ds_target)
 y = ds_target.tas.values
 
@@ -70,13 +88,13 @@ y = np.expand_dims(y, axis= 0)
 for i, date in enumerate(dates):
     print(date)
     date_str = date.date().strftime('%Y%m%d')
-    sample = glob.glob(str(sample_dir/f'sample_{date_str}.npz'))[0]
-    data = dict(np.load(sample), allow_pickle=True)
+    data = load_sample(sample_dir, date_str)
 
     x = data['x']
-    x, _ = transforms((x, y))
-    x = torch.unsqueeze(x, dim=0).float()
-    y_hat = model(x.to(device)).to(device)
+    x, _ = transforms((x, y, date.dayofyear - 1))
+    x = to_memory_format(torch.unsqueeze(x, dim=0).float(), args.channels_last)
+    with torch.no_grad(), context():
+        y_hat = model(x.to(device)).to(device)
     y_hat = y_hat.detach().cpu()
 
     unpad_func = UnPad(TARGET_SIZE)
@@ -85,7 +103,7 @@ for i, date in enumerate(dates):
 
     ds.tas[i] = y_hat
 
-ds_ref = xr.open_dataset(PREDICTION_DIR/f'tas_day_CNRM-CM6-1_historical_r1i1p1f2_gr_20000101_20141231_exp3_swinunet_all_cmip6_bc.nc')
+ds_ref = open_dataset(PREDICTION_DIR/f'tas_day_CNRM-CM6-1_historical_r1i1p1f2_gr_20000101_20141231_exp3_swinunet_all_cmip6_bc.nc')
 ds_all = xr.concat([ds, ds_ref], dim='time')
 
 ds_all.to_netcdf(PREDICTION_DIR/f'tas_day_CNRM-CM6-1_historical_r1i1p1f2_gr_19800101_20141231_{args.exp}_{test_name}.nc')
\ No newline at end of file
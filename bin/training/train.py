@@ -11,6 +11,7 @@ from iriscc.dataloaders import get_dataloaders
 from iriscc.hparams import IRISCCHyperParameters
 from iriscc.lightning_module import IRISCCLightningModule
 from iriscc.lightning_module_ddpm import IRISCCCDDPMLightningModule
+from iriscc.callbacks import ThroughputMonitor
 
 torch.cuda.is_available()
 
@@ -39,11 +40,11 @@ torch.set_float32_matmul_precision('high')
 trainer = pl.Trainer(max_epochs=hparams.max_epoch, 
                      default_root_dir=hparams.runs_dir,
                      log_every_n_steps=1,
-                     accelerator="gpu",
+                     accelerator=hparams.accelerator,
                      devices="auto",
-                     precision='16-mixed',
+                     precision=hparams.precision,
                      logger=logger,
-                     callbacks=checkpoint_callback)
+                     callbacks=[checkpoint_callback, ThroughputMonitor()])
 
 trainer.fit(model, train_dataloaders=train_dataloader, val_dataloaders=val_dataloader)
 trainer.test(model, dataloaders=test_dataloader, ckpt_path='best')
\ No newline at end of file
@@ -11,21 +11,23 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 
 from iriscc.settings import DATASET_BC_DIR
+from iriscc.samplestore import load_period
 
 
-train_hist = dict(np.load(DATASET_BC_DIR/'bc_train_hist.npz'))
-test_hist = dict(np.load(DATASET_BC_DIR/'bc_test_hist.npz'))
-test_future = dict(np.load(DATASET_BC_DIR/'bc_test_future.npz'))
+train_hist = load_period(DATASET_BC_DIR/'bc_train_hist')
+test_hist = load_period(DATASET_BC_DIR/'bc_test_hist')
+test_future = load_period(DATASET_BC_DIR/'bc_test_future')
 
-era5_hist = np.mean(train_hist['era5'], axis = (1,2))
-cmip6_hist = np.mean(train_hist['cmip6'], axis = (1,2))
+# Spatial means are read from the memory-mapped arrays, or chunk by chunk when the periods are stored as Zarr
+era5_hist = np.asarray(np.mean(train_hist['era5'], axis = (1,2)))
+cmip6_hist = np.asarray(np.mean(train_hist['cmip6'], axis = (1,2)))
 dates_hist = train_hist['dates']
 
-era5_test = np.mean(test_hist['era5'], axis = (1,2))
-cmip6_test = np.mean(test_hist['cmip6'], axis = (1,2))
+era5_test = np.asarray(np.mean(test_hist['era5'], axis = (1,2)))
+cmip6_test = np.asarray(np.mean(test_hist['cmip6'], axis = (1,2)))
 dates_test = test_hist['dates']
 
-cmip6_test_future = np.mean(test_future['cmip6'], axis = (1,2))
+cmip6_test_future = np.asarray(np.mean(test_future['cmip6'], axis = (1,2)))
 dates_test_future = test_future['dates']
 
 df_cmip6 = pd.DataFrame({'dates' : np.concatenate((dates_hist, 
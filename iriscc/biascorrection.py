@@ -0,0 +1,299 @@
+''' Vectorised empirical quantile mapping and CDF-t bias correction of whole grids '''
+
+import sys
+sys.path.append('.')
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional, Union
+
+
+def interp_columns(x: np.ndarray, xp: np.ndarray, fp: np.ndarray) -> np.ndarray:
+    """
+    Linear interpolation of every column of x (N, P) on its own table (xp, fp) of shape
+    (K, P), xp being sorted along its first axis. Values outside a table are clamped.
+
+    The columns are shifted by increasing offsets so that all the tables form a single
+    sorted sequence, interpolated in one `np.interp` call instead of P calls. Columns
+    with missing values in their table return NaN.
+    """
+    K, P = xp.shape
+    valid = ~(np.isnan(xp).any(axis=0) | np.isnan(fp).any(axis=0))
+    xp = np.where(valid, xp, np.arange(K).reshape(-1, 1))
+    fp = np.where(valid, fp, 0.)
+    x = np.clip(x, xp[0], xp[-1])
+    span = float(np.max(xp[-1] - xp[0])) + 1.
+    offset = np.arange(P) * span - xp[0]
+    y = np.interp((x + offset).ravel(),
+                  (xp + offset).T.ravel(),
+                  fp.T.ravel()).reshape(x.shape)
+    y[:, ~valid] = np.nan
+    return y
+
+
+def quantile_tables(data: np.ndarray,
+                    months: Optional[np.ndarray],
+                    probabilities: np.ndarray) -> np.ndarray:
+    """
+    Returns the quantiles (12, K, P) of every pixel of a (T, P) series for each month,
+    or (1, K, P) if months is None, computed along the time axis.
+    """
+    if months is None:
+        return np.nanquantile(data, probabilities, axis=0)[np.newaxis]
+    return np.stack([np.nanquantile(data[months == m], probabilities, axis=0) for m in range(1, 13)])
+
+
+def correct(x: np.ndarray, source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """
+    Maps the values x (N, P) from the quantiles `source` to the quantiles `target` (K, P).
+    Outside the range of `source`, the correction of the closest quantile is applied.
+    """
+    return x + interp_columns(x, source, target - source)
+
+
+def cdft_table(q_cf: np.ndarray, q_ch: np.ndarray, q_oh: np.ndarray, probabilities: np.ndarray) -> np.ndarray:
+    """
+    Returns the CDF-t corrected quantiles q_cf(F_ch(q_oh(p))) of the future period,
+    i.e. the quantiles of the future observations F_of = F_oh(F_ch^-1(F_cf)).
+    """
+    p = np.broadcast_to(probabilities.reshape(-1, 1), q_cf.shape)
+    p_ch = interp_columns(q_oh, q_ch, p) # F_ch(q_oh(p))
+    return interp_columns(p_ch, p, q_cf)
+
+
+def _fit_block(obs, cm_hist, months_obs, months_hist, probabilities):
+    return quantile_tables(obs, months_obs, probabilities), quantile_tables(cm_hist, months_hist, probabilities)
+
+
+def _apply_block(method, x, months, windows, q_oh, q_ch, probabilities):
+    y = np.empty_like(x)
+    for i in range(len(q_oh)):
+        in_month = np.ones(len(x), dtype=bool) if months is None else months == i + 1
+        if method == 'qm':
+            y[in_month] = correct(x[in_month], q_ch[i], q_oh[i])
+            continue
+        for centre, window in windows:
+            window = window & in_month
+            centre = centre & in_month
+            if not centre.any():
+                continue
+            q_cf = np.nanquantile(x[window], probabilities, axis=0)
+            y[centre] = correct(x[centre], q_cf, cdft_table(q_cf, q_ch[i], q_oh[i], probabilities))
+    return y
+
+
+class QuantileDebiaser:
+    """
+    Base class of the quantile-based debiasers working on whole (time, lat, lon) arrays.
+
+    The quantiles of the observations (q_oh) and of the historical simulation (q_ch) are
+    computed for every pixel and month at once, along the time axis. With n_workers > 1,
+    the grid is split in blocks of pixels processed in parallel.
+
+    The fitted tables are saved with `save` and reloaded with `load`, so new scenarios
+    are corrected without refitting.
+
+    Attributes:
+        n_quantiles (int): Number of quantiles of the tables.
+        by_month (bool): Fits and applies one transfer function per calendar month.
+        q_oh (np.ndarray): Observation quantiles (12 or 1, n_quantiles, lat, lon).
+        q_ch (np.ndarray): Historical simulation quantiles (12 or 1, n_quantiles, lat, lon).
+        fit_key (str): Hash of the fitted inputs and settings (see `fit_hash`).
+    """
+    method = None
+
+    def __init__(self, n_quantiles: int = 100, by_month: bool = True) -> None:
+        self.n_quantiles = n_quantiles
+        self.by_month = by_month
+        self.q_oh = None
+        self.q_ch = None
+        self.fit_key = ''
+
+    @property
+    def probabilities(self) -> np.ndarray:
+        return np.linspace(0., 1., self.n_quantiles)
+
+    def months(self, time: np.ndarray) -> Optional[np.ndarray]:
+        return pd.DatetimeIndex(time).month.values if self.by_month else None
+
+    def windows(self, time: np.ndarray) -> List[tuple]:
+        """
+        Returns the (corrected, fitted) masks of the time steps of each period of
+        the series to correct. The whole series by default.
+        """
+        everything = np.ones(len(time), dtype=bool)
+        return [(everything, everything)]
+
+    def fit_hash(self,
+                 obs: np.ndarray,
+                 cm_hist: np.ndarray,
+                 time_obs: np.ndarray,
+                 time_cm_hist: np.ndarray) -> str:
+        """
+        Returns a hash of the method, the settings and the inputs of `fit`, saved with
+        the tables so that a saved debiaser is only reused for the same training data.
+        """
+        h = hashlib.md5()
+        h.update(str(self.method).encode())
+        h.update(str(sorted(self.settings().items())).encode())
+        for array in (obs, cm_hist, time_obs, time_cm_hist):
+            array = np.asarray(array)
+            array = np.ascontiguousarray(array.astype(str) if array.dtype.kind == 'O' else array)
+            h.update(str((array.shape, array.dtype.str)).encode())
+            h.update(array.view(np.uint8).ravel())
+        return h.hexdigest()
+
+    def fit(self,
+            obs: np.ndarray,
+            cm_hist: np.ndarray,
+            time_obs: np.ndarray,
+            time_cm_hist: np.ndarray,
+            n_workers: int = 1) -> 'QuantileDebiaser':
+        """
+        Computes the quantile tables of the observations and of the historical simulation.
+
+        Args:
+            obs (np.ndarray): Observations (T_obs, lat, lon).
+            cm_hist (np.ndarray): Historical simulation (T_hist, lat, lon) on the same grid.
+            time_obs (np.ndarray): Dates of the observations.
+            time_cm_hist (np.ndarray): Dates of the historical simulation.
+            n_workers (int): Number of worker processes (spatial split).
+        """
+        self.fit_key = self.fit_hash(obs, cm_hist, time_obs, time_cm_hist)
+        shape = np.shape(obs)[1:]
+        obs = np.asarray(obs).reshape(len(obs), -1)
+        cm_hist = np.asarray(cm_hist).reshape(len(cm_hist), -1)
+        months_obs, months_hist = self.months(time_obs), self.months(time_cm_hist)
+        blocks = np.array_split(np.arange(obs.shape[1]), n_workers)
+        if n_workers == 1:
+            q_oh, q_ch = _fit_block(obs, cm_hist, months_obs, months_hist, self.probabilities)
+        else:
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                results = list(executor.map(_fit_block,
+                                            [obs[:, b] for b in blocks],
+                                            [cm_hist[:, b] for b in blocks],
+                                            [months_obs] * n_workers,
+                                            [months_hist] * n_workers,
+                                            [self.probabilities] * n_workers))
+            q_oh = np.concatenate([r[0] for r in results], axis=-1)
+            q_ch = np.concatenate([r[1] for r in results], axis=-1)
+        self.q_oh = q_oh.reshape(q_oh.shape[:2] + shape)
+        self.q_ch = q_ch.reshape(q_ch.shape[:2] + shape)
+        return self
+
+    def apply(self,
+              cm_future: np.ndarray,
+              time_cm_future: np.ndarray,
+              n_workers: int = 1) -> np.ndarray:
+        """
+        Corrects a simulation (T, lat, lon) on the grid of the fitted tables.
+
+        Args:
+            cm_future (np.ndarray): Simulation to correct.
+            time_cm_future (np.ndarray): Dates of the simulation.
+            n_workers (int): Number of worker processes (spatial split).
+
+        Returns:
+            np.ndarray: The corrected simulation (T, lat, lon).
+        """
+        if self.q_oh is None:
+            raise RuntimeError('The debiaser must be fitted or loaded before being applied')
+        shape = np.shape(cm_future)
+        x = np.asarray(cm_future).reshape(len(cm_future), -1)
+        q_oh = self.q_oh.reshape(self.q_oh.shape[:2] + (-1,))
+        q_ch = self.q_ch.reshape(self.q_ch.shape[:2] + (-1,))
+        months, windows = self.months(time_cm_future), self.windows(time_cm_future)
+        if n_workers == 1:
+            y = _apply_block(self.method, x, months, windows, q_oh, q_ch, self.probabilities)
+        else:
+            blocks = np.array_split(np.arange(x.shape[1]), n_workers)
+            with ProcessPoolExecutor(max_workers=n_workers) as executor:
+                y = np.concatenate(list(executor.map(_apply_block,
+                                                     [self.method] * n_workers,
+                                                     [x[:, b] for b in blocks],
+                                                     [months] * n_workers,
+                                                     [windows] * n_workers,
+                                                     [q_oh[..., b] for b in blocks],
+                                                     [q_ch[..., b] for b in blocks],
+                                                     [self.probabilities] * n_workers)), axis=-1)
+        return y.reshape(shape)
+
+    def save(self, path: Union[str, Path]) -> Path:
+        """
+        Saves the fitted tables and settings to a .npz file.
+        """
+        path = Path(path).with_suffix('.npz')
+        tmp_path = path.with_suffix('.tmp.npz')
+        np.savez(tmp_path, method=self.method, q_oh=self.q_oh, q_ch=self.q_ch, fit_key=self.fit_key, **self.settings())
+        os.replace(tmp_path, path)
+        return path
+
+    def settings(self) -> dict:
+        return {'n_quantiles': self.n_quantiles, 'by_month': self.by_month}
+
+    @staticmethod
+    def load(path: Union[str, Path]) -> 'QuantileDebiaser':
+        """
+        Returns the debiaser saved in a .npz file, ready to be applied.
+        """
+        with np.load(Path(path).with_suffix('.npz')) as data:
+            data = {key: data[key] for key in data.files}
+        debiaser = DEBIASERS[str(data.pop('method'))]
+        q_oh, q_ch = data.pop('q_oh'), data.pop('q_ch')
+        fit_key = str(data.pop('fit_key', ''))
+        debiaser = debiaser(**{key: value.item() for key, value in data.items()})
+        debiaser.q_oh, debiaser.q_ch, debiaser.fit_key = q_oh, q_ch, fit_key
+        return debiaser
+
+
+class QuantileMapping(QuantileDebiaser):
+    """
+    Empirical quantile mapping: x -> q_oh(F_ch(x)), with the tables of the historical period.
+    """
+    method = 'qm'
+
+
+class CDFt(QuantileDebiaser):
+    """
+    CDF-transform (Michelangeli et al., 2009): x -> q_cf(F_ch(q_oh(F_cf(x)))), F_cf being
+    the distribution of the simulation to correct. Only the historical tables are fitted:
+    F_cf is computed from the corrected series itself, by month and by running windows
+    of `window_years` years of which the central `step_years` are corrected (the whole
+    series if window_years is None).
+
+    Attributes:
+        window_years (Optional[int]): Length of the running windows in years.
+        step_years (int): Number of corrected years per window.
+    """
+    method = 'cdft'
+
+    def __init__(self,
+                 n_quantiles: int = 100,
+                 by_month: bool = True,
+                 window_years: Optional[int] = 17,
+                 step_years: int = 9) -> None:
+        super().__init__(n_quantiles, by_month)
+        self.window_years = window_years or None # saved as 0
+        self.step_years = step_years
+
+    def settings(self) -> dict:
+        return {**super().settings(), 'window_years': self.window_years or 0, 'step_years': self.step_years}
+
+    def windows(self, time: np.ndarray) -> List[tuple]:
+        years = pd.DatetimeIndex(time).year.values
+        if self.window_years is None or years.max() - years.min() < self.window_years:
+            return super().windows(time)
+        windows = []
+        for start in range(years.min(), years.max() + 1, self.step_years):
+            centre = (years >= start) & (years < start + self.step_years)
+            first = min(max(start + self.step_years // 2 - self.window_years // 2, years.min()),
+                        years.max() + 1 - self.window_years)
+            windows.append((centre, (years >= first) & (years < first + self.window_years)))
+        return windows
+
+
+DEBIASERS = {'qm': QuantileMapping, 'cdft': CDFt}
@@ -0,0 +1,89 @@
+''' Parallel and resumable dataset building '''
+
+import sys
+sys.path.append('.')
+
+import os
+import json
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, List, Optional, Tuple, Union
+
+
+class ProgressManifest:
+    """
+    Keeps the list of the completed tasks of a build in a JSON file, so that a killed
+    build resumes where it stopped.
+
+    Attributes:
+        path (Path): Path of the manifest file.
+        completed (set): Keys of the completed tasks.
+    """
+    def __init__(self, path: Union[str, Path]) -> None:
+        self.path = Path(path)
+        self.completed = set()
+        if self.path.exists():
+            with open(self.path) as f:
+                self.completed = set(json.load(f)['completed'])
+
+    def done(self, task) -> bool:
+        return str(task) in self.completed
+
+    def add(self, task) -> None:
+        self.completed.add(str(task))
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump({'completed': sorted(self.completed)}, f)
+        os.replace(tmp_path, self.path)
+
+
+def run_build(tasks: Iterable,
+              build_func: Callable[[object], List[Tuple[object, dict]]],
+              writer,
+              n_workers: int = 1,
+              manifest_path: Optional[Union[str, Path]] = None) -> None:
+    """
+    Builds a dataset by running `build_func` on each task (a date or a year) in a process pool.
+
+    Tasks run in parallel but their samples are written in the order of `tasks` by the
+    calling process, so every output backend can be used. At most two tasks per worker
+    are in flight to bound memory. Samples already present and valid in the output are
+    skipped, and completed tasks are recorded in the manifest.
+
+    Args:
+        tasks (Iterable): Tasks to run, e.g. the years or dates of the dataset.
+        build_func (Callable): Module-level function returning the list of (date, sample)
+            pairs of a task.
+        writer: Sample writer exposing `exists(date)`, `write(date, sample)` and `flush()`.
+        n_workers (int): Number of worker processes. With 1 worker tasks run in the
+            calling process.
+        manifest_path (Optional[Union[str, Path]]): Path of the progress manifest.
+    """
+    manifest = ProgressManifest(manifest_path) if manifest_path is not None else None
+    tasks = [task for task in tasks if manifest is None or not manifest.done(task)]
+
+    def write(task, samples):
+        for date, sample in samples:
+            if not writer.exists(date):
+                writer.write(date, sample)
+        writer.flush()
+        if manifest is not None:
+            manifest.add(task)
+        print(f'{task} done')
+
+    if n_workers == 1:
+        for task in tasks:
+            write(task, build_func(task))
+        return
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append((task, executor.submit(build_func, task)))
+            if len(pending) >= 2 * n_workers:
+                task_done, future = pending.popleft()
+                write(task_done, future.result())
+        while pending:
+            task_done, future = pending.popleft()
+            write(task_done, future.result())
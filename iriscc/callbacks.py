@@ -0,0 +1,172 @@
+''' Lightning callbacks shared by the IRISCC modules '''
+
+import sys
+sys.path.append('.')
+
+import os
+import csv
+import time
+import resource
+import torch
+import pytorch_lightning as pl
+from pytorch_lightning.utilities import rank_zero_info
+from pathlib import Path
+from typing import Dict, List, Optional
+
+STAGES = ['data', 'transfer', 'forward', 'backward', 'optimizer']
+TRANSFER_HOOKS = ['on_before_batch_transfer', 'on_after_batch_transfer']
+
+
+class ThroughputMonitor(pl.Callback):
+    """
+    Records the time spent in each stage of the training steps and the training throughput.
+
+    Per step, the stages are:
+        - data: waiting for the DataLoader (from the end of the previous step),
+        - transfer: host to device copy and batched transforms (`on_after_batch_transfer`),
+        - forward: training_step (forward pass and loss),
+        - backward: loss.backward(),
+        - optimizer: optimizer step.
+
+    The step timings are written to 'throughput.csv' in the log directory, and the epoch
+    means, samples/s and peak memory are logged to TensorBoard ('throughput/...'), with
+    the eager and compiled step times of a compiled model ('throughput/compile_...').
+    A step whose data stage dominates is I/O-bound, otherwise it is compute-bound.
+
+    Attributes:
+        synchronize (bool): Waits for the CUDA kernels at each timing point, so that the
+            asynchronous GPU work is counted in the right stage (slightly slower steps).
+    """
+    def __init__(self, synchronize: bool = True) -> None:
+        super().__init__()
+        self.synchronize = synchronize
+        self.rows: List[Dict[str, float]] = []
+        self.step: Dict[str, float] = {}
+        self.last_end: Optional[float] = None
+        self.csv_path: Optional[Path] = None
+
+    def now(self, pl_module: pl.LightningModule) -> float:
+        if self.synchronize and pl_module.device.type == 'cuda':
+            torch.cuda.synchronize(pl_module.device)
+        return time.perf_counter()
+
+    def setup(self, trainer: pl.Trainer, pl_module: pl.LightningModule, stage: str) -> None:
+        # The transfer hooks are module hooks: they are wrapped once, for the fit stage,
+        # to time the copy, and restored in teardown
+        if stage != 'fit' or getattr(pl_module, '_throughput_hooks', None) is not None:
+            return
+        before, after = pl_module.on_before_batch_transfer, pl_module.on_after_batch_transfer
+        # Hooks already overridden on the instance are put back in teardown
+        pl_module._throughput_hooks = {name: pl_module.__dict__.get(name) for name in TRANSFER_HOOKS}
+
+        def on_before_batch_transfer(batch, dataloader_idx):
+            if pl_module.training:
+                self.step['transfer_start'] = self.now(pl_module)
+            return before(batch, dataloader_idx)
+
+        def on_after_batch_transfer(batch, dataloader_idx):
+            batch = after(batch, dataloader_idx)
+            if pl_module.training:
+                self.step['transfer_end'] = self.now(pl_module)
+            return batch
+
+        pl_module.on_before_batch_transfer = on_before_batch_transfer
+        pl_module.on_after_batch_transfer = on_after_batch_transfer
+        if trainer.logger is not None and trainer.logger.log_dir is not None:
+            self.csv_path = Path(trainer.logger.log_dir) / 'throughput.csv'
+
+    def teardown(self, trainer: pl.Trainer, pl_module: pl.LightningModule, stage: str) -> None:
+        if stage != 'fit' or getattr(pl_module, '_throughput_hooks', None) is None:
+            return
+        for name, hook in pl_module._throughput_hooks.items():
+            if hook is None:
+                del pl_module.__dict__[name] # the class hook is used again
+            else:
+                pl_module.__dict__[name] = hook
+        pl_module._throughput_hooks = None
+
+    def on_train_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        # Set by the module when hparams 'compile_mode' is not None (see compile_model)
+        report = getattr(pl_module, 'compile_report', None)
+        if not report:
+            return
+        rank_zero_info(f"torch.compile ({pl_module.compile_mode}): compiled in {report['compile_time']:.1f} s, "
+                       f"{report['eager_time']*1e3:.1f} ms -> {report['compiled_time']*1e3:.1f} ms per step "
+                       f"(x{report['speedup']:.2f})")
+        if trainer.logger is not None:
+            for name, value in report.items():
+                trainer.logger.experiment.add_scalar(f'throughput/compile_{name}', value, 0)
+
+    def on_train_epoch_start(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        self.rows = []
+        if pl_module.device.type == 'cuda':
+            torch.cuda.reset_peak_memory_stats(pl_module.device)
+        self.last_end = self.now(pl_module)
+
+    def on_train_batch_start(self, trainer, pl_module, batch, batch_idx) -> None:
+        self.step['forward_start'] = self.now(pl_module)
+        self.step['samples'] = len(batch[0])
+
+    def on_before_backward(self, trainer, pl_module, loss) -> None:
+        self.step['backward_start'] = self.now(pl_module)
+
+    def on_after_backward(self, trainer, pl_module) -> None:
+        self.step['backward_end'] = self.now(pl_module)
+
+    def on_before_optimizer_step(self, trainer, pl_module, optimizer) -> None:
+        self.step['optimizer_start'] = self.now(pl_module)
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx) -> None:
+        end = self.now(pl_module)
+        step = self.step
+        transfer_start = step.get('transfer_start', step['forward_start'])
+        transfer_end = step.get('transfer_end', step['forward_start'])
+        backward_start = step.get('backward_start', end)
+        backward_end = step.get('backward_end', backward_start)
+        optimizer_start = step.get('optimizer_start', backward_end)
+        self.rows.append({'epoch': trainer.current_epoch,
+                          'step': trainer.global_step,
+                          'samples': step['samples'],
+                          'data': transfer_start - self.last_end,
+                          'transfer': transfer_end - transfer_start,
+                          'forward': backward_start - step['forward_start'],
+                          'backward': backward_end - backward_start,
+                          'optimizer': end - optimizer_start,
+                          'total': end - self.last_end})
+        self.last_end = end
+        self.step = {}
+
+    def peak_memory(self, pl_module: pl.LightningModule) -> float:
+        """
+        Returns the peak memory in MiB: allocated on the GPU, resident on the host otherwise.
+        """
+        if pl_module.device.type == 'cuda':
+            return torch.cuda.max_memory_allocated(pl_module.device) / 2**20
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10 # KiB on Linux
+
+    def on_train_epoch_end(self, trainer: pl.Trainer, pl_module: pl.LightningModule) -> None:
+        if not self.rows:
+            return
+        epoch = trainer.current_epoch
+        # The validation loop runs before this hook: only the training steps are counted
+        duration = max(sum(row['total'] for row in self.rows), 1e-12)
+        samples = sum(row['samples'] for row in self.rows)
+        scalars = {f'{stage}_time': sum(row[stage] for row in self.rows) / len(self.rows) for stage in STAGES}
+        scalars['samples_per_sec'] = samples / duration
+        scalars['data_fraction'] = sum(row['data'] for row in self.rows) / duration
+        scalars['peak_memory_mib'] = self.peak_memory(pl_module)
+
+        if trainer.logger is not None:
+            for name, value in scalars.items():
+                trainer.logger.experiment.add_scalar(f'throughput/{name}', value, epoch)
+        pl_module.log('samples_per_sec', scalars['samples_per_sec'], on_step=False, on_epoch=True, prog_bar=True)
+
+        if self.csv_path is not None and trainer.is_global_zero:
+            new_file = not self.csv_path.exists()
+            os.makedirs(self.csv_path.parent, exist_ok=True)
+            with open(self.csv_path, 'a', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=list(self.rows[0]))
+                if new_file:
+                    writer.writeheader()
+                writer.writerows(self.rows)
+        self.rows = []
@@ -0,0 +1,146 @@
+''' Execution modes of the IRISCC models: torch.compile, autocast precision and memory format '''
+
+import sys
+sys.path.append('.')
+
+import time
+import contextlib
+import torch
+import torch.nn as nn
+from functools import partial
+from typing import Callable, ContextManager, Dict, Optional
+
+COMPILE_MODES = [None, 'default', 'reduce-overhead', 'max-autotune']
+# Lightning precision names and their autocast dtype (None : fp32)
+PRECISIONS = {'32': None, '32-true': None, '16-mixed': torch.float16, 'bf16-mixed': torch.bfloat16}
+
+
+def autocast_context(precision: str, device: torch.device) -> Callable[[], ContextManager]:
+    """
+    Returns the autocast context of a Lightning precision outside of a Trainer
+    (e.g. the prediction scripts): 'bf16-mixed' runs the convolutions and matmuls
+    in bfloat16, on CPU as well as on GPU.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision {precision}, expected one of {list(PRECISIONS)}')
+    if PRECISIONS[precision] is None:
+        return contextlib.nullcontext
+    return partial(torch.autocast, device_type=torch.device(device).type, dtype=PRECISIONS[precision])
+
+
+def to_memory_format(x: torch.Tensor, channels_last: bool) -> torch.Tensor:
+    """
+    Returns a (B, C, H, W) batch in the channels_last memory format if channels_last,
+    unchanged otherwise (no copy if it is already in this format).
+    """
+    if channels_last and x.ndim == 4:
+        return x.contiguous(memory_format=torch.channels_last)
+    return x
+
+
+def get_compile_mode(mode: Optional[str]) -> Optional[str]:
+    """
+    Returns the torch.compile mode of hparams['compile_mode'] ('none' is the same as None).
+    """
+    mode = None if mode == 'none' else mode
+    if mode not in COMPILE_MODES:
+        raise ValueError(f'Unknown compile mode {mode}, expected one of {COMPILE_MODES}')
+    return mode
+
+
+def compile_function(func: Callable, mode: Optional[str]) -> Callable:
+    """
+    Returns func compiled with torch.compile (dynamic shapes, so the batch sizes of
+    training, evaluation and the last batches share one graph), or func if mode is None.
+    """
+    mode = get_compile_mode(mode)
+    if mode is None:
+        return func
+    return torch.compile(func, mode=mode, dynamic=True)
+
+
+def synchronize(device: torch.device) -> None:
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+
+def run_model(model: nn.Module,
+              example: torch.Tensor,
+              train: bool = False,
+              context: Callable[[], ContextManager] = contextlib.nullcontext) -> None:
+    """
+    Runs the model once on an example batch: forward and backward passes for training,
+    forward pass without gradients for inference. The first call of a compiled model
+    builds and caches its graph for the shape of the example.
+    """
+    with context():
+        if train:
+            model(example).float().mean().backward()
+        else:
+            with torch.no_grad():
+                model(example)
+    synchronize(example.device)
+
+
+def time_model(model: nn.Module,
+               example: torch.Tensor,
+               train: bool = False,
+               n_iters: int = 3,
+               context: Callable[[], ContextManager] = contextlib.nullcontext) -> float:
+    ''' Returns the mean duration of a step in seconds '''
+    start = time.perf_counter()
+    for _ in range(n_iters):
+        run_model(model, example, train, context)
+    return (time.perf_counter() - start) / n_iters
+
+
+def compile_model(model: nn.Module,
+                  mode: Optional[str],
+                  example: torch.Tensor,
+                  train: bool = False,
+                  n_iters: int = 3,
+                  context: Callable[[], ContextManager] = contextlib.nullcontext) -> Dict[str, float]:
+    """
+    Compiles a model in place (nn.Module.compile, so the state dict keys and the
+    checkpoints are unchanged) and warms it up on an example batch.
+
+    The eager and compiled steps are timed on the example. The gradients and the buffers
+    (BatchNorm running statistics) modified by the training steps are restored.
+    Inductor generates C++ kernels on CPU, so the modes also work on CPU-only nodes
+    ('reduce-overhead' only adds CUDA graphs on GPU).
+
+    Args:
+        model (nn.Module): Model to compile.
+        mode (str, optional): torch.compile mode, see COMPILE_MODES. Nothing is done if None.
+        example (torch.Tensor): Batch of shape (B, C, H, W) on the device of the model.
+        train (bool): Times training steps (forward and backward) instead of inference.
+        n_iters (int): Number of timed steps.
+        context (Callable): Context of the steps, e.g. the autocast of the trainer precision.
+
+    Returns:
+        Dict[str, float]: 'eager_time', 'compile_time', 'compiled_time' (seconds) and 'speedup',
+        empty if the model is not compiled.
+    """
+    mode = get_compile_mode(mode)
+    if mode is None:
+        return {}
+    was_training = model.training
+    model.train(train)
+    buffers = {name: buffer.clone() for name, buffer in model.named_buffers()}
+
+    eager_time = time_model(model, example, train, n_iters, context)
+    model.compile(mode=mode)
+    start = time.perf_counter()
+    run_model(model, example, train, context)
+    compile_time = time.perf_counter() - start
+    compiled_time = time_model(model, example, train, n_iters, context)
+
+    with torch.no_grad():
+        for name, buffer in model.named_buffers():
+            buffer.copy_(buffers[name])
+    model.zero_grad(set_to_none=True)
+    model.train(was_training)
+    return {'eager_time': eager_time,
+            'compile_time': compile_time,
+            'compiled_time': compiled_time,
+            'speedup': eager_time / max(compiled_time, 1e-12)}
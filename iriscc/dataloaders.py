@@ -4,15 +4,22 @@ sys.path.append('.')
 from torch.utils.data import Dataset, DataLoader
 from torchvision.transforms import v2
 import numpy as np
+import pandas as pd
 import torch
 import glob
+import os
+import time
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 from torch import Tensor
 
 
 from iriscc.hparams import IRISCCHyperParameters
-from iriscc.transforms import MinMaxNormalisation, LandSeaMask, Pad, FillMissingValue, DeMinMaxNormalisation, DomainCrop
+from iriscc.samplestore import MemmapSampleStore, ZarrSampleStore, load_static, merge_static, sample_date
+from iriscc.transformcache import TransformCache, transform_hash
+from iriscc.settings import TRAIN_END, VAL_END
+from iriscc.transforms import (LandSeaMask, Pad, FillMissingValue, DeMinMaxNormalisation, DomainCrop, get_normalisation,
+                               BatchStaticChannels, BatchLandSeaMask, BatchFillMissingValue, BatchDomainCrop, BatchPad)
 from iriscc.plotutils import plot_test
 
 class IRISCC(Dataset):
@@ -24,24 +31,49 @@ class IRISCC(Dataset):
         A custom PyTorch Dataset for loading and transforming IRISCC data.
 
         Args:
-            transform (Optional[v2.Compose]): Transformations to apply to the data.
+            transform (Optional[v2.Compose]): Transformations to apply to the data. If None, 
+                the raw arrays are returned (see `get_batch_transforms`).
             hparams (IRISCCHyperParameters): Hyperparameters for the dataset.
             data_type (str): Type of data to load ('train', 'val', or 'test').
         """
         self.sample_dir = hparams.sample_dir
         self.transform = transform
         self.data_type = data_type
+        self.backend = hparams.sample_backend
+        # The day-of-year normalisation needs the date of each sample
+        self.day_of_year = hparams.normalisation == 'pixel_doy'
+        # Static channels (e.g. orography) are stored once per dataset. With batched 
+        # transforms they are put in front of the batch on its device (BatchStaticChannels).
+        self.static = None if hparams.batch_transforms else load_static(self.sample_dir)
 
-        list_data = np.sort(glob.glob(str(self.sample_dir / 'sample*')))
-        train_end = np.where(list_data == str(self.sample_dir / 'sample_20091231.npz'))[0][0]
-        val_end = np.where(list_data == str(self.sample_dir / 'sample_20131231.npz'))[0][0]
+        if self.backend == 'memmap':
+            self.samples = MemmapSampleStore(self.sample_dir, self.data_type)
+        elif self.backend == 'zarr':
+            self.samples = ZarrSampleStore(self.sample_dir, self.data_type)
+        else:
+            list_data = np.sort(glob.glob(str(self.sample_dir / 'sample*')))
+            train_end = np.where(list_data == str(self.sample_dir / f'sample_{TRAIN_END}.npz'))[0][0]
+            val_end = np.where(list_data == str(self.sample_dir / f'sample_{VAL_END}.npz'))[0][0]
 
-        if self.data_type == 'train':
-            self.samples = list_data[:train_end]
-        elif self.data_type == 'val':
-            self.samples = list_data[train_end:val_end]
-        elif self.data_type == 'test':
-            self.samples = list_data[val_end:]
+            if self.data_type == 'train':
+                self.samples = list_data[:train_end]
+            elif self.data_type == 'val':
+                self.samples = list_data[train_end:val_end]
+            elif self.data_type == 'test':
+                self.samples = list_data[val_end:]
+        if self.day_of_year:
+            dates = self.samples.dates if self.backend in ['memmap', 'zarr'] else [sample_date(file) for file in self.samples]
+            self.doys = np.array([pd.Timestamp(date).dayofyear - 1 for date in dates])
+
+        # The transforms are deterministic: they are run once and the results are cached
+        self.cache = None
+        if hparams.transform_cache is not None and self.transform is not None:
+            cache = TransformCache(self.sample_dir, self.data_type, 
+                                   key=transform_hash(hparams), 
+                                   dtype=hparams.transform_cache)
+            if not cache.exists():
+                cache.build(self)
+            self.cache = cache
 
     def __len__(self) -> int:
         """
@@ -57,13 +89,127 @@ class IRISCC(Dataset):
             idx (int): Index of the sample to retrieve.
 
         Returns:
-            tuple[Tensor, Tensor]: Transformed input (x) and target (y) tensors.
+            tuple[Tensor, Tensor]: Transformed input (x) and target (y) tensors. With batched 
+                transforms and the 'pixel_doy' normalisation, the 0-based day of the year 
+                of the sample is returned as a third element.
         """
-        data = dict(np.load(self.samples[idx], allow_pickle=True))
-        x, y = data['x'], data['y']
+        if self.cache is not None:
+            x, y = self.cache[idx]
+            return torch.from_numpy(x.astype(np.float32)), torch.from_numpy(y.astype(np.float32))
+        if self.backend in ['memmap', 'zarr']:
+            x, y = self.samples[idx]
+        else:
+            data = dict(np.load(self.samples[idx], allow_pickle=True))
+            x, y = data['x'], data['y']
+        x = merge_static(x, self.static)
+        sample = (x, y, self.doys[idx]) if self.day_of_year else (x, y)
         if self.transform:
-            x, y = self.transform((x, y))
-        return x.float(), y.float()
+            x, y = self.transform(sample)
+            return x.float(), y.float()
+        x, y = torch.from_numpy(np.array(x, dtype=np.float32)), torch.from_numpy(np.array(y, dtype=np.float32))
+        return (x, y, int(self.doys[idx])) if self.day_of_year else (x, y)
+
+
+AUTOTUNE = {} # (sample_dir, backend, batch_size) -> (num_workers, prefetch_factor)
+DEFAULT_NUM_WORKERS = 4 # num_workers = 'auto' on a dataset too small to be measured
+
+
+def loader_kwargs(num_workers: int, 
+                  prefetch_factor: Optional[int], 
+                  pin_memory: bool, 
+                  persistent_workers: bool) -> dict:
+    """
+    Returns the DataLoader worker arguments, dropping the ones that are only valid
+    with worker processes (or with a GPU for pin_memory).
+    """
+    kwargs = {'num_workers': num_workers,
+              'pin_memory': pin_memory and torch.cuda.is_available()}
+    if num_workers > 0:
+        kwargs['prefetch_factor'] = prefetch_factor
+        kwargs['persistent_workers'] = persistent_workers
+    return kwargs
+
+
+def autotune_loader(dataset: Dataset, 
+                    batch_size: int, 
+                    n_batches: int = 20,
+                    default_prefetch_factor: Optional[int] = 2) -> Tuple[int, Optional[int]]:
+    """
+    Measures the loading throughput of a dataset for several worker counts and prefetch 
+    depths and returns the fastest (num_workers, prefetch_factor). 
+    The result is kept for the other splits of the same dataset and batch size.
+    A dataset of less than two batches (warm-up and timed batch) is not measured:
+    (DEFAULT_NUM_WORKERS, default_prefetch_factor) is returned.
+
+    Args:
+        dataset (Dataset): Dataset to load.
+        batch_size (int): Batch size of the DataLoader, used for the measure.
+        n_batches (int): Number of batches timed per setting, after a first warm-up batch.
+        default_prefetch_factor (int, optional): Prefetch depth returned without a measure.
+    """
+    key = (str(dataset.sample_dir), dataset.backend, batch_size)
+    if key in AUTOTUNE:
+        return AUTOTUNE[key]
+    if len(dataset) < 2 * batch_size:
+        print(f'DataLoader auto-tune: {len(dataset)} samples, less than two batches, '
+              f'num_workers={DEFAULT_NUM_WORKERS}, prefetch_factor={default_prefetch_factor}')
+        return DEFAULT_NUM_WORKERS, default_prefetch_factor
+
+    n_cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    workers = [0] + [n for n in [1, 2, 4, 8, 16] if n <= n_cpus]
+    settings = [(n, None) if n == 0 else (n, prefetch) for n in workers for prefetch in ([None] if n == 0 else [2, 4, 8])]
+    n_batches = max(1, min(n_batches, len(dataset) // batch_size - 1))
+
+    timings = {}
+    for num_workers, prefetch_factor in settings:
+        loader = DataLoader(dataset, 
+                            batch_size=batch_size, 
+                            shuffle=True, 
+                            **loader_kwargs(num_workers, prefetch_factor, False, False))
+        iterator = iter(loader)
+        next(iterator) # worker start-up is paid once with persistent workers
+        n_timed = 0
+        start = time.perf_counter()
+        for _ in range(n_batches):
+            try:
+                next(iterator)
+            except StopIteration: # last partial batch already consumed
+                break
+            n_timed += 1
+        duration = time.perf_counter() - start
+        del iterator, loader
+        if n_timed == 0:
+            continue
+        timings[(num_workers, prefetch_factor)] = duration / n_timed
+        print(f'num_workers={num_workers}, prefetch_factor={prefetch_factor}: '
+              f'{batch_size / timings[(num_workers, prefetch_factor)]:.1f} samples/s')
+
+    if not timings:
+        return DEFAULT_NUM_WORKERS, default_prefetch_factor
+
+    AUTOTUNE[key] = min(timings, key=timings.get)
+    print(f'DataLoader auto-tune: num_workers={AUTOTUNE[key][0]}, prefetch_factor={AUTOTUNE[key][1]}')
+    return AUTOTUNE[key]
+
+
+def get_batch_transforms(hparams: dict) -> Optional[v2.Compose]:
+    """
+    Returns the batched transforms applied by the Lightning modules once the batch is 
+    on its device, or None when the transforms run per sample in the DataLoader.
+
+    Args:
+        hparams (dict): Hyperparameters (IRISCCHyperParameters().__dict__).
+    """
+    if not hparams.get('batch_transforms', False):
+        return None
+    return v2.Compose([
+                BatchStaticChannels(hparams['sample_dir']),
+                get_normalisation(hparams, batch=True),
+                BatchLandSeaMask(hparams['mask'], hparams['fill_value']),
+                BatchFillMissingValue(hparams['fill_value']),
+                BatchDomainCrop(hparams['sample_dir'], hparams['domain_crop']),
+                BatchPad(hparams['fill_value'], hparams.get('channels_last', False))
+                ])
 
 
 def get_dataloaders(data_type: str) -> DataLoader:
@@ -79,12 +225,15 @@ def get_dataloaders(data_type: str) -> DataLoader:
 
     hparams = IRISCCHyperParameters()
     transforms = v2.Compose([
-                MinMaxNormalisation(hparams.sample_dir, hparams.output_norm), 
+                get_normalisation(hparams.__dict__), 
                 LandSeaMask(hparams.mask, hparams.fill_value),
                 FillMissingValue(hparams.fill_value),
                 DomainCrop(hparams.sample_dir, hparams.domain_crop),
                 Pad(hparams.fill_value)
                 ])
+    if hparams.batch_transforms:
+        # The workers only load raw arrays, the modules transform whole batches
+        transforms = None
     training_data = IRISCC(transform=transforms,
                         hparams=hparams,
                         data_type=data_type)
@@ -98,12 +247,17 @@ def get_dataloaders(data_type: str) -> DataLoader:
     if data_type == 'train':
         batch_size = hparams.batch_size
     else : 
-        batch_size = 1
+        batch_size = hparams.eval_batch_size
+
+    num_workers, prefetch_factor = hparams.num_workers, hparams.prefetch_factor
+    if num_workers == 'auto':
+        num_workers, prefetch_factor = autotune_loader(training_data, batch_size, 
+                                                       default_prefetch_factor=hparams.prefetch_factor)
 
     dataloader = DataLoader(training_data, 
                             batch_size=batch_size, 
                             shuffle=shuffle,
-                            num_workers=1)
+                            **loader_kwargs(num_workers, prefetch_factor, hparams.pin_memory, hparams.persistent_workers))
     return dataloader   
 
 if __name__=='__main__':
@@ -0,0 +1,132 @@
+''' Process-wide registry of static geometry: coordinates, masks and crop indices '''
+
+import sys
+sys.path.append('.')
+
+import numpy as np
+import xarray as xr
+from pathlib import Path
+from functools import lru_cache
+from typing import Tuple, Union
+
+from iriscc.settings import (TARGET_SAFRAN_FILE,
+                             COUNTRIES_MASK,
+                             IMERG_MASK,
+                             LANDSEAMASK_CMIP6,
+                             LANDSEAMASK_ERA5,
+                             LANDSEAMASK_EOBS,
+                             CONFIG)
+from iriscc.gridutils import (standardize_dims_and_coords,
+                              standardize_longitudes,
+                              crop_domain_from_ds,
+                              interpolation_target_grid)
+
+# Every array is loaded once per process, memoised by (file, domain) and handed out read-only.
+
+
+def _read_only(array: np.ndarray) -> np.ndarray:
+    array = np.asarray(array)
+    array.setflags(write=False)
+    return array
+
+
+@lru_cache(maxsize=None)
+def _coordinates(sample_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+    coordinates = dict(np.load(Path(sample_dir) / 'coordinates.npz', allow_pickle=True))
+    return _read_only(coordinates['lon']), _read_only(coordinates['lat'])
+
+
+def coordinates(sample_dir: Union[str, Path]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the longitudes and latitudes of a dataset ('coordinates.npz' of sample_dir).
+    """
+    return _coordinates(str(sample_dir))
+
+
+@lru_cache(maxsize=None)
+def _crop_indices(sample_dir: str, domain: tuple) -> Tuple[np.ndarray, np.ndarray]:
+    lon, lat = _coordinates(sample_dir)
+    lon_indices = np.where((lon >= domain[0]) & (lon <= domain[1]))[0]
+    lat_indices = np.where((lat >= domain[2]) & (lat <= domain[3]))[0]
+    return _read_only(lat_indices), _read_only(lon_indices)
+
+
+def crop_indices(sample_dir: Union[str, Path], domain) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the latitude and longitude indices of a dataset grid inside a domain.
+
+    Args:
+        sample_dir (Union[str, Path]): Dataset directory containing 'coordinates.npz'.
+        domain: Cropping domain (min_lon, max_lon, min_lat, max_lat).
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Latitude indices and longitude indices.
+    """
+    return _crop_indices(str(sample_dir), tuple(domain))
+
+
+@lru_cache(maxsize=None)
+def continents_condition() -> np.ndarray:
+    """
+    Returns the IMERG condition (True over sea) used by the 'continents' mask.
+    """
+    ds = xr.open_dataset(IMERG_MASK)
+    condition = (100 - ds['landseamask'].values) < 25
+    ds.close()
+    return _read_only(condition)
+
+
+@lru_cache(maxsize=None)
+def landseamask_condition(mask_type: str) -> np.ndarray:
+    """
+    Returns the condition (True over sea) of a land-sea mask on its native grid.
+
+    Args:
+        mask_type (str): 'cmip6', 'era5', or 'eobs'.
+    """
+    if mask_type == 'cmip6':
+        mask = xr.open_dataset(LANDSEAMASK_CMIP6)
+        mask = standardize_longitudes(mask)
+        condition = mask['sftlf'].values < 2  # Land fraction less than 2%
+    elif mask_type == 'era5':
+        mask = xr.open_dataset(LANDSEAMASK_ERA5).isel(time=0)
+        mask = standardize_dims_and_coords(mask)
+        mask = standardize_longitudes(mask)
+        mask = mask.reindex(lat=mask.lat[::-1])
+        condition = mask['lsm'].values < 0.1  # Land-sea mask threshold
+    elif mask_type == 'eobs':
+        mask = xr.open_dataset(LANDSEAMASK_EOBS)
+        mask = standardize_dims_and_coords(mask)
+        condition = mask['landseamask'].values == 1.  # Land-sea mask value
+    else:
+        raise ValueError("Invalid mask_type. Choose from 'cmip6', 'era5', or 'eobs'.")
+    return _read_only(condition)
+
+
+@lru_cache(maxsize=None)
+def countries_condition() -> np.ndarray:
+    """
+    Returns the condition (True over the countries removed from SAFRAN-like arrays)
+    regridded once to the SAFRAN grid.
+    """
+    # Load the countries mask dataset
+    ds = xr.open_dataset(COUNTRIES_MASK)
+    ds = ds.reindex(lat=ds.lat[::-1])  # Reverse latitude order if necessary
+    ds = crop_domain_from_ds(ds, CONFIG['safran']['domain']['france'])  # Crop to France domain
+    ds = ds.drop_vars('spatial_ref')  # Drop unnecessary variable
+    index = ds['index'].values
+
+    # Define country codes to remove (e.g., Switzerland, Germany, Austria, Italy)
+    countries_to_remove = [41.0, 56.0, 105.0, 112.0, 28.0]
+    mask = np.isin(index, countries_to_remove)
+    index = np.where(mask, index, np.nan)
+
+    # Update the dataset with the modified index
+    ds['index'].values = index
+    ds["mask"] = xr.where(~np.isnan(ds["index"]), 1, 0)
+
+    # Interpolate the mask to match the SAFRAN grid
+    ds_saf = xr.open_dataset(TARGET_SAFRAN_FILE).isel(time=0)
+    ds_saf["mask"] = xr.where(~np.isnan(ds_saf["tas"]), 1, 0)
+    ds = interpolation_target_grid(ds, ds_saf, method='conservative_normed')
+    return _read_only(~np.isnan(ds['index'].values))
@@ -0,0 +1,170 @@
+''' Grid helpers shared by the data utilities and the geometry registry: conventions, cropping and cached regridders '''
+
+import sys
+sys.path.append('.')
+
+import os
+import hashlib
+import numpy as np
+import xarray as xr
+import xesmf as xe
+
+from iriscc.settings import TARGET_SIZE, SAFRAN_PROJ_PYPROJ, REGRID_WEIGHTS_DIR
+
+REGRIDDERS = {} # in-memory regridders, keyed by (source grid, target grid, method) hash
+
+
+def standardize_dims_and_coords(ds) :
+   # Camille Le Gloannec script
+   # CMIP6 models have inconsistent names of dimensions and coordinates, this function fix that at the dataset level by naming dimensions (x,y) and coordinates (lon,lat).
+
+   dim_mapping = {'x' : ['i', 'ni', 'xh', 'lon', 'nlon'], 
+         'y' : ['j', 'nj', 'yh', 'lat', 'nlat'],
+         'lev' : ['olevel']}
+   coord_mapping = {'lon' : ['longitude', 'nav_lon'],
+         'lat' : ['latitude', 'nav_lat']}
+   
+   for standard_name, possible_names in dim_mapping.items() :
+      for name in possible_names :
+         if name in ds.dims :
+            ds = ds.rename({name: standard_name})
+            break
+   
+   for standard_name, possible_names in coord_mapping.items() :
+      for name in possible_names :
+         if name in ds.coords :
+            ds = ds.rename({name: standard_name})
+            break
+         
+   return ds
+
+
+def standardize_longitudes(ds) :
+   # Camille Le Gloannec script
+   # CMIP6 models have inconsistent longitude conventions, this function fix that at the dataset level by setting the convention to -180° - 180°.
+
+   if 'lon' in ds.coords :
+      lon = ds.coords['lon']
+      ds.coords['lon'] = ((lon+180)%360)-180
+      
+      if len(ds.lon.shape) == 1 :
+         ds = ds.sortby('lon')
+      else :
+         for dim in ds.lon.dims :
+            ds = ds.sortby(dim)
+         
+   else :
+      x = ds.coords['x']
+      ds.coords['x'] = ((x+180)%360)-180
+      ds = ds.sortby(ds.x)
+      
+   return ds
+
+
+def generate_bounds(coord:np.ndarray) -> np.ndarray:
+   """
+   Generates bounds for a given coordinate array.
+   """
+   bounds = np.zeros(len(coord) + 1)
+   bounds[1:-1] = 0.5 * (coord[:-1] + coord[1:])  # Milieux entre chaque point
+   bounds[0] = coord[0] - (coord[1] - coord[0]) / 2  # Première limite extrapolée
+   bounds[-1] = coord[-1] + (coord[-1] - coord[-2]) / 2  # Dernière limite extrapolée
+   return bounds.astype(np.int32)
+
+
+def add_lon_lat_bounds(ds:xr.Dataset) -> xr.Dataset:
+   """
+   Adds longitude and latitude bounds to the dataset based on the coordinates of the cells.
+   Useful for SAFRAN-like datasets.
+   """
+
+   x = ds['x'].values
+   y = ds['y'].values
+
+   x_b = generate_bounds(x)
+   y_b = generate_bounds(y)
+
+   x_b_2d, y_b_2d = np.meshgrid(x_b, y_b)
+
+   projection = SAFRAN_PROJ_PYPROJ
+   lon_b, lat_b = projection(x_b_2d, y_b_2d, inverse=True)
+
+   ds = ds.assign_coords(
+      x_b=("x_b", x_b), 
+      y_b=("y_b", y_b),
+      lon_b=(["y_b", "x_b"], lon_b),
+      lat_b=(["y_b", "x_b"], lat_b)
+   )
+   
+   return ds
+
+
+def grid_hash(ds:xr.Dataset) -> str:
+   """
+   Returns a hash of the grid of a dataset (coordinates, cell bounds and mask), 
+   independent of the data values.
+   """
+   h = hashlib.md5()
+   for name in ['lon', 'lat', 'x', 'y', 'lon_b', 'lat_b', 'mask']:
+      if name in ds.variables:
+         values = np.ascontiguousarray(ds[name].values)
+         h.update(name.encode())
+         h.update(str(values.shape).encode())
+         h.update(values.tobytes())
+   return h.hexdigest()
+
+
+def get_regridder(ds:xr.Dataset, ds_target:xr.Dataset, method:str) -> xe.Regridder:
+   """
+   Returns the xESMF regridder between two grids.
+   Regridders are kept in memory for the process and their weights are saved in 
+   REGRID_WEIGHTS_DIR, so they are computed once for a given pair of grids and method.
+   """
+   key = hashlib.md5(f'{grid_hash(ds)}_{grid_hash(ds_target)}_{method}'.encode()).hexdigest()
+   if key not in REGRIDDERS:
+      kwargs = {'extrap_method': 'nearest_s2d'} if method == 'bilinear' else {}
+      weights_file = REGRID_WEIGHTS_DIR / f'{method}_{key}.nc'
+      if weights_file.exists():
+         regridder = xe.Regridder(ds, ds_target, method, weights=str(weights_file), **kwargs)
+      else:
+         regridder = xe.Regridder(ds, ds_target, method, **kwargs)
+         os.makedirs(REGRID_WEIGHTS_DIR, exist_ok=True)
+         tmp_file = REGRID_WEIGHTS_DIR / f'{method}_{key}.{os.getpid()}.tmp'
+         regridder.to_netcdf(str(tmp_file))
+         os.replace(tmp_file, weights_file) # atomic, several builders may write the same weights
+      REGRIDDERS[key] = regridder
+   return REGRIDDERS[key]
+
+
+def interpolation_target_grid(ds:xr.Dataset, ds_target:xr.Dataset, method:str) -> xr.Dataset:
+   """
+   Interpolates the input dataset to match the target grid and domain.
+   """
+
+   if 'x' in ds.coords :
+      if 'x_b' not in ds.coords:
+         ds = add_lon_lat_bounds(ds)
+   if 'x' in ds_target.coords :
+      if 'x_b' not in ds_target.coords:
+         ds_target = add_lon_lat_bounds(ds_target)
+
+
+   for i, coord in enumerate(['lat','lon']):
+      if len(ds[coord].dims) == 1:
+         if len(ds[coord].values) > TARGET_SIZE[i]: # if resolution is finer than target's
+               new_coord = np.linspace(ds[coord].values.min(), ds[coord].values.max(), TARGET_SIZE[i])
+               ds = ds.interp({coord:new_coord})
+   for var in ds.data_vars:
+      ds[var].values = np.asfortranarray(ds[var].values)
+      ds[var].values = np.ascontiguousarray(ds[var].values)
+   regridder = get_regridder(ds, ds_target, method)
+   ds_out = regridder(ds)
+   return ds_out
+
+
+def crop_domain_from_ds(ds:xr.Dataset, domain:tuple) -> xr.Dataset:
+   """
+   Crops the input dataset to a specified geographical domain based on latitude and longitude coordinates.
+   """
+   ds = ds.sel(lon=slice(domain[0], domain[1]), lat=slice(domain[2], domain[3]))
+   return ds
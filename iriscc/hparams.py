@@ -11,11 +11,24 @@ class IRISCCHyperParameters():
         self.mask = 'target'
         self.learning_rate = 0.001
         self.batch_size = 32
+        self.eval_batch_size = 32 # validation and test batch size (test metrics are computed per sample)
+        self.num_workers = 4 # int or 'auto' : worker count and prefetch depth measured on the host
+        self.prefetch_factor = 2
+        self.pin_memory = True
+        self.persistent_workers = True
         self.max_epoch = 60
         self.model ='swinunetr'
         self.exp = 'exp3/swinunet_all'
         self.runs_dir = RUNS_DIR / self.exp
         self.sample_dir = DATASET_EXP3_30Y_DIR
+        self.sample_backend = 'npz' # 'npz', 'memmap' (see bin/preprocessing/build_sample_store.py) or 'zarr'
+        self.transform_cache = None # None, 'float32' or 'float16' : cache of the transformed samples
+        self.batch_transforms = False # True : transforms applied to whole batches on the training device
+        self.normalisation = 'minmax' # 'minmax', 'pixel' or 'pixel_doy' (see compute_statistics.py --pixel)
+        self.accelerator = 'gpu' # 'gpu' or 'cpu'
+        self.precision = '16-mixed' # '32', '16-mixed' or 'bf16-mixed' (bf16 autocast, also on CPU)
+        self.channels_last = False # True : channels_last memory format for the model and its inputs
+        self.compile_mode = None # None, 'default', 'reduce-overhead' or 'max-autotune' : torch.compile of the model
         self.fill_value = 0.
         self.domain = 'france'
         self.domain_crop = None
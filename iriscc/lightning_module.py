@@ -12,11 +12,13 @@ import pandas as pd
 import matplotlib.pyplot as plt
 from monai.networks.nets import SwinUNETR
 
-from iriscc.metrics import MaskedMAE, MaskedRMSE
+from iriscc.metrics import MaskedMAE, MaskedRMSE, errors_from_sums
 from iriscc.models.unet import UNet
 from iriscc.models.miniunet import MiniUNet
 from iriscc.models.miniswinunetr import MiniSwinUNETR
-from iriscc.loss import MaskedMSELoss
+from iriscc.loss import masked_error_sums
+from iriscc.dataloaders import get_batch_transforms
+from iriscc.compilation import compile_model, compile_function, get_compile_mode, run_model, to_memory_format
 
 layout = {
     "Check Overfit": {
@@ -28,7 +30,6 @@ class IRISCCLightningModule(pl.LightningModule):
     def __init__(self, hparams):
         super().__init__()
  
-        self.loss = MaskedMSELoss(ignore_value = hparams['fill_value'])
         self.metrics_dict = nn.ModuleDict({
                     "rmse": MaskedRMSE(ignore_value = hparams['fill_value']),
                     "mae": MaskedMAE(ignore_value = hparams['fill_value'])
@@ -40,6 +41,14 @@ class IRISCCLightningModule(pl.LightningModule):
         self.scheduler_gamma = hparams['scheduler_gamma']
         self.in_channels = hparams['in_channels']
         self.img_size = hparams['img_size']
+        self.batch_size = hparams['batch_size']
+        self.eval_batch_size = hparams.get('eval_batch_size', 1)
+        self.compile_mode = get_compile_mode(hparams.get('compile_mode'))
+        self.compile_report = None
+        # Masked error sums of the loss and metrics, fused by torch.compile with compile_mode
+        self.error_sums = compile_function(masked_error_sums, self.compile_mode)
+        self.channels_last = hparams.get('channels_last', False)
+        self.batch_transforms = get_batch_transforms(hparams)
         os.makedirs(self.runs_dir, exist_ok=True)
 
         if hparams['model'] == 'unet':
@@ -50,18 +59,52 @@ class IRISCCLightningModule(pl.LightningModule):
             self.model = SwinUNETR(img_size=self.img_size, in_channels=self.in_channels, out_channels=1,spatial_dims=2)
         elif hparams['model'] == 'miniswinunetr':
             self.model = MiniSwinUNETR(img_size=self.img_size, in_channels=self.in_channels, out_channels=1,spatial_dims=2)
+        if self.channels_last:
+            self.model = self.model.to(memory_format=torch.channels_last)
 
-
-        self.test_metrics = {}
+        self.test_metrics = []
         self.train_step_outputs = []
         self.val_step_outputs = []
         
         self.save_hyperparameters()
         self.epoch_start_time = None
 
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        # Raw batches are transformed on the device (hparams 'batch_transforms')
+        if self.batch_transforms is not None:
+            batch = self.batch_transforms(batch)
+        if self.channels_last:
+            x, y, *rest = batch
+            batch = (to_memory_format(x, True), y, *rest)
+        return batch
+
     def forward(self, x):
         return self.model(x) 
 
+    def compile_and_warmup(self, train: bool):
+        """
+        Compiles the model (hparams 'compile_mode') and caches the graphs of the
+        img_size batches used for training (if train) and evaluation.
+        The speedup is logged by the ThroughputMonitor callback.
+        """
+        if self.compile_mode is None or self.compile_report is not None:
+            return
+        context = self.trainer.precision_plugin.forward_context
+        example = torch.randn(self.batch_size if train else self.eval_batch_size, 
+                              self.in_channels, *self.img_size, device=self.device)
+        example = to_memory_format(example, self.channels_last)
+        self.compile_report = compile_model(self.model, self.compile_mode, example, train=train, context=context)
+        if train:
+            example = torch.randn(self.eval_batch_size, self.in_channels, *self.img_size, device=self.device)
+            example = to_memory_format(example, self.channels_last)
+            run_model(self.model, example, train=False, context=context)
+
+    def on_fit_start(self):
+        self.compile_and_warmup(train=True)
+
+    def on_test_start(self):
+        self.compile_and_warmup(train=False)
+
     def on_train_start(self):
         self.logger.experiment.add_custom_scalars(layout)
         self.logger.log_hyperparams(vars(self.hparams))
@@ -69,14 +112,20 @@ class IRISCCLightningModule(pl.LightningModule):
     def on_train_epoch_start(self):
         self.epoch_start_time = time.time()
 
-    def common_step(self, x, y):
+    def common_step(self, x, y, absolute=False):
+        """
+        Returns the prediction, the loss and the per-sample (sum_squared_error,
+        sum_absolute_error, count) of the batch, computed by a single `masked_error_sums`
+        call shared by the loss and the metrics (absolute errors only if absolute).
+        """
         y_hat = self(x)
-        loss = torch.sqrt(self.loss(y_hat, y))
-        return y_hat, loss
+        sums = self.error_sums(y_hat, y, self.fill_value, dim=tuple(range(1, y.ndim)), absolute=absolute)
+        loss = torch.sqrt(sums[0].sum() / sums[2].sum())
+        return y_hat, loss, sums
 
     def training_step(self, batch, batch_idx):
         x, y = batch
-        y_hat, loss = self.common_step(x, y)
+        y_hat, loss, _ = self.common_step(x, y)
         self.train_step_outputs.append(loss)
         self.log('train_loss', loss, on_step=False, on_epoch=True, prog_bar=True)
         return loss
@@ -90,7 +139,7 @@ class IRISCCLightningModule(pl.LightningModule):
 
     def validation_step(self, batch, batch_idx):
         x, y = batch
-        y_hat, loss = self.common_step(x, y)
+        y_hat, loss, _ = self.common_step(x, y)
         self.log('val_loss', loss, on_step=False, on_epoch=True, prog_bar=True)
         self.val_step_outputs.append(loss)
         return loss
@@ -103,16 +152,14 @@ class IRISCCLightningModule(pl.LightningModule):
         
     def test_step(self, batch, batch_idx):
         x, y = batch
-        y_hat, loss = self.common_step(x, y)
-        self.log("test_loss", loss, on_step=False, on_epoch=True, prog_bar=True)
-            
-        batch_dict = {"loss": loss}
-        for metric_name, metric in self.metrics_dict.items():
-            metric.update(y_hat, y)
-            batch_dict[metric_name] = metric.compute()
-            self.logger.experiment.add_scalar(metric_name, metric.compute(), batch_idx)
-            metric.reset()
-        self.test_metrics[batch_idx] = batch_dict
+        y_hat, loss, (sum_squared_error, sum_absolute_error, count) = self.common_step(x, y, absolute=True)
+        self.log("test_loss", loss, on_step=False, on_epoch=True, prog_bar=True, batch_size=len(x))
+
+        # Per-sample metrics of the whole batch, kept on the device until the end of the epoch
+        rmse, mae = errors_from_sums(sum_squared_error, sum_absolute_error, count)
+        self.test_metrics.append({"loss": rmse, "rmse": rmse, "mae": mae})
+        self.metrics_dict["rmse"].update_sums(sum_squared_error, count)
+        self.metrics_dict["mae"].update_sums(sum_absolute_error, count)
 
         if batch_idx == 0:
 
@@ -120,35 +167,40 @@ class IRISCCLightningModule(pl.LightningModule):
             y[y == self.fill_value] = torch.nan
             vmin, vmax = np.nanmin(y.cpu().numpy()), np.nanmax(y.cpu().numpy())
             levels = np.round(np.linspace(vmin, vmax, 11)).astype(int)
-            cs = ax.contourf(y[batch_idx,0,:,:].cpu().numpy(), cmap='OrRd', levels=levels)
+            cs = ax.contourf(y[0,0,:,:].cpu().numpy(), cmap='OrRd', levels=levels)
             plt.colorbar(cs, ax=ax, pad=0.05)
             self.logger.experiment.add_figure('Figure/test_y_0', fig)
     
             fig, ax = plt.subplots()
             x[x == self.fill_value] = torch.nan
-            cs = ax.contourf(x[batch_idx,-1,:,:].cpu().numpy(), cmap='OrRd')
+            cs = ax.contourf(x[0,-1,:,:].cpu().numpy(), cmap='OrRd')
             plt.colorbar(cs, ax=ax, pad=0.05)
             self.logger.experiment.add_figure('Figure/test_x_0', fig)
 
             fig, ax = plt.subplots()
-            cs = ax.contourf(y_hat[batch_idx,0,:,:].cpu().numpy(), cmap='OrRd')
+            cs = ax.contourf(y_hat[0,0,:,:].cpu().numpy(), cmap='OrRd')
             plt.colorbar(cs, ax=ax, pad=0.05)
             self.logger.experiment.add_figure('Figure/test_yhat_raw_0', fig)
 
             fig, ax = plt.subplots()
             y_hat[torch.isnan(y)] = torch.nan 
-            cs = ax.contourf(y_hat[batch_idx,0,:,:].cpu().numpy(), cmap='OrRd', levels=levels)
+            cs = ax.contourf(y_hat[0,0,:,:].cpu().numpy(), cmap='OrRd', levels=levels)
             plt.colorbar(cs, ax=ax, pad=0.05)
             self.logger.experiment.add_figure('Figure/test_yhat_0', fig)
  
             
     def build_metrics_dataframe(self):
-        data = []
-        first_sample = list(self.test_metrics.keys())[0]
-        metrics = list(self.test_metrics[first_sample].keys())
-        for name_sample, metrics_dict in self.test_metrics.items():
-            data.append([name_sample] + [metrics_dict[m].item() for m in metrics])
-        return pd.DataFrame(data, columns=["Name"] + metrics)
+        # One device to host copy per metric for the whole test set
+        metrics = {name: torch.cat([batch[name] for batch in self.test_metrics]).float().cpu().numpy()
+                   for name in self.test_metrics[0]}
+        return pd.DataFrame({"Name": np.arange(len(metrics['rmse'])), **metrics})
+
+    def write_test_metrics(self, df):
+        # The per-sample TensorBoard scalars are buffered until the end of the test epoch
+        for metric_name in self.metrics_dict.keys():
+            for name_sample, value in zip(df["Name"], df[metric_name]):
+                self.logger.experiment.add_scalar(metric_name, value, name_sample)
+        self.logger.experiment.flush()
 
     def save_test_metrics_as_csv(self, df):
         path_csv = Path(self.logger.log_dir) / "metrics_test_set.csv"
@@ -156,9 +208,15 @@ class IRISCCLightningModule(pl.LightningModule):
     
     def on_test_epoch_end(self):
         df = self.build_metrics_dataframe()
+        self.test_metrics.clear()
+        self.write_test_metrics(df)
         self.save_test_metrics_as_csv(df)
         df = df.drop("Name", axis=1)
         self.log('hp_metric', df['rmse'].mean())
+        # Test set metrics accumulated from the same sums as the per-sample metrics
+        for metric_name, metric in self.metrics_dict.items():
+            self.log(f'test_{metric_name}', metric.compute())
+            metric.reset()
     
         
     def configure_optimizers(self):
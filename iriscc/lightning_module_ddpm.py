@@ -12,9 +12,10 @@ import pytorch_lightning as pl
 import matplotlib.pyplot as plt
 
 from iriscc.transforms import DeMinMaxNormalisation
-from iriscc.metrics import MaskedMAE, MaskedRMSE
+from iriscc.metrics import MaskedMAE, MaskedRMSE, errors_from_sums
 from iriscc.models.cddpm import CDDPM
-from iriscc.loss import MaskedMSELoss
+from iriscc.loss import MaskedMSELoss, masked_error_sums
+from iriscc.dataloaders import get_batch_transforms
 
 layout = {
     "Check Overfit": {
@@ -35,6 +36,7 @@ class IRISCCCDDPMLightningModule(pl.LightningModule):
         self.scheduler_step_size = hparams['scheduler_step_size']
         self.scheduler_gamma = hparams['scheduler_gamma']
         self.output_norm = hparams['output_norm']
+        self.batch_transforms = get_batch_transforms(hparams)
         os.makedirs(self.runs_dir, exist_ok=True)
 
         self.loss = nn.MSELoss()  
@@ -52,13 +54,19 @@ class IRISCCCDDPMLightningModule(pl.LightningModule):
         
         self.denorm = DeMinMaxNormalisation(hparams['sample_dir'], self.output_norm)
 
-        self.test_metrics = {}
+        self.test_metrics = []
         self.train_step_outputs = []
         self.val_step_outputs = []
 
         self.save_hyperparameters()
         self.epoch_start_time = None
 
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        # Raw batches are transformed on the device (hparams 'batch_transforms')
+        if self.batch_transforms is not None:
+            batch = self.batch_transforms(batch)
+        return batch
+
     def configure_model(self) -> None:
         self.model.betas = self.model.betas.to(self.device)
         self.model.alpha_bars = self.model.alpha_bars.to(self.device)
@@ -122,16 +130,17 @@ class IRISCCCDDPMLightningModule(pl.LightningModule):
                                         eta = None)
         
         if self.output_norm is True:
-            x[0,...], y[0,...] = self.denorm((x[0,...], y[0,...]))
-            y_hat[0,...] = self.denorm((False, y_hat[0,...]))
-
-        batch_dict = {}
-        for metric_name, metric in self.metrics_dict.items():
-            metric.update(y_hat, y)
-            batch_dict[metric_name] = metric.compute()
-            self.logger.experiment.add_scalar(metric_name, metric.compute(), batch_idx)
-            metric.reset()
-        self.test_metrics[batch_idx] = batch_dict
+            for i in range(len(x)):
+                x[i,...], y[i,...] = self.denorm((x[i,...], y[i,...]))
+                y_hat[i,...] = self.denorm((False, y_hat[i,...]))
+
+        # Per-sample metrics of the whole batch, kept on the device until the end of the epoch
+        sum_squared_error, sum_absolute_error, count = masked_error_sums(y_hat, y, self.fill_value, 
+                                                                         dim=tuple(range(1, y.ndim)))
+        rmse, mae = errors_from_sums(sum_squared_error, sum_absolute_error, count)
+        self.test_metrics.append({"rmse": rmse, "mae": mae})
+        self.metrics_dict["rmse"].update_sums(sum_squared_error, count)
+        self.metrics_dict["mae"].update_sums(sum_absolute_error, count)
 
         if batch_idx == 0: 
             y[y == self.fill_value] = torch.nan
@@ -162,12 +171,17 @@ class IRISCCCDDPMLightningModule(pl.LightningModule):
  
             
     def build_metrics_dataframe(self):
-        data = []
-        first_sample = list(self.test_metrics.keys())[0]
-        metrics = list(self.test_metrics[first_sample].keys())
-        for name_sample, metrics_dict in self.test_metrics.items():
-            data.append([name_sample] + [metrics_dict[m].item() for m in metrics])
-        return pd.DataFrame(data, columns=["Name"] + metrics)
+        # One device to host copy per metric for the whole test set
+        metrics = {name: torch.cat([batch[name] for batch in self.test_metrics]).float().cpu().numpy()
+                   for name in self.test_metrics[0]}
+        return pd.DataFrame({"Name": np.arange(len(metrics['rmse'])), **metrics})
+
+    def write_test_metrics(self, df):
+        # The per-sample TensorBoard scalars are buffered until the end of the test epoch
+        for metric_name in self.metrics_dict.keys():
+            for name_sample, value in zip(df["Name"], df[metric_name]):
+                self.logger.experiment.add_scalar(metric_name, value, name_sample)
+        self.logger.experiment.flush()
 
     def save_test_metrics_as_csv(self, df):
         path_csv = Path(self.logger.log_dir) / "metrics_test_set.csv"
@@ -175,9 +189,15 @@ class IRISCCCDDPMLightningModule(pl.LightningModule):
     
     def on_test_epoch_end(self):
         df = self.build_metrics_dataframe()
+        self.test_metrics.clear()
+        self.write_test_metrics(df)
         self.save_test_metrics_as_csv(df)
         df = df.drop("Name", axis=1)
         self.log('hp_metric', df['rmse'].mean())
+        # Test set metrics accumulated from the same sums as the per-sample metrics
+        for metric_name, metric in self.metrics_dict.items():
+            self.log(f'test_{metric_name}', metric.compute())
+            metric.reset()
 
     
     def configure_optimizers(self):
@@ -1,8 +1,63 @@
 import sys
 sys.path.append('.')
 
+import math
 import torch
 import torch.nn as nn
+from typing import Optional, Tuple
+
+
+def masked_error_sums(preds: torch.Tensor,
+                      target: torch.Tensor,
+                      ignore_value: Optional[float] = None,
+                      dim: Optional[Tuple[int, ...]] = None,
+                      weight: Optional[torch.Tensor] = None,
+                      squared: bool = True,
+                      absolute: bool = True) -> Tuple[Optional[torch.Tensor], Optional[torch.Tensor], torch.Tensor]:
+    """
+    Computes the masked sum of squared errors, sum of absolute errors and valid count
+    of a batch from a single error tensor. It is called once per step and its sums feed
+    the loss and the metrics (see `IRISCCLightningModule.common_step`).
+
+    The ignored pixels are zeroed in the error tensor with the boolean mask, so no float
+    mask nor weight tensor is allocated. In eager mode the masking, powers and sums are
+    separate kernels; with hparams 'compile_mode' the Lightning module calls a compiled
+    version in which they are fused.
+
+    Args:
+        preds (torch.Tensor): Predicted values with shape (N, ...).
+        target (torch.Tensor): Target values with shape (N, ...).
+        ignore_value (float, optional): The value in the target tensor to ignore.
+        dim (tuple, optional): Dimensions to reduce, all of them if None.
+        weight (torch.Tensor, optional): Weights broadcastable to the target.
+        squared (bool): Computes the sum of squared errors (None otherwise).
+        absolute (bool): Computes the sum of absolute errors (None otherwise).
+
+    Returns:
+        Tuple[torch.Tensor, torch.Tensor, torch.Tensor]: The sum of squared errors, the
+        sum of absolute errors and the (weighted) count of valid values.
+    """
+    error = preds - target
+    if ignore_value is not None:
+        valid = target != ignore_value
+        error = torch.where(valid, error, 0.)
+    sum_squared_error, sum_absolute_error = None, None
+    if squared:
+        sum_squared_error = (error.square() if weight is None else error.square() * weight).sum(dim=dim)
+    if absolute:
+        sum_absolute_error = (error.abs() if weight is None else error.abs() * weight).sum(dim=dim)
+
+    if weight is not None:
+        weight = weight.expand_as(target)
+        count = (torch.where(valid, weight, 0.) if ignore_value is not None else weight).sum(dim=dim)
+    elif ignore_value is not None:
+        count = valid.sum(dim=dim)
+    else:
+        dims = range(target.ndim) if dim is None else [d % target.ndim for d in dim]
+        count = torch.full([size for d, size in enumerate(target.shape) if d not in dims], 
+                           math.prod(target.shape[d] for d in dims), device=target.device)
+    return sum_squared_error, sum_absolute_error, count
+
 
 class MaskedMSELoss(nn.Module):
     """
@@ -29,8 +84,6 @@ class MaskedMSELoss(nn.Module):
         Returns:
             torch.Tensor: The computed loss as a scalar tensor.
         """
-        mask = (y != self.ignore_value).float()
-        squared_error = (y_hat - y) ** 2
-        masked_error = squared_error * mask
-        loss = masked_error.sum() / (mask.sum())
-        return loss
\ No newline at end of file
+        sum_squared_error, _, count = masked_error_sums(y_hat, y, self.ignore_value, absolute=False)
+        loss = sum_squared_error / count
+        return loss
@@ -1,6 +1,9 @@
 import torch
 from torch import nn
 from torchmetrics import Metric
+from typing import Tuple
+
+from iriscc.loss import masked_error_sums
 
 class MaskedRMSE(Metric):
     """
@@ -17,18 +20,13 @@ class MaskedRMSE(Metric):
         self.add_state("total_weight", default=torch.tensor(0.0), dist_reduce_fx="sum")
 
     def update(self, preds: torch.Tensor, target: torch.Tensor, weight: torch.Tensor = None):
-        if self.ignore_value is not None:
-            mask = (target != self.ignore_value).float()
-        else:
-            mask = torch.ones_like(target)
-
-        if weight is None:
-            weight = torch.ones_like(target)
+        sum_squared_error, _, count = masked_error_sums(preds, target, self.ignore_value, weight=weight, absolute=False)
+        self.update_sums(sum_squared_error, count)
 
-        effective_weight = mask * weight
-        squared_error = (preds - target) ** 2
-        self.sum_squared_error += (squared_error * effective_weight).sum()
-        self.total_weight += effective_weight.sum()
+    def update_sums(self, sum_squared_error: torch.Tensor, count: torch.Tensor):
+        ''' Accumulates the sums already computed by `masked_error_sums` for the loss '''
+        self.sum_squared_error += sum_squared_error.sum()
+        self.total_weight += count.sum()
 
     def compute(self):
         mean_squared_error = self.sum_squared_error / (self.total_weight + 1e-8)
@@ -49,19 +47,23 @@ class MaskedMAE(Metric):
         self.add_state("total_weight", default=torch.tensor(0.0), dist_reduce_fx="sum")
 
     def update(self, preds: torch.Tensor, target: torch.Tensor, weight: torch.Tensor = None):
-        if self.ignore_value is not None:
-            mask = (target != self.ignore_value).float()
-        else:
-            mask = torch.ones_like(target)
-
-        if weight is None:
-            weight = torch.ones_like(target)
+        _, sum_absolute_error, count = masked_error_sums(preds, target, self.ignore_value, weight=weight, squared=False)
+        self.update_sums(sum_absolute_error, count)
 
-        effective_weight = mask * weight
-        absolute_error = torch.abs(preds - target)
-        self.sum_absolute_error += (absolute_error * effective_weight).sum()
-        self.total_weight += effective_weight.sum()
+    def update_sums(self, sum_absolute_error: torch.Tensor, count: torch.Tensor):
+        ''' Accumulates the sums already computed by `masked_error_sums` for the loss '''
+        self.sum_absolute_error += sum_absolute_error.sum()
+        self.total_weight += count.sum()
 
     def compute(self):
         mean_absolute_error = self.sum_absolute_error / (self.total_weight + 1e-8)
-        return mean_absolute_error
\ No newline at end of file
+        return mean_absolute_error
+
+
+def errors_from_sums(sum_squared_error: torch.Tensor, 
+                     sum_absolute_error: torch.Tensor, 
+                     count: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    ''' Returns the RMSE and MAE of sums computed by `masked_error_sums` '''
+    rmse = torch.sqrt(sum_squared_error / (count + 1e-8))
+    mae = sum_absolute_error / (count + 1e-8)
+    return rmse, mae
@@ -0,0 +1,93 @@
+''' Bounded pool of open NetCDF datasets shared by the preprocessing and evaluation scripts '''
+
+import sys
+sys.path.append('.')
+
+import numpy as np
+import xarray as xr
+from pathlib import Path
+from collections import OrderedDict
+from typing import Optional, Union
+
+
+class DatasetPool:
+    """
+    Keeps the last opened NetCDF datasets, keyed by path, and closes the least recently
+    used one when the pool is full. Decoded coordinates are cached separately.
+
+    The datasets are shared: derive new ones (sel, isel, assign...) rather than
+    modifying them in place.
+
+    Attributes:
+        maxsize (int): Maximum number of open datasets.
+    """
+    def __init__(self, maxsize: int = 16) -> None:
+        self.maxsize = maxsize
+        self.datasets = OrderedDict()
+        self.coordinates = {}
+
+    def open(self, path: Union[str, Path], **kwargs) -> xr.Dataset:
+        """
+        Returns the open dataset of a file, opening it with `xr.open_dataset(path, **kwargs)`
+        if it is not in the pool.
+        """
+        key = (str(path), tuple(sorted(kwargs.items())))
+        if key in self.datasets:
+            self.datasets.move_to_end(key)
+            return self.datasets[key]
+        ds = xr.open_dataset(path, **kwargs)
+        self.datasets[key] = ds
+        if len(self.datasets) > self.maxsize:
+            _, oldest = self.datasets.popitem(last=False)
+            oldest.close()
+        return ds
+
+    def coordinate(self, path: Union[str, Path], name: str) -> np.ndarray:
+        """
+        Returns the decoded values of a coordinate (e.g. 'time', 'lat') of a file, read once.
+        """
+        key = (str(path), name)
+        if key not in self.coordinates:
+            values = self.open(path)[name].values
+            values.setflags(write=False)
+            self.coordinates[key] = values
+        return self.coordinates[key]
+
+    def evict(self, path: Optional[Union[str, Path]] = None) -> None:
+        """
+        Closes and removes the datasets and coordinates of a file, or of every file if
+        path is None.
+        """
+        for key in list(self.datasets):
+            if path is None or key[0] == str(path):
+                self.datasets.pop(key).close()
+        for key in list(self.coordinates):
+            if path is None or key[0] == str(path):
+                del self.coordinates[key]
+
+    def __len__(self) -> int:
+        return len(self.datasets)
+
+
+POOL = DatasetPool()
+
+
+def open_dataset(path: Union[str, Path], **kwargs) -> xr.Dataset:
+    """
+    Returns the open dataset of a file from the process-wide pool.
+    """
+    return POOL.open(path, **kwargs)
+
+
+def coordinate(path: Union[str, Path], name: str) -> np.ndarray:
+    """
+    Returns the cached decoded values of a coordinate of a file.
+    """
+    return POOL.coordinate(path, name)
+
+
+def evict(path: Optional[Union[str, Path]] = None) -> None:
+    """
+    Closes a file of the process-wide pool, or every file if path is None.
+    """
+    POOL.evict(path)
@@ -0,0 +1,247 @@
+''' Declarative dataset pipeline: sources, regrid chain, masks and static channels of each experiment '''
+
+import sys
+sys.path.append('.')
+
+import glob
+import numpy as np
+import pandas as pd
+import xarray as xr
+from functools import lru_cache, partial
+from typing import Callable, Dict, List, Optional, Tuple
+
+from iriscc.ncpool import open_dataset, evict
+from iriscc.builder import run_build
+from iriscc.samplestore import save_static
+from iriscc.samplewriters import get_sample_writer
+from iriscc.datautils import (standardize_dims_and_coords,
+                              standardize_longitudes,
+                              interpolation_target_grid,
+                              reformat_as_target,
+                              remove_countries,
+                              apply_landseamask,
+                              crop_domain_from_ds,
+                              select_dates)
+from iriscc.settings import (PIPELINES,
+                             ERA5_DIR,
+                             CMIP6_RAW_DIR,
+                             EOBS_RAW_DIR,
+                             SAFRAN_REFORMAT_DIR,
+                             SAFRAN_DAILY_FILE,
+                             SAFRAN_DAILY_RAW_FILE,
+                             TARGET)
+
+
+def era5_file(year: int) -> str:
+    return glob.glob(str(ERA5_DIR/f'tas*_{year}_*'))[0]
+
+
+def cmip6_file() -> str:
+    return glob.glob(str(CMIP6_RAW_DIR/f'CNRM-CM6-1/tas*historical*r1i1p1f2*'))[0]
+
+
+def eobs_file() -> str:
+    return glob.glob(str(EOBS_RAW_DIR/f'tas*'))[0]
+
+
+def safran_reformat_file(year: int) -> str:
+    return glob.glob(str(SAFRAN_REFORMAT_DIR/f"tas*{year}_reformat.nc"))[0]
+
+
+# Sources return the days of a year of a variable as a (time, ...) dataset cropped to the domain.
+# The files of YEARLY_FILES are only read for one year and are closed once the year is built.
+SOURCES: Dict[str, Callable[[int, pd.DatetimeIndex, tuple], xr.Dataset]] = {}
+YEARLY_FILES: Dict[str, Callable[[int], str]] = {'era5': era5_file, 'safran_reformat': safran_reformat_file}
+
+
+def source(name: str):
+    def register(func):
+        SOURCES[name] = func
+        return func
+    return register
+
+
+@source('era5')
+def era5_source(year, dates, domain):
+    ds = open_dataset(era5_file(year))
+    ds = standardize_dims_and_coords(ds)
+    ds = standardize_longitudes(ds)
+    ds = ds.reindex(lat=ds.lat[::-1])
+    ds = crop_domain_from_ds(ds, domain)
+    return select_dates(ds, dates)
+
+
+@source('cmip6')
+def cmip6_source(year, dates, domain):
+    ds = open_dataset(cmip6_file())
+    ds = standardize_longitudes(ds)
+    ds = crop_domain_from_ds(ds, domain)
+    return select_dates(ds, dates)
+
+
+@source('safran_daily')
+def safran_daily_source(year, dates, domain):
+    # Daily means with the countries already removed (build_safran_daily.py)
+    return select_dates(open_dataset(SAFRAN_DAILY_FILE), dates)
+
+
+@source('safran_daily_raw')
+def safran_daily_raw_source(year, dates, domain):
+    # Same daily means (00h-23h, 1st of August included) without removing the countries
+    return select_dates(open_dataset(SAFRAN_DAILY_RAW_FILE), dates)
+
+
+@source('safran_reformat')
+def safran_reformat_source(year, dates, domain):
+    return select_dates(open_dataset(safran_reformat_file(year)), dates)
+
+
+@source('eobs')
+def eobs_source(year, dates, domain):
+    ds = open_dataset(eobs_file())
+    ds = select_dates(ds.sel(time=str(year)), dates)
+    ds = standardize_dims_and_coords(ds)
+    ds = apply_landseamask(ds, 'eobs')
+    ds = crop_domain_from_ds(ds, domain)
+    if np.nanmean(ds[TARGET].values) < 100: # if celsus
+        ds[TARGET] = ds[TARGET] + 273.15
+    return ds
+
+
+@lru_cache(maxsize=None)
+def cmip6_grid(domain: tuple, landseamask: Optional[str] = None) -> xr.Dataset:
+    """
+    Returns the CMIP6 grid of a domain (first time step), shared by every regrid step.
+    """
+    ds = open_dataset(cmip6_file())
+    ds = standardize_longitudes(ds)
+    if landseamask is not None:
+        ds = apply_landseamask(ds.isel(time=[0]), landseamask)
+    ds = crop_domain_from_ds(ds, domain)
+    return ds.isel(time=0)
+
+
+def regrid(ds: xr.Dataset, steps: List[dict], domain: tuple) -> xr.Dataset:
+    """
+    Applies a regrid chain to a (time, ...) dataset. A step regrids either to the CMIP6
+    grid of the domain ({'target': 'cmip6', 'method', 'landseamask'}) or to the grid of a
+    target file ({'target': file, 'method', 'crop_target', 'mask'}). The regridders are
+    cached (see `get_regridder`), so each one is built once per process.
+    """
+    for step in steps:
+        if step['target'] == 'cmip6':
+            ds = interpolation_target_grid(ds,
+                                           ds_target=cmip6_grid(domain, step.get('landseamask')),
+                                           method=step['method'])
+        else:
+            ds = reformat_as_target(ds,
+                                    target_file=step['target'],
+                                    method=step['method'],
+                                    domain=domain,
+                                    crop_target=step.get('crop_target', False),
+                                    mask=step.get('mask', False))
+    return ds
+
+
+def read_variable(spec: dict, year: int, dates: pd.DatetimeIndex, domain: tuple) -> np.ndarray:
+    """
+    Returns the (T, H, W) values of an input or target variable over some days of a year.
+
+    Args:
+        spec (dict): {'source', 'var' (default TARGET), 'regrid' (list of steps),
+            'remove_countries' (bool)}.
+    """
+    ds = SOURCES[spec['source']](year, dates, domain)
+    ds = regrid(ds, spec.get('regrid', []), domain)
+    values = ds[spec.get('var', TARGET)].values
+    if spec.get('remove_countries', False):
+        values = remove_countries(values)
+    return values
+
+
+class Pipeline:
+    """
+    Builds the dataset of an experiment from its entry of `PIPELINES`.
+
+    The days are processed by years: each source is read once per year, regridded
+    at once with the cached regridders and masks, and the samples of the year are
+    returned to the writer (see `run_build`).
+
+    Attributes:
+        name (str): Experiment name (key of PIPELINES).
+        config (dict): Pipeline configuration.
+        domain (tuple): Domain (lon_min, lon_max, lat_min, lat_max).
+    """
+    def __init__(self, name: str) -> None:
+        if name not in PIPELINES:
+            raise ValueError(f'Unknown pipeline {name}, expected one of {list(PIPELINES)}')
+        self.name = name
+        self.config = PIPELINES[name]
+        self.domain = tuple(self.config['domain'])
+
+    @property
+    def output_dir(self):
+        return self.config['output_dir']
+
+    def years(self) -> np.ndarray:
+        return np.unique(self.config['dates'].year)
+
+    def static_data(self) -> Optional[np.ndarray]:
+        """
+        Returns the static inputs, shared by every sample, as an array of shape (S, H, W).
+        """
+        if 'static' not in self.config:
+            return None
+        static = self.config['static']
+        ds = open_dataset(static['file']) # Already interpolated to target grids
+        if static.get('crop', False):
+            ds = crop_domain_from_ds(standardize_dims_and_coords(ds), self.domain)
+        return np.expand_dims(ds[static['var']].values, axis=0)
+
+    def coordinates(self) -> Dict[str, np.ndarray]:
+        """
+        Returns the 'lon' and 'lat' coordinates of the target grid.
+        """
+        dates = self.config['dates'][:1]
+        ds = SOURCES[self.config['target']['source']](dates[0].year, dates, self.domain)
+        return {'lon': ds['lon'].values, 'lat': ds['lat'].values}
+
+    def build_year(self, year: int) -> List[Tuple[pd.Timestamp, dict]]:
+        """
+        Returns the (date, sample) pairs of a year.
+        """
+        dates = self.config['dates'][self.config['dates'].year == year]
+        x = np.stack([read_variable(spec, year, dates, self.domain) for spec in self.config['inputs']], axis=1)
+        y = read_variable(self.config['target'], year, dates, self.domain)
+
+        # The yearly files are not read again
+        for spec in self.config['inputs'] + [self.config['target']]:
+            if spec['source'] in YEARLY_FILES:
+                evict(YEARLY_FILES[spec['source']](year))
+
+        if self.config.get('layout', 'xy') == 'baseline':
+            return [(date, {'y_hat': x[i, 0], 'y': y[i]}) for i, date in enumerate(dates)]
+        return [(date, {'x': x[i], 'y': y[i][np.newaxis]}) for i, date in enumerate(dates)]
+
+    def run(self, backend: str = 'npz', n_workers: int = 1) -> None:
+        """
+        Writes the static channels and coordinates, then builds the samples of every year
+        in parallel with a resumable progress manifest.
+        """
+        static = self.static_data()
+        if static is not None:
+            save_static(self.output_dir, static)
+        if self.config.get('coordinates', False):
+            np.savez(self.output_dir/'coordinates.npz', **self.coordinates())
+
+        with get_sample_writer(self.output_dir, backend) as writer:
+            run_build(self.years(),
+                      partial(build_year, self.name),
+                      writer,
+                      n_workers=n_workers,
+                      manifest_path=self.output_dir/f'build_progress_{backend}.json')
+
+
+def build_year(name: str, year: int) -> List[Tuple[pd.Timestamp, dict]]:
+    ''' Module-level entry point of the worker processes '''
+    return Pipeline(name).build_year(year)
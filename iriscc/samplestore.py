@@ -0,0 +1,310 @@
+''' Sample stores: consolidated memory-mapped arrays and chunked Zarr stores '''
+
+import sys
+sys.path.append('.')
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+import xarray as xr
+from pathlib import Path
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple, Union
+
+from iriscc.settings import TRAIN_END, VAL_END
+
+STORE_DIR = 'sample_store'
+ZARR_STORE = 'samples.zarr'
+STATIC_FILE = 'static.npz'
+SPLITS = ['train', 'val', 'test']
+
+
+def sample_date(sample_file: Union[str, Path]) -> np.datetime64:
+    """
+    Returns the date encoded in a 'sample_YYYYMMDD.npz' file name.
+    """
+    date_str = Path(sample_file).stem.split('_')[-1]
+    return np.datetime64(pd.to_datetime(date_str, format='%Y%m%d').date(), 'D')
+
+
+def split_mask(dates: np.ndarray, data_type: str) -> np.ndarray:
+    """
+    Returns the boolean mask selecting the dates of a dataset split.
+
+    Args:
+        dates (np.ndarray): Sample dates (datetime64[D]).
+        data_type (str): Type of data to select ('train', 'val', or 'test').
+
+    Returns:
+        np.ndarray: Boolean mask of the same length as `dates`.
+    """
+    train_end = np.datetime64(pd.to_datetime(TRAIN_END).date(), 'D')
+    val_end = np.datetime64(pd.to_datetime(VAL_END).date(), 'D')
+    if data_type == 'train':
+        return dates < train_end
+    elif data_type == 'val':
+        return (dates >= train_end) & (dates < val_end)
+    elif data_type == 'test':
+        return dates >= val_end
+    raise ValueError(f"Invalid data_type '{data_type}'. Choose from {SPLITS}.")
+
+
+def save_static(sample_dir: Union[str, Path], static: np.ndarray) -> None:
+    """
+    Saves the static input channels of a dataset (e.g. the orography), shared by every
+    sample, in 'sample_dir/static.npz'. The samples then only store the dynamic channels.
+
+    Args:
+        sample_dir (Union[str, Path]): Dataset directory.
+        static (np.ndarray): Static channels of shape (S, H, W).
+    """
+    np.savez(Path(sample_dir) / STATIC_FILE, x=static)
+
+
+@lru_cache(maxsize=None)
+def _load_static(sample_dir: str) -> Optional[np.ndarray]:
+    path = Path(sample_dir) / STATIC_FILE
+    if not path.exists():
+        return None
+    static = np.load(path)['x']
+    static.setflags(write=False)
+    return static
+
+
+def load_static(sample_dir: Union[str, Path]) -> Optional[np.ndarray]:
+    """
+    Returns the static input channels (S, H, W) of a dataset, or None if its samples 
+    contain every channel. The array is read once per process.
+    """
+    return _load_static(str(sample_dir))
+
+
+def merge_static(x: np.ndarray, static: Optional[np.ndarray]) -> np.ndarray:
+    """
+    Puts the static channels in front of the dynamic channels of a sample (C, H, W) 
+    or of a block of samples (T, C, H, W).
+    """
+    if static is None:
+        return x
+    static = np.broadcast_to(static, x.shape[:-3] + static.shape)
+    return np.concatenate([static, x], axis=-3)
+
+
+class MemmapSampleStore:
+    """
+    Read access to one split of a consolidated sample store.
+
+    The store keeps, for each split, one contiguous (T, C, H, W) float32 array for the
+    inputs and one for the targets ('{split}_x.npy', '{split}_y.npy') plus the sample
+    dates ('{split}_dates.npy'), in 'sample_dir/sample_store'. Arrays are opened with
+    `np.memmap` on first access so that each DataLoader worker maps the files itself
+    and shares the page cache instead of receiving a pickled copy.
+
+    Attributes:
+        store_dir (Path): Directory containing the store files.
+        data_type (str): Split served by the store ('train', 'val', or 'test').
+        dates (np.ndarray): Sample dates (datetime64[D]).
+    """
+    def __init__(self, sample_dir: Union[str, Path], data_type: str) -> None:
+        self.store_dir = Path(sample_dir) / STORE_DIR
+        self.data_type = data_type
+        self.dates = np.load(self.store_dir / f'{data_type}_dates.npy')
+        self._x = None
+        self._y = None
+
+    @staticmethod
+    def exists(sample_dir: Union[str, Path]) -> bool:
+        return all((Path(sample_dir) / STORE_DIR / f'{split}_dates.npy').exists() for split in SPLITS)
+
+    @property
+    def x(self) -> np.memmap:
+        if self._x is None:
+            self._x = np.load(self.store_dir / f'{self.data_type}_x.npy', mmap_mode='r')
+        return self._x
+
+    @property
+    def y(self) -> np.memmap:
+        if self._y is None:
+            self._y = np.load(self.store_dir / f'{self.data_type}_y.npy', mmap_mode='r')
+        return self._y
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_x'] = None
+        state['_y'] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __getitem__(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.x[idx], self.y[idx]
+
+
+class ZarrSampleStore:
+    """
+    Lazy read access to one split of a Zarr sample store written by `ZarrSampleWriter`.
+
+    Only the time chunk containing the requested sample is read and decompressed.
+    The store is opened on first access in each DataLoader worker.
+
+    Attributes:
+        store_path (Path): Path of the Zarr store.
+        data_type (str): Split served by the store ('train', 'val', or 'test').
+        dates (np.ndarray): Sample dates (datetime64[D]).
+    """
+    def __init__(self, sample_dir: Union[str, Path], data_type: str) -> None:
+        self.store_path = Path(sample_dir) / ZARR_STORE
+        self.data_type = data_type
+        dates = xr.open_zarr(self.store_path)['time'].values.astype('datetime64[D]')
+        self.positions = np.where(split_mask(dates, data_type))[0]
+        self.dates = dates[self.positions]
+        self._ds = None
+
+    @staticmethod
+    def exists(sample_dir: Union[str, Path]) -> bool:
+        return (Path(sample_dir) / ZARR_STORE).exists()
+
+    @property
+    def ds(self) -> xr.Dataset:
+        if self._ds is None:
+            self._ds = xr.open_zarr(self.store_path)
+        return self._ds
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_ds'] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    def __getitem__(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        sample = self.ds.isel(time=self.positions[idx])
+        return sample['x'].values, sample['y'].values
+
+
+@lru_cache(maxsize=None)
+def _open_zarr(store_path: Path) -> Tuple[xr.Dataset, pd.DatetimeIndex]:
+    ds = xr.open_zarr(store_path)
+    return ds, pd.DatetimeIndex(ds['time'].values).normalize()
+
+
+def load_sample(sample_dir: Union[str, Path], date) -> Dict[str, np.ndarray]:
+    """
+    Loads the sample of a given date, whatever the storage backend of the dataset.
+    The static channels of the dataset, if any, are merged into 'x'.
+
+    Args:
+        sample_dir (Union[str, Path]): Dataset directory.
+        date: Sample date (pd.Timestamp, datetime or 'YYYYMMDD' string).
+
+    Returns:
+        Dict[str, np.ndarray]: The sample arrays (e.g. 'x' and 'y').
+    """
+    sample_dir = Path(sample_dir)
+    date = pd.Timestamp(date).normalize()
+    if ZarrSampleStore.exists(sample_dir):
+        ds, dates = _open_zarr(sample_dir / ZARR_STORE)
+        sample = ds.isel(time=dates.get_loc(date))
+        data = {key: sample[key].values for key in ds.data_vars}
+    else:
+        data = dict(np.load(sample_dir / f"sample_{date.strftime('%Y%m%d')}.npz", allow_pickle=True))
+    if 'x' in data:
+        data['x'] = merge_static(data['x'], load_static(sample_dir))
+    return data
+
+
+def create_period(path: Union[str, Path], keys: List[str], dates: pd.DatetimeIndex, shape: Tuple[int, int]) -> Path:
+    """
+    Preallocates a memmap period dataset: one (time, H, W) float32 '{key}.npy' array per key
+    and the 'dates.npy' axis in the directory 'path.memmap', filled in place afterwards
+    (see `open_period_array`).
+
+    Returns:
+        Path: The period directory.
+    """
+    period_dir = Path(path).with_suffix('.memmap')
+    os.makedirs(period_dir, exist_ok=True)
+    for key in keys:
+        array = np.lib.format.open_memmap(period_dir / f'{key}.npy', mode='w+', dtype=np.float32,
+                                          shape=(len(dates),) + tuple(shape))
+        array.flush()
+        del array
+    np.save(period_dir / 'dates.npy', np.asarray(dates, dtype='datetime64[ns]'))
+    return period_dir
+
+
+def open_period_array(path: Union[str, Path], key: str, mode: str = 'r') -> np.memmap:
+    """
+    Returns a (time, H, W) array of a memmap period dataset, 'r+' to fill it in place.
+    """
+    return np.load(Path(path).with_suffix('.memmap') / f'{key}.npy', mmap_mode=mode)
+
+
+def load_period(path: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """
+    Loads a stacked period dataset (e.g. 'bc_train_hist') from its memmap directory,
+    Zarr store or .npz file.
+
+    The memmap and Zarr variables are lazy (memory-mapped or dask-backed arrays) and
+    are only read when used.
+
+    Args:
+        path (Union[str, Path]): Path of the dataset without extension.
+
+    Returns:
+        Dict[str, np.ndarray]: The period arrays and their 'dates'.
+    """
+    path = Path(path)
+    memmap_path = path.with_suffix('.memmap')
+    zarr_path = path.with_suffix('.zarr')
+    if memmap_path.exists():
+        data = {file.stem: open_period_array(path, file.stem) for file in memmap_path.glob('*.npy') if file.stem != 'dates'}
+        data['dates'] = np.load(memmap_path / 'dates.npy')
+        return data
+    if zarr_path.exists():
+        ds = xr.open_zarr(zarr_path)
+        data = {key: ds[key].data for key in ds.data_vars}
+        data['dates'] = ds['time'].values
+        return data
+    return dict(np.load(path.with_suffix('.npz'), allow_pickle=True))
+
+
+def build_sample_store(sample_dir: Union[str, Path]) -> None:
+    """
+    Converts a directory of daily 'sample_YYYYMMDD.npz' files into a consolidated store.
+
+    Args:
+        sample_dir (Union[str, Path]): Dataset directory containing the .npz samples.
+    """
+    sample_dir = Path(sample_dir)
+    store_dir = sample_dir / STORE_DIR
+    store_dir.mkdir(exist_ok=True)
+
+    samples = np.sort(glob.glob(str(sample_dir / 'sample_*.npz')))
+    dates = np.array([sample_date(sample) for sample in samples])
+    if len(samples) == 0:
+        raise FileNotFoundError(f'No sample_*.npz file in {sample_dir}')
+    # The shapes are taken from any sample: a split without dates gets zero-length arrays
+    first = dict(np.load(samples[0], allow_pickle=True))
+    shapes = {key: first[key].shape for key in ('x', 'y')}
+
+    for split in SPLITS:
+        split_samples = samples[split_mask(dates, split)]
+        if len(split_samples) == 0:
+            for key, shape in shapes.items():
+                np.save(store_dir / f'{split}_{key}.npy', np.empty((0,) + shape, dtype=np.float32))
+            np.save(store_dir / f'{split}_dates.npy', dates[:0])
+            continue
+        x = np.lib.format.open_memmap(store_dir / f'{split}_x.npy', mode='w+', dtype=np.float32,
+                                      shape=(len(split_samples),) + shapes['x'])
+        y = np.lib.format.open_memmap(store_dir / f'{split}_y.npy', mode='w+', dtype=np.float32,
+                                      shape=(len(split_samples),) + shapes['y'])
+        for i, sample in enumerate(split_samples):
+            data = dict(np.load(sample, allow_pickle=True))
+            x[i], y[i] = data['x'], data['y']
+        x.flush()
+        y.flush()
+        np.save(store_dir / f'{split}_dates.npy', dates[split_mask(dates, split)])
@@ -0,0 +1,152 @@
+''' Output backends for the dataset builders '''
+
+import sys
+sys.path.append('.')
+
+import os
+import zipfile
+import numpy as np
+import pandas as pd
+import xarray as xr
+from pathlib import Path
+from typing import Dict, Union
+from numcodecs import Blosc
+
+from iriscc.samplestore import ZARR_STORE
+
+
+class NpzSampleWriter:
+    """
+    Writes one 'sample_YYYYMMDD.npz' file per date in a dataset directory.
+
+    Attributes:
+        output_dir (Path): Dataset directory.
+    """
+    def __init__(self, output_dir: Union[str, Path]) -> None:
+        self.output_dir = Path(output_dir)
+
+    def path(self, date) -> Path:
+        date_str = pd.Timestamp(date).strftime('%Y%m%d')
+        return self.output_dir / f'sample_{date_str}.npz'
+
+    def exists(self, date) -> bool:
+        """
+        Returns True if the sample of the date exists and is a readable .npz file.
+        """
+        path = self.path(date)
+        if not path.exists():
+            return False
+        try:
+            with np.load(path) as data:
+                return len(data.files) > 0
+        except (OSError, ValueError, zipfile.BadZipFile):
+            return False
+
+    def write(self, date, sample: Dict[str, np.ndarray]) -> None:
+        # Written under a temporary name so that an interrupted build leaves no partial sample
+        path = self.path(date)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **sample)
+        os.replace(tmp_path, path)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class ZarrSampleWriter:
+    """
+    Appends daily samples to a chunked, compressed Zarr store with the date as coordinate.
+
+    Samples are buffered until a full time chunk is available and then appended along
+    the 'time' dimension, so peak memory is bounded by one chunk whatever the length of
+    the period. Each key of the sample dictionary becomes a variable of the store:
+    a (C, H, W) array is stored as ('time', '{key}_channel', 'h', 'w') and a (H, W)
+    array as ('time', 'h', 'w').
+
+    Attributes:
+        store_path (Path): Path of the Zarr store.
+        chunk_size (int): Number of days per chunk along the time axis.
+        compressor (Blosc): Compressor used for every variable (LZ4 + byte shuffle).
+    """
+    def __init__(self, store_path: Union[str, Path], chunk_size: int = 8, clevel: int = 5) -> None:
+        self.store_path = Path(store_path)
+        self.chunk_size = chunk_size
+        self.compressor = Blosc(cname='lz4', clevel=clevel, shuffle=Blosc.SHUFFLE)
+        self.dates = []
+        self.buffer = {}
+        self.append = self.store_path.exists()
+        self.written = set()
+        if self.append:
+            self.written = set(pd.DatetimeIndex(xr.open_zarr(self.store_path)['time'].values).normalize())
+
+    def exists(self, date) -> bool:
+        return pd.Timestamp(date).normalize() in self.written
+
+    def write(self, date, sample: Dict[str, np.ndarray]) -> None:
+        self.dates.append(pd.Timestamp(date))
+        self.written.add(pd.Timestamp(date).normalize())
+        for key, array in sample.items():
+            self.buffer.setdefault(key, []).append(np.asarray(array, dtype=np.float32))
+        if len(self.dates) == self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.dates:
+            return
+        data_vars = {}
+        for key, arrays in self.buffer.items():
+            array = np.stack(arrays, axis=0)
+            if array.ndim == 4:
+                dims = ['time', f'{key}_channel', 'h', 'w']
+            else:
+                dims = ['time', 'h', 'w']
+            data_vars[key] = (dims, array)
+        ds = xr.Dataset(data_vars=data_vars, coords={'time': pd.DatetimeIndex(self.dates)})
+
+        if self.append:
+            ds.to_zarr(self.store_path, append_dim='time')
+        else:
+            encoding = {key: {'chunks': (self.chunk_size,) + ds[key].shape[1:],
+                              'compressor': self.compressor} for key in ds.data_vars}
+            ds.to_zarr(self.store_path, mode='w', encoding=encoding)
+            self.append = True
+        self.dates = []
+        self.buffer = {}
+
+    def close(self) -> None:
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def get_sample_writer(output_dir: Union[str, Path], backend: str, **kwargs):
+    """
+    Returns the sample writer of a dataset builder.
+
+    Args:
+        output_dir (Union[str, Path]): Dataset directory. The Zarr backend writes
+            'output_dir/samples.zarr'.
+        backend (str): Output backend, 'npz' or 'zarr'.
+
+    Returns:
+        NpzSampleWriter | ZarrSampleWriter: Writer exposing `write(date, sample)` and `close()`.
+    """
+    if backend == 'npz':
+        return NpzSampleWriter(output_dir)
+    elif backend == 'zarr':
+        return ZarrSampleWriter(Path(output_dir) / ZARR_STORE, **kwargs)
+    raise ValueError("Invalid backend. Choose from 'npz' or 'zarr'.")
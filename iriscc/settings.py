@@ -9,10 +9,13 @@ RAW_DIR = Path('/scratch/globc/garcia/rawdata/')
 SAFRAN_DIR = RAW_DIR / 'safran'
 SAFRAN_RAW_DIR = SAFRAN_DIR / 'raw_safran'
 SAFRAN_REFORMAT_DIR = SAFRAN_DIR / 'safran_reformat_day'
+SAFRAN_GRID_FILE = Path('/gpfs-calypso/scratch/globc/garcia/utils/tasmax_1d_21000101_21001231.nc') # SAFRAN (x, y) grid
 CMIP6_RAW_DIR = RAW_DIR / 'cmip6'
 ERA5_DIR = RAW_DIR / "era5"
 EOBS_RAW_DIR = RAW_DIR / 'eobs'
 TARGET_SAFRAN_FILE = SAFRAN_REFORMAT_DIR / 'tas_day_SAFRAN_1959_reformat.nc'
+SAFRAN_DAILY_FILE = SAFRAN_DIR / 'tas_day_SAFRAN_daily_mean.nc' # see bin/preprocessing/build_safran_daily.py
+SAFRAN_DAILY_RAW_FILE = SAFRAN_DIR / 'tas_day_SAFRAN_daily_mean_raw.nc' # same daily means, countries kept
 TARGET_EOBS_FILE = EOBS_RAW_DIR / 'tas_ens_mean_1d_025deg_reg_v29_0e_19500101-20231231.nc'
 OROG_FILE = EOBS_RAW_DIR / 'elevation_ens_025deg_reg_v29_0e.nc'
 #OROG_FILE = RAW_DIR / 'topography/topography_safran.nc'
@@ -40,6 +43,7 @@ DATASET_TEST_ERA5_DIR = DATASET_DIR / 'dataset_test_era5'
 DATASET_TEST_6MB_ISAFRAN = DATASET_DIR / 'dataset_test_6mb_iSAFRAN'
 DATASET_BC_DIR = DATASET_DIR / 'dataset_bc'
 DATASET_BC_CMIP6_ERA5 = DATASET_BC_DIR / 'dataset_bc_era5_cmip6.npz' # Historical data for bias correction
+REGRID_WEIGHTS_DIR = DATASET_DIR / 'regrid_weights' # xESMF weights cache
 
 
 RUNS_DIR = Path('/scratch/globc/garcia/runs/')
@@ -117,7 +121,74 @@ TARGET_MODEL_SIZE =[160, 160]
 #DATES_TEST = pd.date_range(start='2012-10-18', end='2014-12-31', freq='D') #exp1 exp2
 DATES_TEST = pd.date_range(start='2010-01-01', end='2014-12-31', freq='D') # exp3
 
+# Dataset splits (first sample of the validation and test sets)
+TRAIN_END = '20091231'
+VAL_END = '20131231'
+
 
 DATES_BC_TRAIN_HIST = pd.date_range(start='1980-01-01', end='1999-12-31', freq='D')
 DATES_BC_TEST_HIST = pd.date_range(start='2000-01-01', end='2014-12-31', freq='D')
 DATES_BC_TEST_FUTURE = pd.date_range(start='2015-01-01', end='2100-12-31', freq='D')
+
+
+# Dataset pipelines (see iriscc/pipeline.py and bin/preprocessing/build_dataset.py)
+# Each entry lists the sources of the inputs and of the target, their regrid chain 
+# ('cmip6' for the CMIP6 grid of the domain, or a target grid file), their masks, 
+# the static channels and the output directory. 
+# layout 'xy' writes {'x': (C, H, W), 'y': (1, H, W)}, 'baseline' writes {'y_hat': (H, W), 'y': (H, W)}.
+PIPELINES = {
+    'exp1': {'output_dir': DATASET_EXP1_30Y_DIR,
+             'dates': DATES,
+             'domain': CONFIG['safran']['domain']['france'],
+             'static': {'file': OROG_FILE, 'var': 'z'},
+             'inputs': [{'source': 'cmip6', 'var': 'tas',
+                         'regrid': [{'target': TARGET_SAFRAN_FILE, 'method': 'conservative_normed'}]}],
+             'target': {'source': 'safran_daily'},
+             'layout': 'xy'},
+    'exp2': {'output_dir': DATASET_EXP2_BI_DIR,
+             'dates': DATES,
+             'domain': CONFIG['safran']['domain']['france'],
+             'static': {'file': OROG_FILE, 'var': 'z'},
+             'inputs': [{'source': 'era5', 'var': 'tas',
+                         'regrid': [{'target': 'cmip6', 'method': 'conservative_normed'},
+                                    {'target': TARGET_SAFRAN_FILE, 'method': 'bilinear'}]}],
+             'target': {'source': 'safran_daily_raw'},
+             'layout': 'xy'},
+    'exp3': {'output_dir': DATASET_EXP3_30Y_DIR,
+             'dates': DATES,
+             'domain': CONFIG['safran']['domain']['france'],
+             'static': {'file': OROG_FILE, 'var': 'Altitude'},
+             'inputs': [{'source': 'era5', 'var': 'tas',
+                         'regrid': [{'target': 'cmip6', 'method': 'conservative_normed'},
+                                    {'target': TARGET_SAFRAN_FILE, 'method': 'conservative_normed'}]}],
+             'target': {'source': 'safran_reformat', 'remove_countries': True},
+             'layout': 'xy'},
+    'exp3_baseline': {'output_dir': DATASET_EXP3_BASELINE_DIR,
+                      'dates': DATES_TEST,
+                      'domain': CONFIG['safran']['domain']['france'],
+                      'inputs': [{'source': 'era5', 'var': 'tas',
+                                  'regrid': [{'target': 'cmip6', 'method': 'conservative_normed', 'landseamask': 'cmip6'},
+                                             {'target': TARGET_SAFRAN_FILE, 'method': 'bilinear'}],
+                                  'remove_countries': True}],
+                      'target': {'source': 'safran_reformat', 'remove_countries': True},
+                      'layout': 'baseline'},
+    'exp4': {'output_dir': DATASET_EXP4_30Y_DIR,
+             'dates': DATES,
+             'domain': CONFIG['eobs']['domain']['europe'],
+             'static': {'file': OROG_FILE, 'var': 'elevation', 'crop': True},
+             'inputs': [{'source': 'era5', 'var': 'tas',
+                         'regrid': [{'target': 'cmip6', 'method': 'conservative_normed'},
+                                    {'target': TARGET_EOBS_FILE, 'method': 'conservative_normed', 'crop_target': True, 'mask': True}]}],
+             'target': {'source': 'eobs'},
+             'coordinates': True,
+             'layout': 'xy'},
+    'exp4_baseline': {'output_dir': DATASET_EXP4_BASELINE_DIR,
+                      'dates': DATES_TEST,
+                      'domain': CONFIG['eobs']['domain']['europe'],
+                      'inputs': [{'source': 'era5', 'var': 'tas',
+                                  'regrid': [{'target': 'cmip6', 'method': 'conservative_normed'},
+                                             {'target': TARGET_EOBS_FILE, 'method': 'bilinear', 'crop_target': True}]}],
+                      'target': {'source': 'eobs'},
+                      'coordinates': True,
+                      'layout': 'baseline'},
+}
@@ -0,0 +1,358 @@
+''' Streaming dataset statistics with mergeable accumulators '''
+
+import sys
+sys.path.append('.')
+
+import os
+import glob
+import numpy as np
+import pandas as pd
+import xarray as xr
+from pathlib import Path
+from functools import reduce, lru_cache
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Tuple, Union
+
+from iriscc.samplestore import ZARR_STORE, SPLITS, sample_date, split_mask, load_sample
+
+PIXEL_STATISTICS_FILE = 'statistics_pixel.npz'
+
+
+class Moments:
+    """
+    Count, mean, sum of squared deviations (M2), min and max of a stream of arrays,
+    reduced over their first axis and ignoring NaN values.
+
+    Two accumulators computed on separate chunks are merged with the parallel
+    formula of Chan et al., so chunks can be reduced in any order.
+
+    Attributes:
+        n (np.ndarray): Number of valid values.
+        mean (np.ndarray): Mean of the valid values.
+        m2 (np.ndarray): Sum of the squared deviations from the mean.
+        min (np.ndarray): Minimum of the valid values.
+        max (np.ndarray): Maximum of the valid values.
+    """
+    def __init__(self) -> None:
+        self.n = None
+        self.mean = None
+        self.m2 = None
+        self.min = None
+        self.max = None
+
+    def update(self, values: np.ndarray) -> 'Moments':
+        """
+        Adds a chunk of values of shape (N, ...) reduced over its first axis.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        chunk = Moments()
+        chunk.n = np.sum(~np.isnan(values), axis=0)
+        chunk.mean = np.nansum(values, axis=0) / np.maximum(chunk.n, 1)
+        chunk.m2 = np.nansum((values - chunk.mean) ** 2, axis=0)
+        chunk.min = np.fmin.reduce(values, axis=0)
+        chunk.max = np.fmax.reduce(values, axis=0)
+        return self.merge(chunk)
+
+    def merge(self, other: 'Moments') -> 'Moments':
+        """
+        Merges the accumulator of another chunk into this one.
+        """
+        if other.n is None:
+            return self
+        if self.n is None:
+            self.n, self.mean, self.m2 = other.n.copy(), other.mean.copy(), other.m2.copy()
+            self.min, self.max = other.min.copy(), other.max.copy()
+            return self
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.n / np.maximum(n, 1)
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.n * other.n / np.maximum(n, 1)
+        self.n = n
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        return self
+
+    @property
+    def var(self) -> np.ndarray:
+        return self.m2 / np.maximum(self.n, 1)
+
+    @property
+    def std(self) -> np.ndarray:
+        return np.sqrt(self.var)
+
+
+class Histogram:
+    """
+    Fixed-bin histogram of a stream of values, ignoring NaN and out-of-range values.
+
+    Attributes:
+        edges (np.ndarray): Bin edges.
+        counts (np.ndarray): Number of values per bin.
+    """
+    def __init__(self, min: float, max: float, bins: int = 50) -> None:
+        self.edges = np.linspace(min, max, bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+
+    def update(self, values: np.ndarray) -> 'Histogram':
+        values = np.asarray(values).ravel()
+        values = values[~np.isnan(values)]
+        self.counts += np.histogram(values, bins=self.edges)[0]
+        return self
+
+    def merge(self, other: 'Histogram') -> 'Histogram':
+        self.counts += other.counts
+        return self
+
+    @property
+    def density(self) -> np.ndarray:
+        return self.counts / max(self.counts.sum(), 1) / np.diff(self.edges)
+
+
+def list_dates(sample_dir: Union[str, Path]) -> np.ndarray:
+    """
+    Returns the sorted sample dates (datetime64[D]) of a dataset, whatever its backend.
+    """
+    sample_dir = Path(sample_dir)
+    if (sample_dir / ZARR_STORE).exists():
+        return np.sort(xr.open_zarr(sample_dir / ZARR_STORE)['time'].values.astype('datetime64[D]'))
+    return np.sort(np.array([sample_date(file) for file in glob.glob(str(sample_dir / 'sample_*.npz'))]))
+
+
+def masked_sample(sample_dir: Union[str, Path], date) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Returns the (x, y) arrays of a sample, x being masked where the target is missing.
+    """
+    data = load_sample(sample_dir, date)
+    x, y = np.array(data['x'], dtype=np.float64), np.array(data['y'], dtype=np.float64)
+    x[:, np.isnan(y[0])] = np.nan
+    return x, y
+
+
+def chunk_moments(sample_dir: Union[str, Path], dates: np.ndarray, n_channels: int) -> Moments:
+    """
+    Returns the moments of the input channels and of the target of a chunk of samples,
+    one channel per (x[0], ..., x[n_channels-2], y[0]).
+    """
+    moments = Moments()
+    for date in dates:
+        x, y = masked_sample(sample_dir, date)
+        values = np.concatenate([x[:n_channels - 1], y[:1]], axis=0)
+        moments.update(values.reshape(n_channels, -1).T)
+    return moments
+
+
+def chunk_histograms(sample_dir: Union[str, Path],
+                     dates: np.ndarray,
+                     min: float,
+                     max: float,
+                     bins: int) -> Dict[str, Tuple[Histogram, Moments]]:
+    """
+    Returns the histograms and moments of the dynamic inputs (x[1:]) and of the target
+    of a chunk of samples.
+    """
+    result = {name: (Histogram(min, max, bins), Moments()) for name in ['x', 'y']}
+    for date in dates:
+        x, y = masked_sample(sample_dir, date)
+        for name, values in [('x', x[1:]), ('y', y)]:
+            result[name][0].update(values)
+            result[name][1].update(values.reshape(-1, 1))
+    return result
+
+
+def sample_channels(sample_dir: Union[str, Path], date, n_channels: int) -> np.ndarray:
+    """
+    Returns the (n_channels, H, W) array (x[0], ..., x[n_channels-2], y[0]) of a sample.
+    """
+    x, y = masked_sample(sample_dir, date)
+    return np.concatenate([x[:n_channels - 1], y[:1]], axis=0)
+
+
+def chunk_pixel_moments(sample_dir: Union[str, Path], dates: np.ndarray, n_channels: int) -> Moments:
+    """
+    Returns the per-pixel moments (n_channels, H, W) of a chunk of samples.
+    """
+    moments = Moments()
+    for date in dates:
+        moments.update(sample_channels(sample_dir, date, n_channels)[np.newaxis])
+    return moments
+
+
+def chunk_doy_moments(sample_dir: Union[str, Path], dates: np.ndarray, n_channels: int) -> Dict[int, Moments]:
+    """
+    Returns the per-pixel moments of a chunk of samples for each day of the year (0-365).
+    """
+    moments = {}
+    for date in dates:
+        doy = pd.Timestamp(date).dayofyear - 1
+        moments.setdefault(doy, Moments()).update(sample_channels(sample_dir, date, n_channels)[np.newaxis])
+    return moments
+
+
+def merge_results(a, b):
+    """
+    Merges two chunk results (accumulators, or dicts / tuples of accumulators).
+    """
+    if isinstance(a, dict):
+        return {key: merge_results(a[key], b[key]) if key in a and key in b else a.get(key, b.get(key))
+                for key in {**a, **b}}
+    if isinstance(a, tuple):
+        return tuple(merge_results(i, j) for i, j in zip(a, b))
+    return a.merge(b)
+
+
+def run_chunks(func: Callable, sample_dir: Union[str, Path], dates: np.ndarray,
+               args: tuple = (), n_workers: int = 1, chunk_size: int = 64):
+    """
+    Runs `func(sample_dir, chunk_dates, *args)` on chunks of dates in a process pool and
+    reduces the chunk results. Memory is bounded by the accumulators, not by the dataset size.
+    """
+    chunks = [dates[i:i + chunk_size] for i in range(0, len(dates), chunk_size)]
+    # Chunk results are merged as they arrive
+    return reduce(merge_results, map_chunks(func, sample_dir, chunks, args, n_workers))
+
+
+def map_chunks(func: Callable, sample_dir: Union[str, Path], chunks: list,
+               args: tuple = (), n_workers: int = 1) -> Iterator:
+    """
+    Yields `func(sample_dir, chunk, *args)` for each chunk, in order: in the current
+    process with a single worker (no pickling), in a process pool otherwise.
+    """
+    if n_workers == 1:
+        yield from (func(sample_dir, chunk, *args) for chunk in chunks)
+        return
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        yield from executor.map(func, [sample_dir] * len(chunks), chunks,
+                                *[[arg] * len(chunks) for arg in args])
+
+
+def compute_statistics(sample_dir: Union[str, Path],
+                       channels: List[str],
+                       n_workers: int = 1,
+                       chunk_size: int = 64,
+                       bins: int = 50) -> Tuple[dict, dict]:
+    """
+    Computes the normalisation statistics of a dataset and the histograms of its splits.
+
+    A first pass computes the per-channel mean, std, min and max over the training split
+    (the statistics used for normalisation). A second pass computes the histograms of
+    every split over the range of the temperature channels.
+
+    Args:
+        sample_dir (Union[str, Path]): Dataset directory.
+        channels (List[str]): Channel names, the last one being the target.
+        n_workers (int): Number of worker processes.
+        chunk_size (int): Number of samples per chunk.
+        bins (int): Number of histogram bins.
+
+    Returns:
+        Tuple[dict, dict]: The statistics ({channel: {'mean', 'std', 'min', 'max'}}) and
+            the histograms ({'x'|'y': {split: (Histogram, Moments)}}).
+    """
+    dates = list_dates(sample_dir)
+    train = run_chunks(chunk_moments, sample_dir, dates[split_mask(dates, 'train')],
+                       args=(len(channels),), n_workers=n_workers, chunk_size=chunk_size)
+    stats = {}
+    for i, channel in enumerate(channels):
+        stats[channel] = {'mean': float(train.mean[i]),
+                          'std': float(train.std[i]),
+                          'min': float(train.min[i]),
+                          'max': float(train.max[i])}
+
+    # Only temperature values are kept in the histograms
+    min, max = float(train.min[1:].min()), float(train.max[1:].max())
+    histograms = {'x': {}, 'y': {}}
+    for split in SPLITS:
+        result = run_chunks(chunk_histograms, sample_dir, dates[split_mask(dates, split)],
+                            args=(min, max, bins), n_workers=n_workers, chunk_size=chunk_size)
+        for name in histograms:
+            histograms[name][split] = result[name]
+    return stats, histograms
+
+
+def compute_pixel_statistics(sample_dir: Union[str, Path],
+                             channels: List[str],
+                             stats: dict,
+                             n_workers: int = 1,
+                             chunk_size: int = 64,
+                             doy_block: int = 8) -> Dict[str, np.ndarray]:
+    """
+    Computes per-pixel mean and std maps of the training split, over the whole period
+    ('mean', 'std' of shape (C, H, W)) and per day of the year ('doy_mean', 'doy_std' of
+    shape (366, C, H, W)).
+
+    The samples are reduced chunk by chunk, never as a whole cube. The day-of-year maps are
+    computed by blocks of `doy_block` days, each block being reduced in one task.
+    Channels that are constant in time (e.g. the orography) and pixels without data use
+    the channel-wide mean and std of `stats`.
+
+    Args:
+        sample_dir (Union[str, Path]): Dataset directory.
+        channels (List[str]): Channel names, the last one being the target.
+        stats (dict): Channel-wide statistics (see `compute_statistics`).
+        n_workers (int): Number of worker processes.
+        chunk_size (int): Number of samples per chunk.
+        doy_block (int): Number of days of the year per task.
+
+    Returns:
+        Dict[str, np.ndarray]: The float32 'mean', 'std', 'doy_mean' and 'doy_std' maps.
+    """
+    dates = list_dates(sample_dir)
+    dates = dates[split_mask(dates, 'train')]
+    n_channels = len(channels)
+    channel_mean = np.array([stats[channel]['mean'] for channel in channels]).reshape(-1, 1, 1)
+    channel_std = np.array([stats[channel]['std'] for channel in channels]).reshape(-1, 1, 1)
+
+    def fill(mean, std):
+        constant = np.nanmax(std, axis=(-2, -1), keepdims=True) == 0
+        mean = np.where(np.isnan(mean) | constant, channel_mean, mean)
+        std = np.where(~(std > 0) | constant, channel_std, std)
+        return mean.astype(np.float32), std.astype(np.float32)
+
+    moments = run_chunks(chunk_pixel_moments, sample_dir, dates,
+                         args=(n_channels,), n_workers=n_workers, chunk_size=chunk_size)
+    mean = np.where(moments.n > 0, moments.mean, np.nan)
+    maps = dict(zip(['mean', 'std'], fill(mean, moments.std)))
+
+    doy_mean = np.empty((366,) + maps['mean'].shape, dtype=np.float32)
+    doy_std = np.empty((366,) + maps['std'].shape, dtype=np.float32)
+    doys = np.array([pd.Timestamp(date).dayofyear - 1 for date in dates])
+    blocks = [dates[(doys >= start) & (doys < start + doy_block)] for start in range(0, 366, doy_block)]
+    results = map_chunks(chunk_doy_moments, sample_dir, blocks, (n_channels,), n_workers)
+    # Each block result is written in the preallocated maps and released
+    for start, result in zip(range(0, 366, doy_block), results):
+        for doy in range(start, min(start + doy_block, 366)):
+            if doy in result:
+                doy_mean[doy], doy_std[doy] = fill(np.where(result[doy].n > 0, result[doy].mean, np.nan),
+                                                   result[doy].std)
+            else:
+                doy_mean[doy], doy_std[doy] = maps['mean'], maps['std']
+
+    maps['doy_mean'] = doy_mean
+    maps['doy_std'] = doy_std
+    return maps
+
+
+def save_pixel_statistics(sample_dir: Union[str, Path], maps: Dict[str, np.ndarray]) -> Path:
+    """
+    Writes the per-pixel maps of `compute_pixel_statistics` next to 'statistics.json'.
+    """
+    file = Path(sample_dir) / PIXEL_STATISTICS_FILE
+    tmp_file = file.with_suffix('.tmp.npz')
+    np.savez(tmp_file, **maps)
+    os.replace(tmp_file, file)
+    return file
+
+
+@lru_cache(maxsize=4)
+def load_pixel_statistics(sample_dir: Union[str, Path]) -> Dict[str, np.ndarray]:
+    """
+    Returns the read-only per-pixel maps of a dataset, read once per process.
+    """
+    file = Path(sample_dir) / PIXEL_STATISTICS_FILE
+    if not file.exists():
+        raise FileNotFoundError(f'{file} not found, run compute_statistics.py with --pixel')
+    with np.load(file) as data:
+        maps = {key: data[key] for key in data.files}
+    for values in maps.values():
+        values.setflags(write=False)
+    return maps
@@ -0,0 +1,88 @@
+''' Date-indexed access to daily and sub-daily NetCDF files '''
+
+import sys
+sys.path.append('.')
+
+import datetime
+import numpy as np
+import pandas as pd
+import xarray as xr
+from pathlib import Path
+from functools import lru_cache
+from typing import Dict, Optional, Union
+
+from iriscc.ncpool import open_dataset, coordinate
+
+
+def day_key(date) -> datetime.date:
+    """
+    Returns the calendar day of a date (pd.Timestamp, datetime, datetime.date,
+    np.datetime64, cftime or 'YYYY-MM-DD' string).
+    """
+    if hasattr(date, 'year') and hasattr(date, 'month') and hasattr(date, 'day'):
+        return datetime.date(date.year, date.month, date.day)
+    return pd.Timestamp(date).date()
+
+
+class TimeIndexedReader:
+    """
+    Serves the time steps of a given day of a dataset by position.
+
+    The (date -> positions) index is built once from the time axis, so that reading a
+    day no longer scans the whole time axis (`ds.sel(time=ds.time.dt.date == date)`).
+
+    Attributes:
+        ds (xr.Dataset): The indexed dataset.
+        index (Dict[datetime.date, slice]): Positions of the time steps of each day.
+    """
+    def __init__(self, ds: xr.Dataset, index: Optional[Dict[datetime.date, slice]] = None) -> None:
+        self.ds = ds
+        self.index = self.build_index(ds['time'].values) if index is None else index
+
+    @staticmethod
+    def build_index(times: np.ndarray) -> Dict[datetime.date, slice]:
+        if np.issubdtype(times.dtype, np.datetime64):
+            days = pd.DatetimeIndex(times).date
+        else: # cftime dates
+            days = [day_key(t) for t in times]
+        index = {}
+        for i, day in enumerate(days):
+            if day in index:
+                index[day] = slice(index[day].start, i + 1)
+            else:
+                index[day] = slice(i, i + 1)
+        return index
+
+    def __contains__(self, date) -> bool:
+        return day_key(date) in self.index
+
+    def day(self, date, squeeze: bool = True) -> xr.Dataset:
+        """
+        Returns the time steps of a day.
+
+        Args:
+            date: The day to read.
+            squeeze (bool): If True, only the first time step of the day is returned,
+                without time dimension (as `.isel(time=0)`).
+
+        Raises:
+            KeyError: If the day is not in the dataset.
+        """
+        positions = self.index[day_key(date)]
+        if squeeze:
+            return self.ds.isel(time=positions.start)
+        return self.ds.isel(time=positions)
+
+
+@lru_cache(maxsize=None)
+def _time_index(path: str) -> Dict[datetime.date, slice]:
+    return TimeIndexedReader.build_index(coordinate(path, 'time'))
+
+
+def open_reader(path: Union[str, Path]) -> TimeIndexedReader:
+    """
+    Returns the time-indexed reader of a NetCDF file. The dataset comes from the handle
+    pool and the index is built once per file, so reading a file day by day opens and 
+    indexes it once.
+    """
+    return TimeIndexedReader(open_dataset(path), index=_time_index(str(path)))
@@ -0,0 +1,108 @@
+''' Cache of the samples after the deterministic training transforms '''
+
+import sys
+sys.path.append('.')
+
+import os
+import json
+import hashlib
+import numpy as np
+from pathlib import Path
+from typing import Tuple, Union
+
+from iriscc.statistics import PIXEL_STATISTICS_FILE
+
+CACHE_DIR = 'transform_cache'
+
+
+def transform_hash(hparams) -> str:
+    """
+    Returns a hash of everything the training transform chain depends on: the
+    hyper-parameters used by the transforms and the dataset statistics.
+    """
+    config = {'sample_dir': str(hparams.sample_dir),
+              'output_norm': hparams.output_norm,
+              'mask': hparams.mask,
+              'fill_value': hparams.fill_value,
+              'domain_crop': hparams.domain_crop,
+              'normalisation': hparams.normalisation}
+    h = hashlib.md5(json.dumps(config, sort_keys=True).encode())
+    with open(Path(hparams.sample_dir) / 'statistics.json', 'rb') as f:
+        h.update(f.read())
+    if hparams.normalisation != 'minmax':
+        with open(Path(hparams.sample_dir) / PIXEL_STATISTICS_FILE, 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()[:12]
+
+
+class TransformCache:
+    """
+    Stores the transformed (padded) samples of a dataset split in a binary shard.
+
+    The transform chain is run once per (dataset, hparams hash) and the resulting
+    tensors are written to 'sample_dir/transform_cache/{split}_{hash}_x.npy' and
+    '..._y.npy', optionally in float16. Later epochs and runs read them through
+    `np.memmap`.
+
+    Attributes:
+        cache_dir (Path): Directory containing the shards.
+        prefix (str): Shard name prefix, '{split}_{hash}'.
+        dtype (str): Storage type of the shards ('float32' or 'float16').
+    """
+    def __init__(self, sample_dir: Union[str, Path], data_type: str, key: str, dtype: str = 'float32') -> None:
+        self.cache_dir = Path(sample_dir) / CACHE_DIR
+        self.prefix = f'{data_type}_{key}_{dtype}'
+        self.dtype = dtype
+        self._x = None
+        self._y = None
+
+    def exists(self) -> bool:
+        return (self.cache_dir / f'{self.prefix}_y.npy').exists()
+
+    def build(self, dataset) -> None:
+        """
+        Runs the dataset (with its transforms) over every sample and writes the shards.
+
+        Args:
+            dataset: Dataset returning transformed (x, y) tensors.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        x_0, y_0 = dataset[0]
+        shards = {}
+        for name, shape in [('x', x_0.shape), ('y', y_0.shape)]:
+            tmp_path = self.cache_dir / f'{self.prefix}_{name}.tmp.npy'
+            shards[name] = (tmp_path, np.lib.format.open_memmap(tmp_path, mode='w+', dtype=self.dtype,
+                                                                 shape=(len(dataset),) + tuple(shape)))
+        for i in range(len(dataset)):
+            x, y = dataset[i]
+            shards['x'][1][i] = x.numpy()
+            shards['y'][1][i] = y.numpy()
+        # y is renamed last, its presence marks a complete cache
+        for name in ['x', 'y']:
+            tmp_path, array = shards[name]
+            array.flush()
+            os.replace(tmp_path, self.cache_dir / f'{self.prefix}_{name}.npy')
+
+    @property
+    def x(self) -> np.memmap:
+        if self._x is None:
+            self._x = np.load(self.cache_dir / f'{self.prefix}_x.npy', mmap_mode='r')
+        return self._x
+
+    @property
+    def y(self) -> np.memmap:
+        if self._y is None:
+            self._y = np.load(self.cache_dir / f'{self.prefix}_y.npy', mmap_mode='r')
+        return self._y
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_x'] = None
+        state['_y'] = None
+        return state
+
+    def __len__(self) -> int:
+        return len(self.y)
+
+    def __getitem__(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.x[idx], self.y[idx]
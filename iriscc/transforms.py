@@ -2,17 +2,17 @@ import sys
 sys.path.append('.')
 
 import numpy as np
-import glob
 import json
 import torch
-import numpy as np
-import xarray as xr
 import torch.nn.functional as F
 from typing import Tuple, Union, List, Optional
 from pathlib import Path
 
 
-from iriscc.settings import (IMERG_MASK, CONFIG, DATASET_EXP4_30Y_DIR)
+from iriscc.settings import (CONFIG, DATASET_EXP4_30Y_DIR)
+from iriscc.geometry import continents_condition, crop_indices
+from iriscc.samplestore import load_static
+from iriscc.statistics import load_pixel_statistics
 from iriscc.plotutils import plot_test
 
 
@@ -33,7 +33,7 @@ class StandardNormalisation():
         self.std = std
     
     def __call__(self, sample: Tuple[np.ndarray, np.ndarray]) -> Tuple[torch.Tensor, torch.Tensor]:
-        x, y = sample
+        x, y = sample[:2]
         x = [(x[C, :, :] - self.mean[C]) / self.std[C] for C in range(len(x))]
         x = np.stack(x, axis=0)
         return torch.tensor(x), torch.tensor(y)
@@ -57,11 +57,11 @@ class MinMaxNormalisation():
         self.output_norm = output_norm
     
     def __call__(self, sample: Tuple[np.ndarray, np.ndarray]) -> Tuple[torch.Tensor, torch.Tensor]:
-        x, y = sample
+        x, y = sample[:2]
         x = [(x[C, :, :] - self.min[C]) / (self.max[C] - self.min[C]) for C in range(len(x))]
         x = np.stack(x, axis=0)
         if self.output_norm:
-            y[0, :, :] = (y[0, :, :] - self.min[-1]) / (self.max[-1] - self.min[-1])
+            y = (y - self.min[-1]) / (self.max[-1] - self.min[-1])
         return torch.tensor(x), torch.tensor(y)
 
     
@@ -89,6 +89,33 @@ class DeMinMaxNormalisation:
                 y[0, :, :] = y[0, :, :] * (self.max[-1] - self.min[-1]) + self.min[-1]
             return torch.tensor(x), torch.tensor(y)
             
+
+
+class PixelStandardNormalisation:
+    """
+    Applies a per-pixel Standard Normalisation to the inputs, with the mean and std maps
+    of the training period or of the sample's day of the year (see `compute_pixel_statistics`).
+    With day_of_year, samples are (x, y, doy) tuples, doy being the 0-based day of the year.
+    """
+    def __init__(self, sample_dir: Union[str, Path], output_norm: bool, day_of_year: bool = False) -> None:
+        if output_norm:
+            raise ValueError('Per-pixel normalisation is only applied to the inputs (output_norm=False)')
+        maps = load_pixel_statistics(sample_dir)
+        self.day_of_year = day_of_year
+        self.mean = maps['doy_mean'] if day_of_year else maps['mean']
+        self.std = maps['doy_std'] if day_of_year else maps['std']
+
+    def __call__(self, sample: Tuple[np.ndarray, ...]) -> Tuple[torch.Tensor, torch.Tensor]:
+        x, y = sample[:2]
+        C = len(x)
+        if self.day_of_year:
+            doy = int(sample[2])
+            mean, std = self.mean[doy, :C], self.std[doy, :C]
+        else:
+            mean, std = self.mean[:C], self.std[:C]
+        x = (x - mean) / std
+        return torch.tensor(x), torch.tensor(y)
+
         
 class LandSeaMask():
     """
@@ -97,9 +124,7 @@ class LandSeaMask():
     def __init__(self, mask: str, fill_value: float) -> None:
         self.mask = mask
         if self.mask == 'continents':
-            ds = xr.open_dataset(IMERG_MASK)
-            ds['landseamask'].values = 100 - ds['landseamask'].values
-            self.condition = ds['landseamask'].values < 25
+            self.condition = torch.from_numpy(continents_condition().copy())
         
         self.fill_value = fill_value
 
@@ -194,7 +219,8 @@ class UnPad():
         y = sample
         y = [self.unpad_func(y[C]) for C in range(len(y))]
         y = torch.stack(y)
-        return y
+        # bf16 predictions and channels_last layouts are returned as standard float32 tensors
+        return y.float()
     
     
 class DomainCrop:
@@ -208,24 +234,238 @@ class DomainCrop:
     def __init__(self, sample_dir: Union[str, Path], domain_crop: Optional[Tuple[float, float, float, float]]) -> None:
         self.sample_dir = Path(sample_dir)
         self.domain = domain_crop
+        if self.domain is not None:
+            lat_indices, lon_indices = crop_indices(self.sample_dir, self.domain)
+            self.lat_indices = torch.tensor(lat_indices, dtype=torch.long)
+            self.lon_indices = torch.tensor(lon_indices, dtype=torch.long)
 
     def __call__(self, sample: Tuple[np.ndarray, np.ndarray]) -> Tuple[torch.Tensor, torch.Tensor]:
         x, y = sample
         if self.domain is not None:
-            coords_file = glob.glob(str(self.sample_dir / 'coordinates.npz'))[0]
-            coordinates = dict(np.load(coords_file, allow_pickle=True))
-            self.lon = coordinates['lon']
-            self.lat = coordinates['lat']
-            lon_indices = np.where((self.lon >= self.domain[0]) & (self.lon <= self.domain[1]))[0]
-            lat_indices = np.where((self.lat >= self.domain[2]) & (self.lat <= self.domain[3]))[0]
-            
-            lat_indices_torch = torch.tensor(lat_indices, dtype=torch.long)
-            lon_indices_torch = torch.tensor(lon_indices, dtype=torch.long)
-            x = x[:, lat_indices_torch][:, :, lon_indices_torch]
-            y = y[:, lat_indices_torch][:, :, lon_indices_torch]
+            x = x[:, self.lat_indices][:, :, self.lon_indices]
+            y = y[:, self.lat_indices][:, :, self.lon_indices]
         return torch.tensor(x), torch.tensor(y)
 
+
+
+# Batched transforms: they act on whole (B, C, H, W) tensors after collation, on the
+# device of the batch, with statistics broadcast as (1, C, 1, 1) tensors.
+
+class BatchStaticChannels:
+    """
+    Puts the static channels of a dataset (see `save_static`) in front of the dynamic
+    channels of a batch. The static tensor is expanded over the batch, not copied.
+    """
+    def __init__(self, sample_dir: Union[str, Path]) -> None:
+        static = load_static(sample_dir)
+        self.static = None if static is None else torch.from_numpy(static.copy()).unsqueeze(0)
+
+    def __call__(self, sample: Tuple[torch.Tensor, ...]) -> Tuple[torch.Tensor, ...]:
+        x, y, *rest = sample
+        if self.static is not None:
+            if self.static.device != x.device or self.static.dtype != x.dtype:
+                self.static = self.static.to(device=x.device, dtype=x.dtype) # moved once
+            x = torch.cat([self.static.expand(x.shape[0], -1, -1, -1), x], dim=1)
+        return (x, y, *rest)
+
+
+class BatchMinMaxNormalisation:
+    """
+    Applies the Min-Max Normalisation to a batch of samples.
+    """
+    def __init__(self, sample_dir: Union[str, Path], output_norm: bool) -> None:
+        statistics_file = Path(sample_dir) / 'statistics.json'
+        with open(statistics_file) as f:
+            stats = json.load(f)
+        self.min = torch.tensor([stats[channel]['min'] for channel in stats.keys()]).view(1, -1, 1, 1)
+        self.max = torch.tensor([stats[channel]['max'] for channel in stats.keys()]).view(1, -1, 1, 1)
+        self.output_norm = output_norm
+
+    def __call__(self, sample: Tuple[torch.Tensor, torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        x, y = sample[:2]
+        min = self.min.to(device=x.device, dtype=x.dtype)
+        max = self.max.to(device=x.device, dtype=x.dtype)
+        C = x.shape[1]
+        x = (x - min[:, :C]) / (max[:, :C] - min[:, :C])
+        if self.output_norm:
+            y = (y - min[:, -1:]) / (max[:, -1:] - min[:, -1:])
+        return x, y
+
+
+class BatchDeMinMaxNormalisation:
+    """
+    Reverts the Min-Max Normalisation of a batch of samples.
+    """
+    def __init__(self, sample_dir: Union[str, Path], output_norm: bool) -> None:
+        statistics_file = Path(sample_dir) / 'statistics.json'
+        with open(statistics_file) as f:
+            stats = json.load(f)
+        self.min = torch.tensor([stats[channel]['min'] for channel in stats.keys()]).view(1, -1, 1, 1)
+        self.max = torch.tensor([stats[channel]['max'] for channel in stats.keys()]).view(1, -1, 1, 1)
+        self.output_norm = output_norm
+
+    def __call__(self, sample: Tuple[Union[bool, torch.Tensor], torch.Tensor]) -> Union[torch.Tensor, Tuple[torch.Tensor, torch.Tensor]]:
+        x, y = sample
+        min = self.min.to(device=y.device, dtype=y.dtype)
+        max = self.max.to(device=y.device, dtype=y.dtype)
+        if x is False:
+            return y * (max[:, -1:] - min[:, -1:]) + min[:, -1:]
+        C = x.shape[1]
+        x = x * (max[:, :C] - min[:, :C]) + min[:, :C]
+        if self.output_norm:
+            y = y * (max[:, -1:] - min[:, -1:]) + min[:, -1:]
+        return x, y
+
+
+class BatchPixelStandardNormalisation:
+    """
+    Applies the per-pixel Standard Normalisation to a batch of samples. The maps are
+    moved once to the device of the batch; with day_of_year, the batch is (x, y, doy).
+    """
+    def __init__(self, sample_dir: Union[str, Path], output_norm: bool, day_of_year: bool = False) -> None:
+        if output_norm:
+            raise ValueError('Per-pixel normalisation is only applied to the inputs (output_norm=False)')
+        maps = load_pixel_statistics(sample_dir)
+        self.day_of_year = day_of_year
+        self.mean = torch.from_numpy((maps['doy_mean'] if day_of_year else maps['mean'][np.newaxis]).copy())
+        self.std = torch.from_numpy((maps['doy_std'] if day_of_year else maps['std'][np.newaxis]).copy())
+
+    def __call__(self, sample: Tuple[torch.Tensor, ...]) -> Tuple[torch.Tensor, torch.Tensor]:
+        x, y = sample[:2]
+        if self.mean.device != x.device or self.mean.dtype != x.dtype:
+            self.mean = self.mean.to(device=x.device, dtype=x.dtype)
+            self.std = self.std.to(device=x.device, dtype=x.dtype)
+        C = x.shape[1]
+        if self.day_of_year:
+            doy = sample[2].to(device=x.device, dtype=torch.long)
+            mean, std = self.mean[doy, :C], self.std[doy, :C]
+        else:
+            mean, std = self.mean[:, :C], self.std[:, :C]
+        x = (x - mean) / std
+        return x, y
+
+
+class BatchLandSeaMask:
+    """
+    Applies a mask to every input channel of a batch of samples.
+    """
+    def __init__(self, mask: str, fill_value: float) -> None:
+        self.mask = mask
+        if self.mask == 'continents':
+            self.condition = torch.from_numpy(continents_condition().copy())
+        self.fill_value = fill_value
+
+    def __call__(self, sample: Tuple[torch.Tensor, torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        x, y = sample
+        if self.mask == 'none':
+            return x, y
+        if self.mask == 'target':
+            condition = torch.isnan(y[:, :1])
+        else:
+            condition = self.condition.to(x.device)
+        x = x.masked_fill(condition, self.fill_value)
+        return x, y
+
+
+class BatchFillMissingValue:
+    """
+    Fills missing (NaN) values in a batch of samples with a specified fill value.
+    """
+    def __init__(self, fill_value: float) -> None:
+        self.fill_value = fill_value
+
+    def __call__(self, sample: Tuple[torch.Tensor, torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        x, y = sample
+        x = torch.nan_to_num(x, nan=self.fill_value)
+        y = torch.nan_to_num(y, nan=self.fill_value)
+        return x, y
+
+
+class BatchDomainCrop:
+    """
+    Crops a batch of samples to a specified domain based on latitude and longitude.
+    """
+    def __init__(self, sample_dir: Union[str, Path], domain_crop: Optional[Tuple[float, float, float, float]]) -> None:
+        self.domain = domain_crop
+        if self.domain is not None:
+            lat_indices, lon_indices = crop_indices(sample_dir, self.domain)
+            self.lat_indices = torch.tensor(lat_indices, dtype=torch.long)
+            self.lon_indices = torch.tensor(lon_indices, dtype=torch.long)
+
+    def __call__(self, sample: Tuple[torch.Tensor, torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        x, y = sample
+        if self.domain is not None:
+            lat_indices = self.lat_indices.to(x.device)
+            lon_indices = self.lon_indices.to(x.device)
+            x = x.index_select(-2, lat_indices).index_select(-1, lon_indices)
+            y = y.index_select(-2, lat_indices).index_select(-1, lon_indices)
+        return x, y
+
+
+class BatchPad:
+    """
+    Pads the last two dimensions of a batch of samples to make them divisible by 32.
+    The padded inputs are returned in the channels_last memory format if channels_last.
+    """
+    def __init__(self, fill_value: float, channels_last: bool = False) -> None:
+        self.divisor: int = 32
+        self.fill_value: float = fill_value
+        self.channels_last: bool = channels_last
+
+    def pad_func(self, array: torch.Tensor) -> torch.Tensor:
+        H, W = array.shape[-2:]
+        padding_H = (-H) % self.divisor
+        padding_W = (-W) % self.divisor
+        padding = (padding_W // 2, padding_W - padding_W // 2,
+                   padding_H // 2, padding_H - padding_H // 2)
+        return F.pad(array, padding, mode='constant', value=self.fill_value)
+
+    def __call__(self, sample: Tuple[torch.Tensor, torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+        x, y = sample
+        x = self.pad_func(x)
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        return x, self.pad_func(y)
+
+
+class BatchUnPad:
+    """
+    Removes the padding of the last two dimensions of a batch based on the initial size.
+    """
+    def __init__(self, initial_size: Tuple[int, int]) -> None:
+        self.initial_size: Tuple[int, int] = initial_size
+
+    def __call__(self, sample: torch.Tensor) -> torch.Tensor:
+        H, W = self.initial_size[0], self.initial_size[1]
+        new_H, new_W = sample.shape[-2:]
+        pad_top = (new_H - H) // 2
+        pad_left = (new_W - W) // 2
+        return sample[..., pad_top:pad_top + H, pad_left:pad_left + W].contiguous().float()
+
     
+NORMALISATIONS = ['minmax', 'pixel', 'pixel_doy']
+
+
+def get_normalisation(hparams: dict, batch: bool = False):
+    """
+    Returns the input normalisation selected by hparams['normalisation']:
+    'minmax' (scalar min/max per channel), 'pixel' (per-pixel mean/std maps) or 
+    'pixel_doy' (per-pixel mean/std maps of the sample's day of the year).
+
+    Args:
+        hparams (dict): Hyperparameters (IRISCCHyperParameters().__dict__).
+        batch (bool): Returns the batched transform if True.
+    """
+    normalisation = hparams.get('normalisation', 'minmax')
+    if normalisation not in NORMALISATIONS:
+        raise ValueError(f'Unknown normalisation {normalisation}, expected one of {NORMALISATIONS}')
+    if normalisation == 'minmax':
+        transform = BatchMinMaxNormalisation if batch else MinMaxNormalisation
+        return transform(hparams['sample_dir'], hparams['output_norm'])
+    transform = BatchPixelStandardNormalisation if batch else PixelStandardNormalisation
+    return transform(hparams['sample_dir'], hparams['output_norm'], day_of_year=normalisation == 'pixel_doy')
+
+
 if __name__=='__main__':
     file = '/gpfs-calypso/scratch/globc/garcia/datasets/dataset_exp4_30y/sample_19850102.npz'
     coordinate = '/gpfs-calypso/scratch/globc/garcia/datasets/dataset_exp4_30y/coordinates.npz'
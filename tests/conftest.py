@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The iriscc package is imported from the repository root, like the bin/ scripts
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
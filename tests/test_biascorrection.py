@@ -0,0 +1,61 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('pandas')
+from iriscc.biascorrection import QuantileMapping, QuantileDebiaser, cdft_table, correct, interp_columns
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(0)
+
+
+def tables(rng, K=11, P=6):
+    xp = np.sort(rng.normal(0., 3., size=(K, P)), axis=0)
+    fp = np.sort(rng.normal(1., 2., size=(K, P)), axis=0)
+    return xp, fp
+
+
+def test_interp_columns_matches_np_interp(rng):
+    xp, fp = tables(rng)
+    x = rng.normal(0., 5., size=(50, xp.shape[1])) # includes values outside the tables
+    y = interp_columns(x, xp, fp)
+    for j in range(xp.shape[1]):
+        np.testing.assert_allclose(y[:, j], np.interp(x[:, j], xp[:, j], fp[:, j]), rtol=1e-10, atol=1e-10)
+
+
+def test_interp_columns_invalid_table_returns_nan(rng):
+    xp, fp = tables(rng)
+    xp[3, 2] = np.nan
+    fp[0, 4] = np.nan
+    y = interp_columns(rng.normal(size=(10, xp.shape[1])), xp, fp)
+    assert np.isnan(y[:, [2, 4]]).all()
+    assert not np.isnan(np.delete(y, [2, 4], axis=1)).any()
+
+
+def test_cdft_table_matches_reference(rng):
+    p = np.linspace(0., 1., 11)
+    q_oh, q_ch = tables(rng)
+    q_cf = np.sort(rng.normal(2., 3., size=q_oh.shape), axis=0)
+    table = cdft_table(q_cf, q_ch, q_oh, p)
+    for j in range(q_oh.shape[1]):
+        p_ch = np.interp(q_oh[:, j], q_ch[:, j], p)
+        np.testing.assert_allclose(table[:, j], np.interp(p_ch, p, q_cf[:, j]), rtol=1e-10, atol=1e-10)
+
+
+def test_correct_maps_source_quantiles_to_target(rng):
+    source, target = tables(rng)
+    np.testing.assert_allclose(correct(source, source, target), target, rtol=1e-10, atol=1e-10)
+
+
+def test_quantile_mapping_round_trip(rng, tmp_path):
+    time = np.arange('2000-01-01', '2004-01-01', dtype='datetime64[D]')
+    obs = rng.normal(285., 4., size=(len(time), 3, 2))
+    cm_hist = obs * 1.1 - 30. # a linear bias, removed by the mapping
+    debiaser = QuantileMapping(n_quantiles=50, by_month=False).fit(obs, cm_hist, time, time)
+    corrected = debiaser.apply(cm_hist, time)
+    assert np.abs(corrected - obs).max() < 0.5
+
+    loaded = QuantileDebiaser.load(debiaser.save(tmp_path / 'debiaser_qm'))
+    assert loaded.fit_key == debiaser.fit_hash(obs, cm_hist, time, time)
+    np.testing.assert_array_equal(loaded.apply(cm_hist, time), corrected)
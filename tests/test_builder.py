@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from iriscc.builder import ProgressManifest, run_build
+
+
+class MemoryWriter:
+    ''' In-memory sample writer recording the order of the writes '''
+    def __init__(self, existing=()):
+        self.samples = {date: None for date in existing}
+        self.order = []
+
+    def exists(self, date):
+        return date in self.samples
+
+    def write(self, date, sample):
+        self.samples[date] = sample
+        self.order.append(date)
+
+    def flush(self):
+        pass
+
+
+def build_task(task):
+    # Module-level, so that the worker processes can run it
+    return [(f'{task}-{i}', {'x': task * 10 + i}) for i in range(3)]
+
+
+@pytest.mark.parametrize('n_workers', [1, 3])
+def test_samples_are_written_in_task_order(n_workers):
+    writer = MemoryWriter()
+    run_build(range(8), build_task, writer, n_workers=n_workers)
+    assert writer.order == [f'{task}-{i}' for task in range(8) for i in range(3)]
+
+
+def test_existing_samples_are_skipped():
+    writer = MemoryWriter(existing=['1-1'])
+    run_build(range(2), build_task, writer)
+    assert writer.order == ['0-0', '0-1', '0-2', '1-0', '1-2']
+
+
+def test_completed_tasks_are_recorded_and_resumed(tmp_path):
+    manifest_path = tmp_path / 'build_progress.json'
+    run_build(range(3), build_task, MemoryWriter(), manifest_path=manifest_path)
+    with open(manifest_path) as f:
+        assert json.load(f)['completed'] == ['0', '1', '2']
+
+    writer = MemoryWriter()
+    run_build(range(5), build_task, writer, manifest_path=manifest_path)
+    assert writer.order == [f'{task}-{i}' for task in (3, 4) for i in range(3)]
+    assert ProgressManifest(manifest_path).completed == {str(task) for task in range(5)}
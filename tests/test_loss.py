@@ -0,0 +1,74 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+from iriscc.loss import MaskedMSELoss, masked_error_sums
+
+FILL_VALUE = 0.
+
+
+def old_masked_mse(y_hat, y, ignore_value):
+    # Implementation of MaskedMSELoss before masked_error_sums
+    mask = (y != ignore_value).float()
+    return ((y_hat - y) ** 2 * mask).sum() / mask.sum()
+
+
+def old_masked_sums(preds, target, ignore_value=None, weight=None):
+    # Implementation of MaskedRMSE / MaskedMAE.update before masked_error_sums
+    mask = (target != ignore_value).float() if ignore_value is not None else torch.ones_like(target)
+    weight = torch.ones_like(target) if weight is None else weight
+    effective_weight = mask * weight
+    return (((preds - target) ** 2 * effective_weight).sum(),
+            ((preds - target).abs() * effective_weight).sum(),
+            effective_weight.sum())
+
+
+@pytest.fixture
+def batch():
+    generator = torch.Generator().manual_seed(0)
+    y = torch.rand(4, 1, 16, 16, generator=generator) + 0.5
+    y[torch.rand(y.shape, generator=generator) < 0.3] = FILL_VALUE
+    y_hat = torch.rand(4, 1, 16, 16, generator=generator)
+    return y_hat, y
+
+
+def test_loss_matches_old_masked_mse(batch):
+    y_hat, y = batch
+    torch.testing.assert_close(MaskedMSELoss(FILL_VALUE)(y_hat, y), old_masked_mse(y_hat, y, FILL_VALUE))
+
+
+@pytest.mark.parametrize('ignore_value', [FILL_VALUE, None])
+@pytest.mark.parametrize('weighted', [False, True])
+def test_sums_match_old_metrics(batch, ignore_value, weighted):
+    y_hat, y = batch
+    weight = torch.linspace(0.5, 1.5, 16).reshape(1, 1, 16, 1) if weighted else None
+    sums = masked_error_sums(y_hat, y, ignore_value, weight=weight)
+    reference = old_masked_sums(y_hat, y, ignore_value, weight.expand_as(y) if weighted else None)
+    for value, expected in zip(sums, reference):
+        torch.testing.assert_close(value.double(), expected.double())
+
+
+@pytest.mark.parametrize('ignore_value', [FILL_VALUE, None])
+def test_per_sample_sums_match_per_sample_calls(batch, ignore_value):
+    y_hat, y = batch
+    sse, sae, count = masked_error_sums(y_hat, y, ignore_value, dim=(1, 2, 3))
+    assert sse.shape == sae.shape == count.shape == (len(y),)
+    for i in range(len(y)):
+        for value, expected in zip((sse[i], sae[i], count[i]), old_masked_sums(y_hat[i:i+1], y[i:i+1], ignore_value)):
+            torch.testing.assert_close(value.double(), expected.double())
+
+
+def test_disabled_sums_are_not_computed(batch):
+    y_hat, y = batch
+    sse, sae, _ = masked_error_sums(y_hat, y, FILL_VALUE, absolute=False)
+    assert sse is not None and sae is None
+    sse, sae, _ = masked_error_sums(y_hat, y, FILL_VALUE, squared=False)
+    assert sse is None and sae is not None
+
+
+def test_loss_gradient_matches_old_masked_mse(batch):
+    y_hat, y = batch
+    y_hat_old = y_hat.clone().requires_grad_()
+    y_hat_new = y_hat.clone().requires_grad_()
+    old_masked_mse(y_hat_old, y, FILL_VALUE).backward()
+    MaskedMSELoss(FILL_VALUE)(y_hat_new, y).backward()
+    torch.testing.assert_close(y_hat_new.grad, y_hat_old.grad)
@@ -0,0 +1,60 @@
+import pytest
+
+np = pytest.importorskip('numpy')
+statistics = pytest.importorskip('iriscc.statistics')
+Moments = statistics.Moments
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(0)
+    values = rng.normal(280., 5., size=(200, 3, 4))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    values[:, 0, 0] = np.nan # a pixel without any valid value
+    return values
+
+
+def reference(values):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (np.sum(~np.isnan(values), axis=0), np.nanmean(values, axis=0), np.nanvar(values, axis=0),
+                np.nanmin(values, axis=0), np.nanmax(values, axis=0))
+
+
+def check(moments, values):
+    n, mean, var, vmin, vmax = reference(values)
+    valid = n > 0
+    np.testing.assert_array_equal(moments.n, n)
+    np.testing.assert_allclose(moments.mean[valid], mean[valid], rtol=1e-12)
+    np.testing.assert_allclose(moments.var[valid], var[valid], rtol=1e-10)
+    np.testing.assert_array_equal(moments.min[valid], vmin[valid])
+    np.testing.assert_array_equal(moments.max[valid], vmax[valid])
+    assert np.isnan(moments.min[~valid]).all() and np.isnan(moments.max[~valid]).all()
+
+
+def test_single_update_matches_numpy(values):
+    check(Moments().update(values), values)
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 64])
+def test_chunked_updates_match_numpy(values, chunk_size):
+    moments = Moments()
+    for start in range(0, len(values), chunk_size):
+        moments.update(values[start:start + chunk_size])
+    check(moments, values)
+
+
+def test_merge_is_order_independent(values):
+    chunks = [Moments().update(values[start:start + 30]) for start in range(0, len(values), 30)]
+    forward, backward = Moments(), Moments()
+    for chunk in chunks:
+        forward.merge(chunk)
+    for chunk in reversed(chunks):
+        backward.merge(chunk)
+    check(forward, values)
+    check(backward, values)
+
+
+def test_merge_with_empty_accumulator(values):
+    moments = Moments().update(values)
+    check(moments.merge(Moments()), values)
+    check(Moments().merge(moments), values)